@@ -3,28 +3,101 @@ import boto3
 import subprocess
 import numpy as np
 import time
-import datetime
-import paramiko
+import uuid
 import io
+import math
 from scp import SCPClient, SCPException
-import sys
-from ast import literal_eval
-from files.file_helper import fetch_local_files
-
-np.set_printoptions(threshold=sys.maxsize)
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+import asyncio
+from driver.assembler import ResultAssembler
+from driver.async_driver import AsyncJobDriver
+from driver.expression import DistributedMatrix, zero_tasks
+from driver.jobs import JobHandle, JobRouter
+from driver.planner import plan_blocks
+from driver.speculation import StragglerMonitor
+from driver.ssh_pool import SSHSessionManager
+from driver.tracing import STAGES as TRACE_STAGES, JobTrace, task_meta
+from files.matrix_store import BlockGrid, generate_matrix, save_matrix
+from files.worker_bundle import REMOTE_BUNDLE, REMOTE_MANIFEST, build_worker_bundle, remote_install_command
+from worker import codec, helper, sparse
+from worker import queue_helper as qh
+from worker.block_store import BlockStore
+from worker.cache import BlockCache, block_digest, task_key
+
+
+# queues used when every worker pulls from the same task queue
+SHARED_QUEUE_NAME = 'queue-shared'
+SHARED_RESULT_QUEUE_NAME = 'result-queue-shared'
+# longest time initialise_instances waits for the instances to be bootstrapped
+BOOTSTRAP_DEADLINE_SECONDS = 900
+# wheels vendored into the worker bundle when present, see files.worker_bundle.download_wheels
+WORKER_WHEELS_DIR = './build/wheels'
 
 
 class CloudComputingApp:
-    def __init__(self, instance_size):
+    def __init__(self, instance_size, scheduling='static', backend=None, compression=None, narrow=False,
+                 sparse=False, cache_dir=None, cache_bytes=1 << 30, worker_cache_bytes=None, speculate_percentile=90,
+                 worker_store_bytes=None):
         """
         Initialize the class
         :param instance_size: number of instances to launch
-        """
+        :param scheduling: 'static' to pre-split the tasks across one queue per instance, 'shared' to let every worker
+        pull from a single task queue so the work follows each worker's real speed
+        :param backend: optional Backend providing the queues and launching the workers, EC2 and SQS are used when not
+        given
+        :param compression: compression of the task and result payloads, None, 'zlib', 'lzma' or 'auto' to choose per
+        message by size
+        :param narrow: send integer blocks as the smallest integer dtype holding their values
+        :param sparse: send blocks as CSR when that is at most half their dense size, the workers then run the sparse
+        kernels
+        :param cache_dir: optional directory of a BlockCache of the block results on the driver, tasks whose result is
+        cached are not sent
+        :param cache_bytes: size bound of the driver cache
+        :param worker_cache_bytes: size bound of a BlockCache kept by every worker, no worker cache when not given
+        :param speculate_percentile: once this percentage of the sent tasks has completed, re-enqueue the tasks still
+        outstanding a while later, see StragglerMonitor. None never re-enqueues.
+        :param worker_store_bytes: size bound of a BlockStore of input blocks kept by every worker. Multiplication tasks
+        then carry only the blocks their worker does not hold yet and refer to the others by key. Needs static
+        scheduling, the driver mirrors the store of the one worker reading each queue.
+        """
+        assert scheduling in ('static', 'shared'), f"Unknown scheduling mode {scheduling}"
+        if worker_store_bytes and scheduling == 'shared':
+            # any of the workers sharing the queue takes a task, mostly not the one holding the blocks it refers to
+            raise ValueError("Worker block stores need static scheduling, every shared queue task would miss them")
         self.INSTANCE_SIZE = instance_size
-        self.sqs = boto3.resource('sqs', region_name='us-east-1')
+        self.SCHEDULING = scheduling
+        self.SENDER_THREADS = 8
+        # the workers encode their results with the codec options the tasks carry
+        self.CODEC_OPTIONS = {'compression': compression, 'narrow': narrow, 'sparse': sparse}
+        self.cache = BlockCache(cache_dir, cache_bytes) if cache_dir else None
+        self.WORKER_CACHE_BYTES = worker_cache_bytes
+        self.WORKER_STORE_BYTES = worker_store_bytes
+        # mirror of the BlockStore of the worker reading each task queue
+        self.block_residency = {}
+        # StragglerMonitor options, no speculative re-execution without a percentile
+        self.SPECULATION_OPTIONS = {'percentile': speculate_percentile, 'delay_factor': 1.5, 'min_delay': 5}
+        self.backend = backend
+        self.ssh_sessions = None
+        self.instance_addresses = []
+        # ResultAssembler and JobTrace of the last merge_queue_result, for its progress and timings
+        self.last_assembler = None
+        self.last_trace = None
+        # tasks sent, skipped and found in the cache by the last compute_matrix_operation, for merge_queue_result
+        self.last_job = None
+        # ids of the jobs whose results are still merged, results of any other job are left over and deleted
+        self.open_jobs = set()
+        # routes the results of the jobs started with submit
+        self.jobs = JobRouter(self)
+        self._submit_lock = threading.Lock()
         self.ec2 = boto3.client('ec2', region_name='us-east-1')
         self.ec2_resource = boto3.resource('ec2', region_name='us-east-1')
-        self.sqs_client = boto3.client('sqs')
+        if backend is not None:
+            self.sqs = backend.sqs
+            self.sqs_client = backend.sqs_client
+        else:
+            self.sqs = boto3.resource('sqs', region_name='us-east-1')
+            self.sqs_client = boto3.client('sqs')
 
     def get_default_security_group(self, client, key_name):
         """
@@ -129,43 +202,22 @@ class CloudComputingApp:
 
     def configure_ssh(self):
         """
-        Configure ssh connection.
-        :return: ssh object
+        Configure ssh connection. The session manager is created once and keeps one open session per instance.
+        :return: SSHSessionManager
         """
-
-        sshs = []
-        for count in range(self.INSTANCE_SIZE):
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            sshs.append(ssh)
-        return sshs
+        if self.ssh_sessions is None:
+            self.ssh_sessions = SSHSessionManager()
+        return self.ssh_sessions
 
     def ssh_connect_with_retry(self, ssh, ip_address, retries):
         """
-        Connect to ssh with retries
+        Connect to ssh with retries, waiting a jittered exponential backoff between attempts
         :param ssh: ssh object
         :param ip_address: ip address of the instance
-        :param retries: number of retries to attempt connection
+        :param retries: number of retries already attempted, at most 4 attempts are made in total
         :return: Boolean. True if connection is successful, False otherwise
         """
-        if retries > 3:
-            return False
-        # read the private key
-        f = open('labsuser.pem', 'r')
-        private_key = paramiko.RSAKey.from_private_key(f)
-
-        interval = 5
-        try:
-            retries += 1
-            print('SSH into the instance: {}'.format(ip_address))
-            ssh.connect(hostname=ip_address,
-                        username='ec2-user', pkey=private_key)
-            return True
-        except Exception as e:
-            print(e)
-            time.sleep(interval)
-            print('Retrying SSH connection to {}'.format(ip_address))
-            self.ssh_connect_with_retry(ssh, ip_address, retries)
+        return self.configure_ssh().connect_client(ssh, ip_address, max_attempts=max(4 - retries, 0))
 
     def ssh_disconnect(self, ssh):
         """
@@ -175,6 +227,22 @@ class CloudComputingApp:
         if ssh:
             ssh.close()
 
+    def run_on_instances(self, command):
+        """
+        Run a command on every instance over the sessions kept open since bootstrap
+        :param command: shell command
+        :return: dict of ip address to (exit status, stdout, stderr), or to the exception raised
+        """
+        return self.configure_ssh().exec_all(self.instance_addresses, command)
+
+    def tail_worker_logs(self, lines=20):
+        """
+        Get the last lines of the worker log of every instance
+        :param lines: number of lines
+        :return: dict of ip address to (exit status, stdout, stderr), or to the exception raised
+        """
+        return self.run_on_instances(f"tail -n {lines} worker.log")
+
     def get_public_address(self, ec2, instance_id):
         """
         Get public address of the instance
@@ -198,23 +266,39 @@ class CloudComputingApp:
         attributes = {
             'DelaySeconds': '0',
             'MessageRetentionPeriod': '86400',
-            "ReceiveMessageWaitTimeSeconds": "0"
+            "ReceiveMessageWaitTimeSeconds": f"{qh.LONG_POLL_SECONDS}"
         }
-        queue_name = 'queue'
-
-        for idx in range(self.INSTANCE_SIZE):
-            # create a computation queue for each instance
+        for queue_name, result_queue_name in self.get_queue_names():
+            # create a computation queue for each instance, or a single one shared by all the instances
             sqs.create_queue(
-                QueueName=f"{queue_name}{idx}",
+                QueueName=queue_name,
                 Attributes=attributes
             )
 
-            # create a result queue for each instance
+            # create the matching result queue
             sqs.create_queue(
-                QueueName=f'result-{queue_name}-{idx}',
+                QueueName=result_queue_name,
                 Attributes=attributes
             )
 
+    def get_queue_names(self):
+        """
+        Get the names of the task and result queues used by the scheduling mode
+        :return: list of (task queue name, result queue name)
+        """
+        if self.SCHEDULING == 'shared':
+            return [(SHARED_QUEUE_NAME, SHARED_RESULT_QUEUE_NAME)]
+        return [(f'queue{idx}', f'result-queue-{idx}') for idx in range(self.INSTANCE_SIZE)]
+
+    def get_worker_queue_names(self, worker_id):
+        """
+        Get the task and result queue names a worker should use
+        :param worker_id: index of the worker
+        :return: tuple of (task queue name, result queue name)
+        """
+        queue_names = self.get_queue_names()
+        return queue_names[worker_id % len(queue_names)]
+
     def send_message_to_queue(self, sqs, queue_name, message):
         """
         Send message to queue
@@ -223,23 +307,53 @@ class CloudComputingApp:
         :param message: message to send
         :return: message id
         """
-        # get the queue
-        queue = sqs.get_queue_by_name(QueueName=queue_name)
+        # get the queue, the handle is cached after the first lookup
+        queue = qh.get_queue(sqs, queue_name)
         # Send message to SQS queue
         response = queue.send_messages(
             Entries=message
         )
         return response
 
-    def install_required_packages(self, ssh):
+    def install_required_packages(self, ssh, bundle=None):
         """
         Install required packages on the instance
         :param ssh: ssh client with connection to the instance
+        :param bundle: optional uploaded WorkerBundle, its vendored wheels are installed offline when it has any
         :return: tuple of (stdout {result of successful completion}, stderr {error message})
         """
-        stdin, stdout, stderr = ssh.exec_command("sudo yum install pip -y && sudo pip install numpy boto3")
+        if bundle is not None:
+            stdin, stdout, stderr = ssh.exec_command(remote_install_command(bundle))
+        else:
+            stdin, stdout, stderr = ssh.exec_command("sudo yum install pip -y && sudo pip install numpy boto3")
         return stdout, stderr
 
+    def deploy_worker_bundle(self, ssh, ip_address, bundle):
+        """
+        Upload the worker bundle and install its requirements, unless the manifest on the instance shows the same
+        bundle is already deployed
+        :param ssh: ssh client with connection to the instance
+        :param ip_address: ip address of the instance
+        :param bundle: WorkerBundle to deploy
+        :return: True if the bundle was deployed, False if the instance already had it
+        """
+        stdin, stdout, stderr = ssh.exec_command(f"cat {REMOTE_MANIFEST} 2>/dev/null")
+        if stdout.read().decode('utf-8').strip() == bundle.sha256:
+            print(f"Worker bundle {bundle.sha256[:12]} already deployed on {ip_address}")
+            return False
+
+        self.bulk_upload(SCPClient(ssh.get_transport()), [bundle.path], f'~/{REMOTE_BUNDLE}', ip_address)
+        stdout, stderr = self.install_required_packages(ssh, bundle)
+        print(stdout.read().decode('utf-8'))
+        print(stderr.read().decode('utf-8'))
+        if stdout.channel.recv_exit_status() != 0:
+            raise RuntimeError(f"Installing the worker requirements failed on {ip_address}")
+        # only record the bundle once it is fully installed
+        if ssh.exec_command(f"echo {bundle.sha256} > {REMOTE_MANIFEST}")[1].channel.recv_exit_status() != 0:
+            raise RuntimeError(f"Recording the worker bundle failed on {ip_address}")
+        print(f"Worker bundle {bundle.sha256[:12]} deployed on {ip_address}")
+        return True
+
     def start_worker(self, ssh, instance_id):
         """
         Start worker on the instance
@@ -247,86 +361,172 @@ class CloudComputingApp:
         :param instance_id: instance id
         :return: tuple of (stdout {result of successful completion}, stderr {error message})
         """
-        stdin, stdout, stderr = ssh.exec_command(f"nohup python3 worker.py {instance_id} > worker.log 2>&1 &")
+        if self.backend is not None:
+            return self.backend.start_worker(self, instance_id)
+        queue_name, result_queue_name = self.get_worker_queue_names(instance_id)
+        cache_bytes = f" {self.WORKER_CACHE_BYTES}" if self.WORKER_CACHE_BYTES else ""
+        if self.WORKER_STORE_BYTES:
+            cache_bytes = f" {self.WORKER_CACHE_BYTES or 0} {self.WORKER_STORE_BYTES}"
+        # stop a worker left over from a previous bring-up and wait for it before starting the new one. The command
+        # line of a shell running both would match the pattern, and the bracket keeps the pattern from matching the
+        # shell running the pkill.
+        ssh.exec_command(f"pkill -f '[{REMOTE_BUNDLE[0]}]{REMOTE_BUNDLE[1:]}'")[1].channel.recv_exit_status()
+        stdin, stdout, stderr = ssh.exec_command(
+            f"nohup python3 {REMOTE_BUNDLE} {instance_id} {queue_name} {result_queue_name}{cache_bytes} "
+            f"> worker.log 2>&1 &")
         print(f"Worker {instance_id} started")
         return stdout, stderr
 
-    def initialise_instances(self, client):
+    def bootstrap_instance(self, idx, sessions, ip_address, bundle):
+        """
+        Bootstrap one instance: connect, deploy the worker bundle, push the AWS configuration and start the worker
+        :param idx: index of the instance
+        :param sessions: SSHSessionManager holding the session to the instance
+        :param ip_address: public IP address of the instance
+        :param bundle: WorkerBundle to deploy
+        :return: dict of stage name to seconds spent in the stage
+        """
+        timings = {}
+
+        def run_stage(stage, function, *args):
+            start_time = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                timings[stage] = time.perf_counter() - start_time
+
+        # connect to ssh
+        print(f"Conencting to Instance-{idx} with IP Address {ip_address}")
+        ssh = run_stage('connect', sessions.connect, ip_address)
+
+        # upload the worker and install required python packages, skipped when the instance is up to date
+        print(f"Deploying worker to Instance-{idx} with IP Address {ip_address}")
+        run_stage('deploy', self.deploy_worker_bundle, ssh, ip_address, bundle)
+
+        # configure aws access to the instance
+        print(f"Configuring Instance -{idx} with IP Address {ip_address} for remote access")
+        run_stage('configure', self.configure_aws_access_for_ssh, ssh, ip_address)
+
+        # start worker on the instance
+        print(f"Starting worker {idx}")
+        run_stage('start', self.start_worker, ssh, idx)
+        return timings
+
+    def initialise_instances(self, client, deadline=BOOTSTRAP_DEADLINE_SECONDS, running=()):
         """
-        Initialise instances by installing required packages
+        Initialise instances by installing required packages. Every instance is bootstrapped concurrently, a failing
+        instance does not stop the others.
         :param client: ec2 client
+        :param deadline: seconds to wait for all the instances to be bootstrapped
+        :param running: IP addresses of instances whose worker is already running, they are not bootstrapped again
+        :return: dict of instance index to {'ip_address', 'timings', 'error'}
         """
+        if self.backend is not None:
+            return self.backend.initialise_instances(self)
         print('Preparing SSH connection')
-        sshs = self.configure_ssh()
+        sessions = self.configure_ssh()
         print('Getting keypairs')
         keypair = self.get_key_pairs(client, 'airscholar-key', False)
         print('Preparing instances')
         ec2, instances = self.prepare_instances(client, keypair['KeyName'], self.INSTANCE_SIZE)
+        print('Building worker bundle')
+        bundle = build_worker_bundle('./worker', './build',
+                                     WORKER_WHEELS_DIR if os.path.isdir(WORKER_WHEELS_DIR) else None)
         print('Getting public addresses')
         print(instances)
-        ip_addresses = [self.get_public_address(ec2, instance) for instance in instances]
-        print(list(ip_addresses))
-        # connect to each instance and install required packages
-        for idx in range(0, len(sshs)):
-            ssh = sshs[idx]
-            ip_address = ip_addresses[idx]
-            # connect to ssh
-            print(f"Conencting to Instance-{idx} with IP Address {ip_address}")
-            self.ssh_connect_with_retry(ssh, ip_address, 0)
-            # install required python packages
-            print(f"Installing required packages for Instance-{idx} with IP Address {ip_address}")
-            stdout, stderr = self.install_required_packages(ssh)
-            print(stdout.read().decode('utf-8'))
-            print(stderr.read().decode('utf-8'))
-
-            # configure aws access to the instance
-            print(f"Configuring Instance -{idx} with IP Address {ip_address} for remote access")
-            self.configure_aws_access_for_ssh(ssh, ip_address)
-
-            # upload worker file to the instance
-            scp = SCPClient(ssh.get_transport())
-            self.bulk_upload(scp, fetch_local_files('./worker'), '~', ip_address)
-
-            # start worker on the instance
-            print(f"Starting worker {idx}")
-            self.start_worker(ssh, idx)
-            # stdin, stdout, stderr = ssh.exec_command(f'python ./worker.py {idx}', get_pty=True)
-            # only for debugging purposes. This prints the output of the worker non-stop.
-            # print(stdout.read().decode('utf-8'))
-            # print(stderr.read().decode('utf-8'))
-
-    def get_messages_from_queue(self, queue, message_size=10):
+
+        executor = ThreadPoolExecutor(max_workers=max(len(instances), 1))
+        try:
+            ip_addresses = list(executor.map(lambda instance: self.get_public_address(ec2, instance), instances))
+            print(ip_addresses)
+            # connect to each instance and install required packages, all instances at once
+            self.instance_addresses = ip_addresses[:self.INSTANCE_SIZE]
+            futures = {executor.submit(self.bootstrap_instance, idx, sessions, ip_address, bundle): idx
+                       for idx, ip_address in enumerate(self.instance_addresses) if ip_address not in running}
+            done, not_done = wait(futures, timeout=deadline)
+        finally:
+            # do not wait for instances still bootstrapping past the deadline
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        report = {}
+        for future, idx in futures.items():
+            report[idx] = {'ip_address': ip_addresses[idx], 'timings': None, 'error': None}
+            if future in not_done:
+                report[idx]['error'] = TimeoutError(f"Instance-{idx} was not ready after {deadline} seconds")
+            elif future.exception() is not None:
+                report[idx]['error'] = future.exception()
+            else:
+                report[idx]['timings'] = future.result()
+
+        for idx, status in sorted(report.items()):
+            if status['error'] is not None:
+                print(f"Instance-{idx} with IP Address {status['ip_address']} failed: {status['error']}")
+            else:
+                stages = ', '.join(f"{stage} {seconds:.1f}s" for stage, seconds in status['timings'].items())
+                print(f"Instance-{idx} with IP Address {status['ip_address']} ready: {stages}")
+        return report
+
+    def get_messages_from_queue(self, queue, message_size=10, wait_time=qh.LONG_POLL_SECONDS, job_ids=None):
         """
         Get messages from queue
-        :param instance_size: number of instances
         :param queue: queue name
         :param message_size: number of messages to get
-        :return: list of messages
+        :param wait_time: seconds to long-poll for when the queue is empty
+        :param job_ids: optional ids of the jobs the caller merges. Results of the other open jobs are made visible
+        again for the caller merging them, results of closed jobs are deleted.
+        :return: list of decoded messages
         """
-        messages = []
-        sqs = boto3.resource('sqs')
-        queue = sqs.get_queue_by_name(QueueName=queue)
+        queue = qh.get_queue(self.sqs, queue)
 
         # get messages from the queue
-        for message in queue.receive_messages(MaxNumberOfMessages=message_size, MessageAttributeNames=['All'],
-                                              WaitTimeSeconds=0):
-            messages.append(eval(message.body))
-            message.delete()
-        return messages
-
-    def split_row(self, array, nrows, ncols):
+        received = qh.receive_messages(queue, message_size, wait_time)
+        messages = [codec.decode_body(message.body) for message in received]
+        if job_ids is None:
+            qh.delete_messages(queue, received)
+            return messages
+
+        kept, released = [], []
+        for raw, message in zip(received, messages):
+            job_id = message.meta.get('job')
+            if job_id is not None and job_id not in job_ids and job_id in self.open_jobs:
+                released.append(raw)
+            else:
+                kept.append((raw, message))
+        qh.change_visibility(queue, released, 0)
+        qh.delete_messages(queue, [raw for raw, _ in kept])
+        return [message for _, message in kept]
+
+    def split_row(self, array, nrows, ncols, ragged=False):
         """
         Split array into sub-arrays
         :param array: array to split
         :param nrows: number of rows
         :param ncols: number of columns
+        :param ragged: allow a block size that does not divide the array, the last block row and column are smaller
+        :return: BlockGrid of views over the array, in row-major block order
         """
         height, width = array.shape
-        assert height % nrows == 0, f"{height} rows is not evenly divisible by {nrows}"
-        assert width % ncols == 0, f"{width} cols is not evenly divisible by {ncols}"
-        return (array.reshape(height // nrows, nrows, -1, ncols)
-                .swapaxes(1, 2)
-                .reshape(-1, nrows, ncols))
+        if not ragged:
+            assert height % nrows == 0, f"{height} rows is not evenly divisible by {nrows}"
+            assert width % ncols == 0, f"{width} cols is not evenly divisible by {ncols}"
+        return BlockGrid(array, (nrows, ncols))
+
+    def plan_block_size(self, operation, shape_a, shape_b, dtype, cost_model=None, max_value=None):
+        """
+        Pick the block size with the smallest predicted makespan on the workers of the app, within the message limit
+        :param operation: 'addition' or 'multiplication'
+        :param shape_a: shape of the first matrix
+        :param shape_b: shape of the second matrix
+        :param dtype: dtype of the matrices
+        :param cost_model: measured CostModel, the defaults are used when not given
+        :param max_value: largest absolute value of the matrices, the full range of an integer dtype when not given
+        :return: BlockPlan, split with split_row(array, plan.block_size, plan.block_size, ragged=True)
+        """
+        plan = plan_blocks(operation, shape_a, shape_b, dtype, self.INSTANCE_SIZE, cost_model,
+                           result_queues=len(self.get_queue_names()), max_value=max_value)
+        print(f"Block size {plan.block_size}: {plan.tasks} tasks of up to {plan.message_bytes} bytes, "
+              f"predicted makespan {plan.makespan:.1f}s")
+        return plan
 
     def split_col(self, array, split_size):
         """
@@ -339,16 +539,21 @@ class CloudComputingApp:
         r, h = array.shape
         return [np.vsplit(i, split_size) for i in np.hsplit(array, r)]
 
-    def generate_array(self, nrows, ncols, max_value=10):
+    def generate_array(self, nrows, ncols, max_value=10, filename=None, density=None):
         """
         Generate a random array of size nrows x ncols with values between 0 and max_value
-        :return:
         :param nrows: number of rows
         :param ncols: number of columns
         :param max_value: max value of the array element
-        :return: generated array
+        :param filename: optional .npy file to generate the array into, chunk by chunk, for arrays larger than RAM
+        :param density: optional fraction of the elements drawn, the others are zero
+        :return: generated array, memory-mapped when a filename is given
         """
+        if filename is not None:
+            return generate_matrix(filename, nrows, ncols, max_value, density=density)
         arr = np.random.randint(max_value, size=(nrows, ncols))
+        if density is not None:
+            arr[np.random.random_sample(arr.shape) >= density] = 0
 
         return arr
 
@@ -356,14 +561,17 @@ class CloudComputingApp:
         """
         Upload multiple files to a remote directory.
         :param List[str] filepaths: List of local files to be uploaded.
+        :raises Exception: the error of a failed upload, after printing it
         """
         try:
             scp.put(filepaths, remote_path=remote_path, recursive=True)
             print(f"Finished uploading {len(filepaths)} files to {remote_path} on {host}")
         except SCPException as e:
             print(f"SCPException during bulk upload: {e}")
+            raise
         except Exception as e:
             print(f"Unexpected exception during bulk upload: {e}")
+            raise
 
     def configure_aws_access_for_ssh(self, ssh, ip_address):
         """
@@ -383,19 +591,7 @@ class CloudComputingApp:
         :param matrix_b: matrix b
         :return: dot product of matrix a and matrix b
         """
-        start_time = datetime.datetime.now()
-        result = []
-        for i in range(len(matrix_a)):
-            row = []
-            for j in range(len(matrix_b[0])):
-                sum = 0
-                for k in range(len(matrix_b)):
-                    sum += matrix_a[i][k] * matrix_b[k][j]
-                row.append(sum)
-            result.append(row)
-        print('Computation time', datetime.datetime.now() - start_time)
-
-        return result
+        return helper.matrix_dot_product(matrix_a, matrix_b)
 
     def matrix_add(self, matrix_1, matrix_2):
         """
@@ -404,17 +600,7 @@ class CloudComputingApp:
         :param matrix_2: matrix 2
         :return: sum of matrix 1 and matrix 2
         """
-        start_time = datetime.datetime.now()
-        result = []
-        for idx_row in range(0, len(matrix_1)):
-            row = matrix_1[idx_row]
-            row1 = matrix_2[idx_row]
-            cols = []
-            for idx_col in range(0, len(row)):
-                cols.append(row[idx_col] + row1[idx_col])
-            result.append(cols)
-        print('Computation time', datetime.datetime.now() - start_time)
-        return result
+        return helper.matrix_add(matrix_1, matrix_2)
 
     def delete_queues(self):
         """
@@ -426,9 +612,10 @@ class CloudComputingApp:
             MaxResults=123)
 
         # delete all the queues
-        for queue in response['QueueUrls']:
+        for queue in response.get('QueueUrls', []):
             client.delete_queue(QueueUrl=queue)
             print(f'{queue} deleted!')
+        qh.forget_queues(self.sqs)
 
     def reformat_data(self, data):
         """
@@ -438,65 +625,629 @@ class CloudComputingApp:
         """
         return str(data).replace('\n', '')
 
-    def compute_matrix_operation(self, operation, split_array1, split_array2):
+    def get_block_grid(self, split_array, grid_shape=None):
         """
-        This function computes the matrix operation
+        This function returns the shape of the block grid a split array was cut into
+        :param split_array: split array as returned by split_row
+        :param grid_shape: explicit (block rows, block columns), taken from the split array when it knows its grid and
+        inferred as a square grid otherwise
+        :return: tuple of (block rows, block columns)
+        """
+        grid_shape = grid_shape or getattr(split_array, 'grid_shape', None)
+        if grid_shape is not None:
+            grid_rows, grid_cols = grid_shape
+            assert grid_rows * grid_cols == len(split_array), f"{len(split_array)} blocks do not fill a {grid_shape} grid"
+            return grid_rows, grid_cols
+
+        size = math.isqrt(len(split_array))
+        assert size * size == len(split_array), f"{len(split_array)} blocks do not form a square grid, pass grid_shape"
+        return size, size
+
+    def get_tasks(self, operation, split_array1, split_array2, grid_shape1=None, grid_shape2=None):
+        """
+        This function lists the block tasks of an operation. Addition pairs the blocks with the same index. Multiplication
+        pairs every block (i, k) of the first matrix with every block (k, j) of the second matrix, the partial products
+        are summed per output tile (i, j) when the results are merged.
         :param operation: operation to be performed
         :param split_array1: split array 1
         :param split_array2: split array 2
-        :return: result of the operation
+        :param grid_shape1: block grid of split array 1
+        :param grid_shape2: block grid of split array 2
+        :return: list of (block coordinates, index in split array 1, index in split array 2)
         """
         if operation == 'addition':
-            for queue_id, dt in enumerate(np.array_split(np.arange(0, len(split_array1)), self.INSTANCE_SIZE)):
-                print(f'Processing Queue {queue_id} with {len(dt)} tasks')
-                # send the data to the server
-                [self.send_message_to_queue(self.sqs, f'queue{queue_id}',
-                                            [{"Id": f"{idx + 1}", "MessageBody": str((operation, (idx, (
-                                                self.reformat_data(split_array1[idx]),
-                                                self.reformat_data(split_array2[idx])))))}])
-                 for idx in range(min(dt), max(dt) + 1) if len(dt) > 0]
+            assert len(split_array1) == len(split_array2), "Both matrices must be split into the same number of blocks"
+            return [((idx,), idx, idx) for idx in range(len(split_array1))]
         elif operation == 'multiplication':
-            for queue_id, dt in enumerate(np.array_split(np.arange(0, len(split_array1)), self.INSTANCE_SIZE)):
-                [print(f'queue{queue_id}', split_array1[idx], split_array2[idx]) for idx in range(min(dt), max(dt) + 1)
-                 if
-                 len(dt) > 0]
+            grid_rows, grid_inner = self.get_block_grid(split_array1, grid_shape1)
+            grid_inner2, grid_cols = self.get_block_grid(split_array2, grid_shape2)
+            assert grid_inner == grid_inner2, f"Block grids {grid_rows}x{grid_inner} and {grid_inner2}x{grid_cols} " \
+                                              f"are not compatible"
+            # k varies fastest so the partial products of one output tile land on the same queue
+            return [((i, j, k), i * grid_inner + k, k * grid_cols + j)
+                    for i in range(grid_rows) for j in range(grid_cols) for k in range(grid_inner)]
+        raise ValueError(f"Unknown operation {operation}")
+
+    def get_task_partitions(self, task_count):
+        """
+        This function splits the task indices evenly across the task queues
+        :param task_count: number of tasks
+        :return: list of arrays of task indices, one per queue
+        """
+        return np.array_split(np.arange(0, task_count), len(self.get_queue_names()))
 
-    def merge_queue_result(self, split_array, array_size, chunk_size):
+    def get_task_entry(self, operation, task_id, task, split_array1, split_array2, cache_key=None, job_id=None,
+                       residency=None, block_keys=None):
+        """
+        This function encodes a task as a send_messages entry
+        :param operation: operation to be performed
+        :param task_id: index of the task in the job
+        :param task: tuple of (block coordinates, index in split array 1, index in split array 2)
+        :param split_array1: split array 1
+        :param split_array2: split array 2
+        :param cache_key: optional cache key of the task, echoed in the result meta for the driver and worker caches
+        :param job_id: optional id of the job, echoed in the result meta so the results of concurrent jobs are told apart
+        :param residency: optional mirror of the BlockStore of the worker the task is sent to
+        :param block_keys: keys of the input blocks in the block store, used with residency
+        :return: send_messages entry
+        """
+        coords, idx_a, idx_b = task
+        meta = dict(task_meta(int(task_id), time.time()), codec=self.CODEC_OPTIONS)
+        if cache_key is not None:
+            meta['cache_key'] = cache_key
+        if job_id is not None:
+            meta['job'] = job_id
+        blocks = [split_array1[idx_a], split_array2[idx_b]]
+        if residency is not None:
+            blocks = self.get_carried_blocks(blocks, block_keys, residency, meta)
+        return {"Id": f"{task_id + 1}",
+                "MessageBody": codec.encode_body(operation, coords, blocks, meta, **self.CODEC_OPTIONS)}
+
+    def get_fused_task_entry(self, task_id, task, grids, job_id=None, residency=None, block_keys=None):
+        """
+        This function encodes a task of a fused pass as a send_messages entry, its program travels in the meta
+        :param task_id: index of the task in the job
+        :param task: tuple of (block coordinates, list of (index in grids, block index), program)
+        :param grids: BlockGrid of every matrix the pass reads blocks from
+        :param job_id: optional id of the job, echoed in the result meta
+        :param residency: optional mirror of the BlockStore of the worker the task is sent to
+        :param block_keys: keys of the input blocks in the block store, used with residency
+        :return: send_messages entry
+        """
+        coords, refs, program = task
+        meta = dict(task_meta(int(task_id), time.time()), codec=self.CODEC_OPTIONS, program=program)
+        if job_id is not None:
+            meta['job'] = job_id
+        blocks = [grids[grid][idx] for grid, idx in refs]
+        if residency is not None:
+            blocks = self.get_carried_blocks(blocks, block_keys, residency, meta)
+        return {"Id": f"{task_id + 1}",
+                "MessageBody": codec.encode_body('fused', coords, blocks, meta, **self.CODEC_OPTIONS)}
+
+    def get_carried_blocks(self, blocks, block_keys, residency, meta):
+        """
+        This function picks the input blocks a task carries: the blocks its worker holds are referred to by key, the
+        others are carried and recorded as held. The keys and choices go in the meta, see worker resolve_blocks.
+        :param blocks: input blocks of the task
+        :param block_keys: key of every input block
+        :param residency: mirror of the BlockStore of the worker the task is sent to
+        :param meta: task meta, updated
+        :return: list of the blocks to carry
+        """
+        inline = []
+        # the mirror counts the dense bytes of the blocks, at least those the worker stores, so the worker holds every
+        # block the mirror does when the tasks arrive in order
+        for key, block in zip(block_keys, blocks):
+            inline.append(residency.get(key) is None)
+            if inline[-1]:
+                residency.put(key, block)
+        meta.update(block_keys=block_keys, inline=inline)
+        return [block for block, carried in zip(blocks, inline) if carried]
+
+    def get_job_entry(self, job, task_id, queue_name=None):
+        """
+        This function encodes a sent task of a job as a send_messages entry. With worker block stores, the blocks the
+        worker reading the queue holds are referred to by key rather than carried.
+        :param job: job dict
+        :param task_id: index of the task in the sent tasks of the job
+        :param queue_name: task queue the entry is sent to, the task carries all its blocks when not given
+        :return: send_messages entry
+        """
+        task = job['sent'][task_id]
+        if job['operation'] == 'fused':
+            operands = [(job['split_array'][grid], idx) for grid, idx in task[1]]
+        else:
+            operands = [(job['split_array'], task[1]), (job['split_array2'], task[2])]
+        residency, block_keys = None, None
+        # added blocks are each used by a single task, there is nothing to reuse
+        if self.WORKER_STORE_BYTES and queue_name is not None and job['operation'] != 'addition':
+            residency = self.get_block_residency(queue_name)
+            block_keys = self.get_block_keys(job, operands)
+        if job['operation'] == 'fused':
+            return self.get_fused_task_entry(task_id, task, job['split_array'], job['id'], residency, block_keys)
+        return self.get_task_entry(job['operation'], task_id, task, job['split_array'], job['split_array2'],
+                                   job['keys'][task_id], job['id'], residency, block_keys)
+
+    def get_block_residency(self, queue_name):
+        """
+        This function returns the mirror of the BlockStore of the worker reading a task queue
+        :param queue_name: task queue
+        :return: BlockStore holding views of the blocks sent
+        """
+        with self._submit_lock:
+            return self.block_residency.setdefault(queue_name, BlockStore(self.WORKER_STORE_BYTES))
+
+    def get_block_keys(self, job, operands):
+        """
+        This function returns the block store keys of the input blocks of a task, hashing each block once per job
+        :param job: job dict, memoising the keys of its blocks
+        :param operands: list of (split array, block index)
+        :return: list of keys
+        """
+        memo = job.setdefault('block_keys', {})
+        keys = []
+        for split_array, idx in operands:
+            if (id(split_array), idx) not in memo:
+                memo[(id(split_array), idx)] = block_digest(split_array[idx])
+            keys.append(memo[(id(split_array), idx)])
+        return keys
+
+    def get_zero_blocks(self, split_array):
+        """
+        This function flags the blocks holding only zeros
+        :param split_array: split array
+        :return: list of booleans, one per block
+        """
+        return [sparse.is_zero(block) for block in split_array]
+
+    def skip_zero_tasks(self, operation, tasks, split_array1, split_array2):
+        """
+        This function separates the tasks whose result is all zeros: a product with a zero operand block, or a sum of
+        two zero blocks
+        :return: tuple of (tasks to send, coordinates of the skipped tasks)
+        """
+        zero_a = self.get_zero_blocks(split_array1)
+        zero_b = self.get_zero_blocks(split_array2)
+        combine = any if operation == 'multiplication' else all
+        sent, skipped = [], []
+        for task in tasks:
+            coords, idx_a, idx_b = task
+            if combine((zero_a[idx_a], zero_b[idx_b])):
+                skipped.append(coords)
+            else:
+                sent.append(task)
+        return sent, skipped
+
+    def get_cache_keys(self, operation, tasks, split_array1, split_array2):
+        """
+        This function computes the cache key of every task, hashing each block once however many tasks use it
+        :return: list of cache keys, one per task
+        """
+        digests_a, digests_b = {}, {}
+        keys = []
+        for coords, idx_a, idx_b in tasks:
+            if idx_a not in digests_a:
+                digests_a[idx_a] = block_digest(split_array1[idx_a])
+            if idx_b not in digests_b:
+                digests_b[idx_b] = block_digest(split_array2[idx_b])
+            keys.append(task_key(operation, [digests_a[idx_a], digests_b[idx_b]]))
+        return keys
+
+    def take_cached_tasks(self, tasks, keys):
+        """
+        This function separates the tasks whose result is in the driver cache, their keys are pinned until
+        merge_queue_result has read them
+        :return: tuple of (tasks to send, their keys, list of (coordinates, key) of the cached tasks)
+        """
+        sent, sent_keys, cached = [], [], []
+        for task, key in zip(tasks, keys):
+            if key in self.cache:
+                cached.append((task[0], key))
+            else:
+                sent.append(task)
+                sent_keys.append(key)
+        self.cache.pin(key for _, key in cached)
+        return sent, sent_keys, cached
+
+    def prepare_job(self, operation, split_array1, split_array2, grid_shape1=None, grid_shape2=None):
+        """
+        This function lists the tasks of an operation that have to be sent. Tasks whose result is all zeros or already
+        in the driver cache are left out and recorded in last_job, for merge_queue_result to fill them in. The job gets
+        a new id, carried by every message of the job.
+        :param operation: operation to be performed
+        :param split_array1: split array 1
+        :param split_array2: split array 2
+        :param grid_shape1: block grid of split array 1, only used for multiplication
+        :param grid_shape2: block grid of split array 2, only used for multiplication
+        :return: tuple of (tasks to send, their cache keys)
+        """
+        tasks = self.get_tasks(operation, split_array1, split_array2, grid_shape1, grid_shape2)
+        tasks, skipped = self.skip_zero_tasks(operation, tasks, split_array1, split_array2)
+        keys, cached = [None] * len(tasks), []
+        if self.cache is not None or self.WORKER_CACHE_BYTES:
+            keys = self.get_cache_keys(operation, tasks, split_array1, split_array2)
+        if self.cache is not None:
+            tasks, keys, cached = self.take_cached_tasks(tasks, keys)
+        job_id = uuid.uuid4().hex
+        self.open_jobs.add(job_id)
+        self.last_job = {'id': job_id, 'operation': operation, 'split_array': split_array1,
+                         'split_array2': split_array2, 'tasks': len(tasks), 'skipped': skipped, 'cached': cached,
+                         'sent': tasks, 'keys': keys, 'started': time.monotonic()}
+        if skipped:
+            print(f'Skipping {len(skipped)} tasks with all-zero results')
+        if cached:
+            print(f'Reusing {len(cached)} cached results')
+        return tasks, keys
+
+    def compute_matrix_operation(self, operation, split_array1, split_array2, grid_shape1=None, grid_shape2=None):
+        """
+        This function computes the matrix operation. Tasks whose result is all zeros or already in the driver cache are
+        not sent, merge_queue_result fills them in.
+        :param operation: operation to be performed
+        :param split_array1: split array 1
+        :param split_array2: split array 2
+        :param grid_shape1: block grid of split array 1, only used for multiplication
+        :param grid_shape2: block grid of split array 2, only used for multiplication
+        :return: result of the operation
+        """
+        self.prepare_job(operation, split_array1, split_array2, grid_shape1, grid_shape2)
+        self.send_tasks(self.last_job)
+
+    def send_tasks(self, job):
+        """
+        This function sends the tasks of a job prepared by prepare_job
+        :param job: job dict
+        """
+        with qh.BatchSender(self.sqs, max_workers=self.SENDER_THREADS) as sender:
+            queue_names = self.get_queue_names()
+            for queue_id, dt in enumerate(self.get_task_partitions(len(job['sent']))):
+                queue_name = queue_names[queue_id][0]
+                print(f'Processing {queue_name} with {len(dt)} tasks')
+                # send the data to the server, batches are encoded lazily as the sender pool drains
+                sender.send(queue_name, (self.get_job_entry(job, task_id, queue_name) for task_id in dt))
+            print(f'Sent {sender.flush()} tasks')
+
+    def drain_result_queue(self, assembler, result_queue_name, expected, abort, trace=None, job_id=None):
+        """
+        This function writes the results of a result queue into the assembler as they arrive
+        :param assembler: ResultAssembler receiving the blocks
+        :param result_queue_name: result queue name
+        :param expected: number of distinct results expected on this queue
+        :param abort: threading.Event set when the merge has failed and draining should stop
+        :param trace: optional JobTrace collecting the timings of the results
+        :param job_id: optional id of the job, results of other open jobs are left on the queue
+        """
+        received = 0
+        job_ids = {job_id} if job_id is not None else None
+        while received < expected and not abort.is_set():
+            messages = self.get_messages_from_queue(result_queue_name, job_ids=job_ids)
+            received_at = time.time()
+            received += sum(self.add_result(assembler, msg, received_at, trace, job_id) for msg in messages)
+        print(f"Received {received} results from {result_queue_name}, {assembler.progress:.0%} of the job done")
+
+    def add_result(self, assembler, message, received_at, trace=None, job_id=None):
+        """
+        This function writes a result message into the assembler, records its timings and adds it to the driver cache
+        :param assembler: ResultAssembler receiving the blocks
+        :param message: decoded result message
+        :param received_at: wall clock time the message was received at
+        :param trace: optional JobTrace collecting the timings of the results
+        :param job_id: optional id of the job, a result of another job, e.g. left over from a closed one, is dropped
+        :return: True if the result was new, False if it was a duplicate or belongs to another job
+        """
+        if job_id is not None and message.meta.get('job', job_id) != job_id:
+            return False
+        if message.operation == 'missing':
+            self.resend_missing_blocks(message, job_id)
+            return False
+        if not assembler.add(message):
+            return False
+        if trace is not None:
+            trace.record(message.meta, received_at)
+        if self.cache is not None and 'cache_key' in message.meta:
+            self.cache.put(message.meta['cache_key'], message.blocks[0])
+        return True
+
+    def resend_missing_blocks(self, message, job_id=None):
+        """
+        This function sends again, with all its blocks, a task whose worker did not hold a block the task referred to.
+        It goes to the queue it was first sent to, so its result comes back on the result queue counting it.
+        :param message: 'missing' reply of the worker, echoing the task meta
+        :param job_id: id of the job, the last job by default
+        """
+        job = self.find_job(job_id)
+        if job is None:
+            return
+        task_id = message.meta['task']
+        queue_name = self.get_queue_names()[
+            next(idx for idx, dt in enumerate(self.get_task_partitions(len(job['sent']))) if task_id in dt)][0]
+        # the worker lost the blocks, e.g. when it restarted, later tasks carry them again
+        residency = self.block_residency.get(queue_name)
+        if residency is not None:
+            for key, inline in zip(message.meta['block_keys'], message.meta['inline']):
+                if not inline:
+                    residency.discard(key)
+        qh.send_message_to_queue(self.sqs, queue_name, [self.get_job_entry(job, task_id)])
+
+    def find_job(self, job_id=None):
+        """
+        This function finds a job in flight by id
+        :param job_id: id of the job, the last job when not given
+        :return: job dict, or None when the job is no longer in flight
+        """
+        job = self.last_job
+        if job_id is None or (job is not None and job['id'] == job_id):
+            return job
+        handle = self.jobs.get(job_id)
+        return handle.job if handle is not None else None
+
+    def fill_cached_results(self, assembler, cached):
+        """
+        This function writes the results found in the driver cache into the assembler and releases their pins
+        :param assembler: ResultAssembler receiving the blocks
+        :param cached: list of (coordinates, cache key)
         """
-        This function merges the results from the queue
+        try:
+            for coords, key in cached:
+                block = self.cache.get(key)
+                if block is None:
+                    raise KeyError(f"Cached result {key} of block {coords} was removed before the merge")
+                assembler.add(codec.Message('result', coords, [block], {}))
+        finally:
+            if cached:
+                self.cache.unpin(key for _, key in cached)
+
+    def get_job(self, operation, split_array):
+        """
+        This function returns the last job prepared by compute_matrix_operation if it is the one being merged
+        :param operation: operation of the merged results
+        :param split_array: first split array of the merged results
+        :return: last_job, or None
+        """
+        job = self.last_job
+        if job is not None and job['operation'] == operation and job['split_array'] is split_array:
+            return job
+        return None
+
+    def resend_outstanding_tasks(self, assembler, job=None):
+        """
+        This function re-enqueues the tasks of a job that have no result yet. Each goes to the queue it was first sent
+        to, so its result still comes back on the result queue merge_queue_result counts it on.
+        :param assembler: ResultAssembler of the job
+        :param job: job dict, the last job by default
+        :return: number of tasks re-enqueued
+        """
+        job = job or self.last_job
+        tasks = job['sent']
+        queue_names = self.get_queue_names()
+        with qh.BatchSender(self.sqs, max_workers=self.SENDER_THREADS) as sender:
+            for queue_id, dt in enumerate(self.get_task_partitions(len(tasks))):
+                outstanding = [task_id for task_id in dt if not assembler.is_received(tasks[task_id][0])]
+                sender.send(queue_names[queue_id][0], (self.get_job_entry(job, task_id, queue_names[queue_id][0])
+                                                       for task_id in outstanding))
+            return sender.flush()
+
+    def watch_stragglers(self, assembler, abort, job=None):
+        """
+        This function re-enqueues the straggling tasks of a job once, when the StragglerMonitor calls for it
+        :param assembler: ResultAssembler of the job
+        :param abort: threading.Event set when the merge has failed or the job is cancelled
+        :param job: job dict, the last job by default
+        """
+        job = job or self.last_job
+        monitor = StragglerMonitor(assembler, job['started'], **self.SPECULATION_OPTIONS)
+        while not assembler.wait(monitor.interval) and not abort.is_set():
+            if monitor.poll():
+                print(f"Re-enqueued {self.resend_outstanding_tasks(assembler, job)} straggling tasks after "
+                      f"{monitor.deadline:.1f}s")
+                return
+
+    def create_assembler(self, split_array, array_size, chunk_size, operation='addition', filename=None):
+        """
+        This function creates the ResultAssembler of a job, with the tasks the last compute_matrix_operation skipped or
+        found in the driver cache already filled in
+        :param split_array: split array
+        :param array_size: array size
+        :param chunk_size: chunk size
+        :param operation: operation that produced the results
+        :param filename: optional .npy file to assemble the result in through a memory map
+        :return: tuple of (assembler, number of results expected from the result queues)
+        """
+        blocks_per_row = math.ceil(array_size / chunk_size)
+        task_count = len(split_array) if operation == 'addition' else blocks_per_row ** 3
+        assembler = ResultAssembler((array_size, array_size), (chunk_size, chunk_size), operation,
+                                    inner_blocks=blocks_per_row if operation == 'multiplication' else 1,
+                                    filename=filename)
+        self.last_assembler = assembler
+        job = self.get_job(operation, split_array)
+        if job is not None:
+            task_count = job['tasks']
+            for coords in job['skipped']:
+                assembler.skip(coords)
+            self.fill_cached_results(assembler, job.get('cached', []))
+        return assembler, task_count
+
+    def close_job(self, job_id):
+        """
+        This function marks a job as merged or abandoned, its results still coming are then deleted by any consumer
+        :param job_id: id of the job, None is ignored
+        """
+        self.open_jobs.discard(job_id)
+
+    def report_trace(self, trace):
+        """
+        This function prints the percentiles of the task timings of a job and the stage bounding it
+        :param trace: JobTrace of the job
+        """
+        summary = trace.summary()
+        if summary:
+            print("Task seconds (p50/p99): " + ', '.join(
+                f"{stage} {summary[stage]['p50']:.3f}/{summary[stage]['p99']:.3f}" for stage in TRACE_STAGES) +
+                f", bound by {trace.bottleneck()}")
+
+    def merge_queue_result(self, split_array, array_size, chunk_size, operation='addition', filename=None):
+        """
+        This function merges the results from the queue. Every result queue is drained concurrently and each block is
+        written into a preallocated output as soon as it arrives, so merging overlaps with the computation. Duplicate
+        results are dropped, and the straggling tasks are re-enqueued once as the job nears completion.
         :param split_array: split array
         :param array_size: array size
         :param chunk_size: chunk size
+        :param operation: operation that produced the results
+        :param filename: optional .npy file to assemble the result in through a memory map
+        :return: merged array
+        """
+        assembler, task_count = self.create_assembler(split_array, array_size, chunk_size, operation, filename)
+        trace = self.last_trace = JobTrace()
+
+        job = self.get_job(operation, split_array)
+        job_id = job['id'] if job is not None else None
+        queue_names = self.get_queue_names()
+        abort = threading.Event()
+        with ThreadPoolExecutor(max_workers=len(queue_names) + 1) as executor:
+            futures = [executor.submit(self.drain_result_queue, assembler, queue_names[a][1], len(b), abort, trace,
+                                       job_id) for a, b in enumerate(self.get_task_partitions(task_count))]
+            if self.SPECULATION_OPTIONS['percentile'] and job is not None:
+                futures.append(executor.submit(self.watch_stragglers, assembler, abort, job))
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                abort.set()
+                raise
+            finally:
+                self.close_job(job_id)
+
+        self.report_trace(trace)
+        return assembler.get_result()
+
+    def run_operation(self, operation, split_array1, split_array2, array_size, chunk_size, grid_shape1=None,
+                      grid_shape2=None, filename=None, max_in_flight=None):
+        """
+        This function runs an operation end to end with the AsyncJobDriver: tasks are sent while the results are merged,
+        so there is no wait between compute_matrix_operation and merge_queue_result. Use AsyncJobDriver.run directly to
+        await the job from a running event loop.
+        :param operation: operation to be performed
+        :param split_array1: split array 1
+        :param split_array2: split array 2
+        :param array_size: array size
+        :param chunk_size: chunk size
+        :param grid_shape1: block grid of split array 1, only used for multiplication
+        :param grid_shape2: block grid of split array 2, only used for multiplication
+        :param filename: optional .npy file to assemble the result in through a memory map
+        :param max_in_flight: bound of the tasks sent and not yet answered
         :return: merged array
         """
-        temp_res = []
-
-        for a, b in enumerate(np.array_split(np.arange(0, len(split_array)), self.INSTANCE_SIZE)):
-            compute_res = []
-            print(f"Received {len(b)} results from queue{a}")
-            # get the result from the queue
-            for i in range(len(b)):
-                res = self.get_messages_from_queue(f'result-queue-{a}', 1)
-                [compute_res.append(msg) for msg in res]
-            # sort the result by the index
-            compute_res.sort()
-            # append the result to the temp_res
-            [temp_res.append(literal_eval(res)) for (index, res) in compute_res]
-
-        final_res = []
-        temp = []
-        for idx, data in enumerate(temp_res):
-            temp.append(data)
-            # if the index is equal to the chunk size, append the temp to the final_res
-            if idx % int(array_size / chunk_size) == int(array_size / chunk_size) - 1:
-                final_res.append(np.hstack([tuple(t) for t in temp]))
-                temp = []
-        return np.concatenate(final_res)
-
-    def terminate_instances(self):
+        driver = AsyncJobDriver(self, max_in_flight)
+        return asyncio.run(driver.run(operation, split_array1, split_array2, array_size, chunk_size, grid_shape1,
+                                      grid_shape2, filename))
+
+    def submit(self, operation, split_array1, split_array2, array_size, chunk_size, grid_shape1=None, grid_shape2=None,
+               filename=None):
+        """
+        This function sends the tasks of a job and returns without waiting for its results. Jobs submitted together
+        share the workers and the queues, the JobRouter tells their results apart by the job id every message carries.
+        :param operation: operation to be performed
+        :param split_array1: split array 1
+        :param split_array2: split array 2
+        :param array_size: array size
+        :param chunk_size: chunk size
+        :param grid_shape1: block grid of split array 1, only used for multiplication
+        :param grid_shape2: block grid of split array 2, only used for multiplication
+        :param filename: optional .npy file to assemble the result in through a memory map
+        :return: JobHandle
+        """
+        with self._submit_lock:
+            self.prepare_job(operation, split_array1, split_array2, grid_shape1, grid_shape2)
+            job = self.last_job
+            assembler, _ = self.create_assembler(split_array1, array_size, chunk_size, operation, filename)
+        return self.start_job(job, assembler)
+
+    def submit_pass(self, fused, filename=None):
+        """
+        This function sends the tasks of a fused pass of a DistributedMatrix expression, tasks whose program gives an
+        all-zero block are not sent
+        :param fused: FusedPass
+        :param filename: optional .npy file to assemble the result in through a memory map
+        :return: JobHandle
+        """
+        tasks, skipped = zero_tasks(fused, [self.get_zero_blocks(grid) for grid in fused.grids])
+        job = {'id': uuid.uuid4().hex, 'operation': 'fused', 'split_array': fused.grids, 'split_array2': None,
+               'tasks': len(tasks), 'skipped': skipped, 'cached': [], 'sent': tasks, 'keys': [None] * len(tasks),
+               'started': time.monotonic()}
+        print(f"Fused {fused.operation} pass of {len(fused.tasks)} tasks over {len(fused.grids)} matrices")
+        if skipped:
+            print(f'Skipping {len(skipped)} tasks with all-zero results')
+        assembler = ResultAssembler(fused.shape, fused.block_shape, fused.operation, fused.inner_blocks, fused.dtype,
+                                    filename)
+        for coords in skipped:
+            assembler.skip(coords)
+        self.open_jobs.add(job['id'])
+        return self.start_job(job, assembler)
+
+    def start_job(self, job, assembler):
+        """
+        This function sends the tasks of a prepared job and routes its results to a new JobHandle
+        :param job: job dict
+        :param assembler: ResultAssembler of the job, with the skipped and cached tasks filled in
+        :return: JobHandle
+        """
+        handle = JobHandle(job, assembler, JobTrace(), self.jobs)
+        if assembler.done:
+            self.close_job(job['id'])
+            return handle
+        # results can arrive while the last tasks are still being sent
+        self.jobs.register(handle)
+        self.send_tasks(job)
+        if self.SPECULATION_OPTIONS['percentile']:
+            threading.Thread(target=self.watch_stragglers, args=(assembler, handle.cancel_event, job), daemon=True,
+                             name=f"stragglers-{job['id']}").start()
+        return handle
+
+    def distributed_matrix(self, array, block_size):
+        """
+        This function wraps an array for lazy evaluation on the workers, see DistributedMatrix
+        :param array: array, possibly memory-mapped
+        :param block_size: edge of the square blocks, shared by every matrix of an expression
+        :return: DistributedMatrix
+        """
+        return DistributedMatrix(self, ('leaf', self.split_row(array, block_size, block_size, ragged=True)),
+                                 block_size)
+
+    def scale_workers(self, count):
+        """
+        Grow or shrink the fleet to count workers. New instances are launched and bootstrapped without restarting the
+        workers already running, surplus instances are terminated. Used by the QueueDepthAutoscaler, with shared
+        scheduling so that no task queue belongs to a removed worker.
+        :param count: number of workers
+        """
+        current = self.INSTANCE_SIZE
+        self.INSTANCE_SIZE = count
+        if self.backend is not None:
+            return self.backend.scale_workers(self, count)
+        if count > current:
+            self.initialise_instances(self.ec2, running=set(self.instance_addresses))
+        elif count < current:
+            removed = self.instance_addresses[count:]
+            self.instance_addresses = self.instance_addresses[:count]
+            for ip_address in removed:
+                if self.ssh_sessions is not None:
+                    self.ssh_sessions.close(ip_address)
+            instance_ids = [instance.id for instance in self.ec2_resource.instances.filter(
+                Filters=[{'Name': 'ip-address', 'Values': removed}])]
+            if instance_ids:
+                self.terminate_instances(instance_ids)
+
+    def terminate_instances(self, instance_ids=None):
         """
         This function terminates all the instances
+        :param instance_ids: only terminate these instances
         """
+        if self.backend is not None:
+            return self.backend.terminate_instances()
+        if instance_ids is not None:
+            print(f'Terminating {instance_ids}')
+            return self.ec2.terminate_instances(InstanceIds=instance_ids)
         ec2 = boto3.resource('ec2')
         for instance in ec2.instances.all():
             # terminate all instances
@@ -511,7 +1262,7 @@ class CloudComputingApp:
         response = client.list_queues(
             MaxResults=123)
 
-        for queue in response['QueueUrls']:
+        for queue in response.get('QueueUrls', []):
             print(f'Purging {queue}')
             client.purge_queue(QueueUrl=queue)
 
@@ -530,49 +1281,41 @@ class CloudComputingApp:
         elif size <= 1000000:
             return 120
 
-    def split_and_compute_dot_product(matrix_a, matrix_b, chunk_size):
+    def split_and_compute_dot_product(self, matrix_a, matrix_b, chunk_size):
         """
-        Splits two huge matrices into smaller chunks and computes the dot product for each pair of chunks without using any libraries.
+        Splits two matrices into chunk_size x chunk_size tiles and computes their product tile by tile, the same way
+        the distributed multiplication does. Useful as a local reference for the distributed result.
 
         Parameters:
-        - matrix_a (list): The first matrix to split and compute the dot product for.
-        - matrix_b (list): The second matrix to split and compute the dot product for.
-        - chunk_size (int): The size of each chunk.
+        - matrix_a (np.ndarray): The first matrix.
+        - matrix_b (np.ndarray): The second matrix.
+        - chunk_size (int): The size of each tile.
 
         Returns:
-        - dot_products (list): A list of dot products for each pair of chunks.
+        - product (np.ndarray): The product of matrix_a and matrix_b.
         """
-        # Split the matrices into chunks
-        chunks_a = [matrix_a[i:i + chunk_size] for i in range(0, len(matrix_a), chunk_size)]
-        chunks_b = [matrix_b[i:i + chunk_size] for i in range(0, len(matrix_b), chunk_size)]
-
-        # Initialize a list to store the dot products
-        dot_products = []
+        matrix_a = np.asarray(matrix_a)
+        matrix_b = np.asarray(matrix_b)
+        split_a = self.split_row(matrix_a, chunk_size, chunk_size)
+        split_b = self.split_row(matrix_b, chunk_size, chunk_size)
+        grid_a = (matrix_a.shape[0] // chunk_size, matrix_a.shape[1] // chunk_size)
+        grid_b = (matrix_b.shape[0] // chunk_size, matrix_b.shape[1] // chunk_size)
 
-        # Iterate over the chunks and compute the dot product for each pair of chunks
-        for chunk_a, chunk_b in zip(chunks_a, chunks_b):
-            print(chunk_a, chunk_b)
-            dot_product = [[0 for j in range(len(chunk_a))] for i in range(len(chunk_b[0]))]
-            print(dot_product)
-            for i in range(len(chunk_b)):
-                for j in range(len(chunk_a[0])):
-                    for k in range(len(chunk_b[0])):
-                        dot_product[i][j] += chunk_b[i][k] * chunk_a[k][j]
+        assembler = ResultAssembler((matrix_a.shape[0], matrix_b.shape[1]), (chunk_size, chunk_size), 'multiplication',
+                                    inner_blocks=grid_a[1])
+        for coords, idx_a, idx_b in self.get_tasks('multiplication', split_a, split_b, grid_a, grid_b):
+            assembler.add(codec.Message('result', coords, [helper.matrix_dot_product(split_a[idx_a], split_b[idx_b])], {}))
 
-            dot_products.append(dot_product)
-
-        return dot_products
+        return assembler.get_result()
 
     def write_result_to_file(self, result, filename):
         """
-        This function writes the result to a file
+        This function writes the result to a binary .npy file, or .npz when the filename ends with .npz
         :param result: result to be written
         :param filename: filename
-        :return:
+        :return: path of the written file
         """
-        with open(filename, 'w') as f:
-            for item in result.tolist():
-                f.write("%s " % item)
+        return save_matrix(filename, result)
 
     def prepare_architecture(self):
         """
@@ -589,8 +1332,13 @@ class CloudComputingApp:
         :return:
         """
         try:
+            self.jobs.close()
             self.terminate_instances()
             self.delete_queues()
+            if self.ssh_sessions is not None:
+                self.ssh_sessions.close()
+            if self.backend is not None:
+                self.backend.shutdown()
             print("TEARDOWN DONE!")
             return True
         except Exception as e:
@@ -0,0 +1,204 @@
+"""
+End-to-end benchmark of the distributed pipeline on the LocalBackend.
+
+Every case runs compute_matrix_operation and merge_queue_result with local worker processes and the in-memory queue
+store, and records the wall time of each stage:
+
+- split: split_row of both matrices
+- encode: encoding every task message, measured on its own
+- enqueue: compute_matrix_operation, the workers already compute while it runs
+- compute: from the end of the enqueue until every result is on the result queues
+- dequeue: merge_queue_result, less the merge time
+- merge: time the ResultAssembler spent writing blocks into the output
+- total: from the start of the enqueue to the merged result
+
+Every run also holds the JobTrace summary of its tasks, with the queue wait, decode, compute and transfer percentiles.
+
+The workers are warmed up with a small job first, so process start-up is not counted. Each case runs in a fresh
+process so peak RSS is measured per case, for the driver and for the largest of its children (workers and queue
+manager, whose peak includes the driver image they were started from). The JSON output records the commit and the
+environment so results of different commits can be compared.
+
+    python -m benchmarks.pipeline --sizes 256 512 --block-sizes 64 128 --workers 1 2 4 --output bench.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from CloudComputing import CloudComputingApp
+from driver.local_backend import LocalBackend
+
+STAGES = ['split', 'encode', 'enqueue', 'compute', 'dequeue', 'merge', 'total']
+
+
+def get_environment():
+    """
+    Describe the commit and the machine a benchmark ran on
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+def wait_for_results(app, expected, timeout=600):
+    """
+    Poll the result queues until they hold at least expected messages
+    """
+    client = app.sqs_client
+    urls = [client.get_queue_url(QueueName=result_queue)['QueueUrl'] for _, result_queue in app.get_queue_names()]
+    deadline = time.monotonic() + timeout
+    while True:
+        available = sum(int(client.get_queue_attributes(
+            QueueUrl=url, AttributeNames=['ApproximateNumberOfMessages'])['Attributes']['ApproximateNumberOfMessages'])
+            for url in urls)
+        if available >= expected:
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Only {available} of {expected} results after {timeout} seconds")
+        time.sleep(0.005)
+
+
+def run_job(app, operation, matrix_a, matrix_b, block_size):
+    """
+    Run one job through the pipeline
+    :return: tuple of (result, dict of stage to seconds, number of tasks)
+    """
+    size = matrix_a.shape[0]
+    timings = {}
+
+    start_time = time.perf_counter()
+    split_a = app.split_row(matrix_a, block_size, block_size, ragged=True)
+    split_b = app.split_row(matrix_b, block_size, block_size, ragged=True)
+    timings['split'] = time.perf_counter() - start_time
+
+    tasks = app.get_tasks(operation, split_a, split_b)
+    start_time = time.perf_counter()
+    for task_id, task in enumerate(tasks):
+        app.get_task_entry(operation, task_id, task, split_a, split_b)
+    timings['encode'] = time.perf_counter() - start_time
+
+    job_start = time.perf_counter()
+    app.compute_matrix_operation(operation, split_a, split_b)
+    enqueued = time.perf_counter()
+    timings['enqueue'] = enqueued - job_start
+
+    # tasks skipped as all-zero or found in the driver cache produce no result message
+    wait_for_results(app, app.last_job['tasks'])
+    computed = time.perf_counter()
+    timings['compute'] = computed - enqueued
+
+    result = app.merge_queue_result(split_a, size, block_size, operation)
+    done = time.perf_counter()
+    timings['merge'] = app.last_assembler.merge_seconds
+    timings['dequeue'] = done - computed - timings['merge']
+    timings['total'] = done - job_start
+    timings['trace'] = app.last_trace.summary()
+    return result, timings, len(tasks)
+
+
+def run_case(size, block_size, workers, operation, scheduling='shared', repeat=1, compression=None, narrow=False,
+             log_dir=None):
+    """
+    Benchmark one configuration in the current process
+    :return: dict of the configuration, the per-stage timings of every repeat and their medians, and the peak RSS
+    """
+    app = CloudComputingApp(instance_size=workers, scheduling=scheduling, backend=LocalBackend(log_dir),
+                            compression=compression, narrow=narrow)
+    runs = []
+    try:
+        app.prepare_architecture()
+        warm_up = app.generate_array(2, 2)
+        run_job(app, 'addition', warm_up, warm_up, 1)
+
+        matrix_a = app.generate_array(size, size)
+        matrix_b = app.generate_array(size, size)
+        expected = matrix_a + matrix_b if operation == 'addition' else matrix_a @ matrix_b
+        for _ in range(repeat):
+            result, timings, tasks = run_job(app, operation, matrix_a, matrix_b, block_size)
+            if not np.array_equal(result, expected):
+                raise AssertionError(f"Wrong result for {operation} of size {size} with blocks of {block_size}")
+            runs.append(timings)
+    finally:
+        app.teardown_infrastructure()
+
+    return {'size': size, 'block_size': block_size, 'workers': workers, 'operation': operation,
+            'scheduling': scheduling, 'compression': compression, 'narrow': narrow, 'tasks': tasks, 'runs': runs,
+            'median': {stage: statistics.median(run[stage] for run in runs) for stage in STAGES},
+            'peak_rss_kb': {'driver': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}}
+
+
+def run_case_in_subprocess(case):
+    """
+    Benchmark one configuration in a fresh interpreter so its peak RSS is not inflated by earlier cases
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'case.json')
+        subprocess.run([sys.executable, '-m', 'benchmarks.pipeline', '--case', json.dumps(case), '--output', output],
+                       check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       stdout=subprocess.DEVNULL)
+        with open(output) as f:
+            return json.load(f)
+
+
+def sweep(sizes, block_sizes, workers, operations, scheduling='shared', repeat=1, compression=None, narrow=False,
+          in_process=False):
+    """
+    Benchmark every combination of the parameters, skipping blocks larger than the matrix
+    :return: dict with the environment and the list of case results
+    """
+    results = []
+    for size, block_size, worker_count, operation in itertools.product(sizes, block_sizes, workers, operations):
+        if block_size > size:
+            continue
+        case = {'size': size, 'block_size': block_size, 'workers': worker_count, 'operation': operation,
+                'scheduling': scheduling, 'repeat': repeat, 'compression': compression, 'narrow': narrow}
+        print(f"Benchmarking {case}", file=sys.stderr)
+        results.append(run_case(**case) if in_process else run_case_in_subprocess(case))
+    return {'environment': get_environment(), 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[128, 256])
+    parser.add_argument('--block-sizes', type=int, nargs='+', default=[32, 64])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--operations', nargs='+', default=['addition', 'multiplication'],
+                        choices=['addition', 'multiplication'])
+    parser.add_argument('--scheduling', default='shared', choices=['static', 'shared'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--compression', choices=['zlib', 'lzma', 'auto'], help="compress task and result payloads")
+    parser.add_argument('--narrow', action='store_true', help="send integer blocks in the smallest dtype that fits")
+    parser.add_argument('--in-process', action='store_true', help="run every case in this process")
+    parser.add_argument('--output', help="JSON file to write, printed to stdout when not given")
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        report = run_case(**json.loads(args.case))
+    else:
+        report = sweep(args.sizes, args.block_sizes, args.workers, args.operations, args.scheduling, args.repeat,
+                       args.compression, args.narrow, args.in_process)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
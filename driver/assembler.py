@@ -0,0 +1,170 @@
+"""Assemble result blocks into a preallocated output matrix as they arrive."""
+import math
+import threading
+import time
+
+import numpy as np
+
+from worker import helper, sparse
+
+
+class ResultAssembler:
+    """
+    Write result blocks into their slice of a preallocated output as soon as they arrive, in any order. Partial
+    products of a multiplication are summed in place into their output tile. Completion is tracked with a bitmap over
+    the task coordinates, so duplicate deliveries of a task are ignored.
+    """
+
+    def __init__(self, shape, block_shape, operation='addition', inner_blocks=1, dtype=None, filename=None):
+        """
+        :param shape: shape of the output matrix
+        :param block_shape: shape of an output block
+        :param operation: 'addition' or 'multiplication'
+        :param inner_blocks: number of partial products summed into every output tile of a multiplication
+        :param dtype: dtype of the output, taken from the first block received when not given, with integer blocks
+        assembled as int64 since they may arrive narrowed or with accumulators sized for their own block only
+        :param filename: optional .npy file to back the output with a memory map instead of RAM
+        """
+        self.shape = tuple(shape)
+        self.block_shape = tuple(block_shape)
+        self.operation = operation
+        self.filename = filename
+        self.grid = tuple(math.ceil(size / block) for size, block in zip(self.shape, self.block_shape))
+        if operation == 'multiplication':
+            self.received = np.zeros(self.grid + (inner_blocks,), dtype=bool)
+        else:
+            self.received = np.zeros(self.grid, dtype=bool)
+        self.result = None
+        # slices of skipped addition blocks, zeroed once the output exists
+        self._zero_regions = []
+        # seconds spent writing blocks into the output
+        self.merge_seconds = 0.0
+        self._completed = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        if dtype is not None:
+            self._allocate(np.dtype(dtype))
+
+    def _allocate(self, dtype):
+        if self.filename is not None:
+            self.result = np.lib.format.open_memmap(self.filename, mode='w+', dtype=dtype, shape=self.shape)
+        else:
+            # multiplication tiles are accumulated, so they need to start from zero
+            allocate = np.zeros if self.operation == 'multiplication' else np.empty
+            self.result = allocate(self.shape, dtype=dtype)
+        for region in self._zero_regions:
+            self.result[region] = 0
+        self._zero_regions = []
+
+    def _region(self, index, block_shape=None):
+        row, col = index[:2]
+        block_shape = block_shape or self.block_shape
+        return (slice(row * self.block_shape[0], row * self.block_shape[0] + block_shape[0]),
+                slice(col * self.block_shape[1], col * self.block_shape[1] + block_shape[1]))
+
+    def _task_index(self, coords):
+        if self.operation == 'multiplication':
+            return tuple(coords)
+        return divmod(coords[0], self.grid[1]) if len(coords) == 1 else tuple(coords)
+
+    def add(self, message):
+        """
+        Write a result message into the output
+        :param message: decoded result message
+        :return: True if the block was written, False if it was a duplicate
+        """
+        index = self._task_index(message.coords)
+        block = message.blocks[0]
+        rows, cols = self._region(index, block.shape)
+
+        with self._lock:
+            if self.received[index]:
+                return False
+            start_time = time.perf_counter()
+            self.received[index] = True
+            if self.result is None:
+                self._allocate(np.dtype(np.int64) if block.dtype.kind in 'biu' else block.dtype)
+            if self.operation == 'multiplication':
+                tile = self.result[rows, cols]
+                helper.matrix_add(tile, block, out=tile)
+            elif sparse.is_sparse(block):
+                block.to_dense(out=self.result[rows, cols])
+            else:
+                self.result[rows, cols] = block
+            self._completed += 1
+            self.merge_seconds += time.perf_counter() - start_time
+            if self._completed == self.received.size:
+                self._done.set()
+        return True
+
+    def skip(self, coords):
+        """
+        Mark a task that was not sent because its result is all zeros as received
+        :param coords: coordinates of the task
+        :return: True if the task was marked, False if it was already received
+        """
+        index = self._task_index(coords)
+        with self._lock:
+            if self.received[index]:
+                return False
+            self.received[index] = True
+            # multiplication outputs start from zero, addition blocks have to be cleared
+            if self.operation != 'multiplication':
+                if self.result is None:
+                    self._zero_regions.append(self._region(index))
+                else:
+                    self.result[self._region(index)] = 0
+            self._completed += 1
+            if self._completed == self.received.size:
+                self._done.set()
+        return True
+
+    def is_received(self, coords):
+        """
+        Whether the result of a task has been written, or the task skipped
+        :param coords: coordinates of the task
+        """
+        return bool(self.received[self._task_index(coords)])
+
+    @property
+    def completed(self):
+        """
+        Number of distinct tasks received
+        """
+        return self._completed
+
+    @property
+    def total(self):
+        """
+        Number of tasks expected
+        """
+        return self.received.size
+
+    @property
+    def progress(self):
+        """
+        Fraction of the tasks received, between 0 and 1
+        """
+        return self._completed / self.total if self.total else 1.0
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until every task has been received
+        :return: True if the output is complete
+        """
+        return self._done.wait(timeout)
+
+    def get_result(self):
+        """
+        Get the assembled output, flushed to disk when backed by a memory map
+        """
+        if self.result is None:
+            # every task was skipped, the output is all zeros
+            self._allocate(np.dtype(np.int64))
+        if isinstance(self.result, np.memmap):
+            self.result.flush()
+        return self.result
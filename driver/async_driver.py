@@ -0,0 +1,149 @@
+"""Run a job with its tasks streamed out while the results are merged, on asyncio over thread-bridged boto3 calls."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from driver.tracing import JobTrace
+from worker import queue_helper as qh
+
+# tasks sent and not yet answered, per worker, when no window is given
+IN_FLIGHT_PER_WORKER = 40
+# seconds between checks for a failed batch while waiting for room in the window
+SEND_CHECK_SECONDS = 0.5
+
+
+class AsyncJobDriver:
+    """
+    Overlap the three phases of a job. Task batches are encoded and sent round-robin across the task queues while one
+    poller per result queue long-polls and merges the results, so there is no wait between sending and merging. A
+    window bounds the tasks sent and not yet answered, sending resumes as results free it up. The straggling tasks
+    are re-enqueued as in merge_queue_result.
+    """
+
+    def __init__(self, app, max_in_flight=None, wait_time=qh.LONG_POLL_SECONDS):
+        """
+        :param app: CloudComputingApp whose queues and workers are ready
+        :param max_in_flight: bound of the tasks sent and not yet answered, IN_FLIGHT_PER_WORKER per worker by default
+        :param wait_time: seconds every receive long-polls for
+        """
+        self.app = app
+        self.max_in_flight = max_in_flight or IN_FLIGHT_PER_WORKER * app.INSTANCE_SIZE
+        assert self.max_in_flight >= qh.MAX_BATCH_ENTRIES, \
+            f"The window must hold a batch of {qh.MAX_BATCH_ENTRIES} tasks"
+        self.wait_time = wait_time
+
+    async def run(self, operation, split_array1, split_array2, array_size, chunk_size, grid_shape1=None,
+                  grid_shape2=None, filename=None):
+        """
+        Run a job end to end
+        :param operation: operation to be performed
+        :param split_array1: split array 1
+        :param split_array2: split array 2
+        :param array_size: array size
+        :param chunk_size: chunk size
+        :param grid_shape1: block grid of split array 1, only used for multiplication
+        :param grid_shape2: block grid of split array 2, only used for multiplication
+        :param filename: optional .npy file to assemble the result in through a memory map
+        :return: merged array
+        """
+        app = self.app
+        tasks, keys = app.prepare_job(operation, split_array1, split_array2, grid_shape1, grid_shape2)
+        job = app.last_job
+        assembler, task_count = app.create_assembler(split_array1, array_size, chunk_size, operation, filename)
+        trace = app.last_trace = JobTrace()
+        queue_names = app.get_queue_names()
+        partitions = app.get_task_partitions(task_count)
+        window = asyncio.Semaphore(self.max_in_flight)
+
+        # one thread per poller, plus one encoding the batches and one watching for stragglers
+        executor = ThreadPoolExecutor(max_workers=len(queue_names) + 2)
+        abort = threading.Event()
+        sender = qh.BatchSender(app.sqs, max_workers=app.SENDER_THREADS)
+        jobs = [asyncio.ensure_future(self.send_tasks(executor, sender, window, job, partitions))]
+        jobs += [asyncio.ensure_future(self.poll_results(executor, window, assembler, trace, queue_names[idx][1],
+                                                         len(partition), job['id']))
+                 for idx, partition in enumerate(partitions)]
+        if app.SPECULATION_OPTIONS['percentile']:
+            jobs.append(asyncio.ensure_future(self.watch_stragglers(executor, jobs[0], assembler, abort, job)))
+        try:
+            await asyncio.gather(*jobs)
+        except BaseException:
+            abort.set()
+            for future in jobs:
+                future.cancel()
+            raise
+        finally:
+            app.close_job(job['id'])
+            sender.close()
+            # a poller cancelled mid long-poll finishes its receive in the background
+            executor.shutdown(wait=False)
+
+        app.report_trace(trace)
+        return assembler.get_result()
+
+    async def send_tasks(self, executor, sender, window, job, partitions):
+        """
+        Encode and send the tasks one batch per queue at a time, waiting for room in the window before each batch
+        """
+        loop = asyncio.get_running_loop()
+        queue_names = self.app.get_queue_names()
+        pending = [(queue_names[idx][0], qh.make_batches(self.app.get_job_entry(job, task_id, queue_names[idx][0])
+                                                         for task_id in partition))
+                   for idx, partition in enumerate(partitions)]
+        while pending:
+            for queue_name, batches in list(pending):
+                batch = await loop.run_in_executor(executor, next, batches, None)
+                if batch is None:
+                    pending.remove((queue_name, batches))
+                    continue
+                for _ in batch:
+                    await self.acquire_slot(window, sender)
+                await loop.run_in_executor(executor, sender.send, queue_name, batch)
+        print(f'Sent {await loop.run_in_executor(executor, sender.flush)} tasks')
+
+    @staticmethod
+    async def acquire_slot(window, sender):
+        """
+        Wait for room in the window for one task. The tasks of a batch that failed to send are never answered to make
+        room, so the error of such a batch is raised instead of waiting on.
+        """
+        while True:
+            sender.raise_failed()
+            try:
+                await asyncio.wait_for(window.acquire(), SEND_CHECK_SECONDS)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+    async def watch_stragglers(self, executor, sending, assembler, abort, job):
+        """
+        Re-enqueue the straggling tasks once, watching only after every task has been sent so the tasks still held
+        back by the window are not taken for stragglers
+        """
+        await sending
+        await asyncio.get_running_loop().run_in_executor(executor, self.app.watch_stragglers, assembler, abort, job)
+
+    async def poll_results(self, executor, window, assembler, trace, result_queue_name, expected, job_id):
+        """
+        Merge the results of a result queue as they arrive, freeing a window slot for every new result
+        """
+        loop = asyncio.get_running_loop()
+        received = 0
+        while received < expected:
+            new = await loop.run_in_executor(executor, self.receive_results, assembler, trace, result_queue_name,
+                                             job_id)
+            received += new
+            for _ in range(new):
+                window.release()
+        print(f"Received {received} results from {result_queue_name}, {assembler.progress:.0%} of the job done")
+
+    def receive_results(self, assembler, trace, result_queue_name, job_id):
+        """
+        Receive one batch of results and write the ones of the job into the assembler, the results of other open jobs
+        are left on the queue
+        :return: number of new results
+        """
+        messages = self.app.get_messages_from_queue(result_queue_name, wait_time=self.wait_time, job_ids={job_id})
+        received_at = time.time()
+        return sum(self.app.add_result(assembler, message, received_at, trace, job_id) for message in messages)
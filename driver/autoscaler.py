@@ -0,0 +1,109 @@
+"""Grow and shrink the worker fleet with the depth of the task queue."""
+import math
+import threading
+import time
+
+BACKLOG_ATTRIBUTES = ['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+
+
+class QueueDepthAutoscaler:
+    """
+    Track a target backlog per worker. Every step reads the visible and in-flight message counts of the task queues
+    and asks the app for ceil(backlog / target) workers, clamped to [min_workers, max_workers]. Scaling out and in
+    each have a cooldown so the fleet does not flap while new workers start or the last tasks drain.
+    """
+
+    def __init__(self, app, target_backlog_per_worker=20, min_workers=1, max_workers=16, scale_out_cooldown=60,
+                 scale_in_cooldown=300, clock=time.monotonic):
+        """
+        :param app: CloudComputingApp using shared scheduling
+        :param target_backlog_per_worker: queued or in-flight tasks each worker should have
+        :param min_workers: workers kept even when the queue is empty
+        :param max_workers: upper bound of the fleet
+        :param scale_out_cooldown: seconds after any scaling before scaling out again
+        :param scale_in_cooldown: seconds after any scaling before scaling in
+        :param clock: time source, replaceable in tests
+        """
+        if app.SCHEDULING != 'shared':
+            raise ValueError("Autoscaling needs shared scheduling, static queues are tied to their instance")
+        assert 0 < min_workers <= max_workers, "min_workers must be positive and at most max_workers"
+        self.app = app
+        self.target_backlog_per_worker = target_backlog_per_worker
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.scale_out_cooldown = scale_out_cooldown
+        self.scale_in_cooldown = scale_in_cooldown
+        self.clock = clock
+        self.last_scaled = None
+        self._queue_urls = {}
+
+    def get_backlog(self):
+        """
+        Count the messages waiting in or being processed from the task queues
+        :return: tuple of (visible messages, in-flight messages)
+        """
+        visible = in_flight = 0
+        client = self.app.sqs_client
+        for queue_name, _ in self.app.get_queue_names():
+            if queue_name not in self._queue_urls:
+                self._queue_urls[queue_name] = client.get_queue_url(QueueName=queue_name)['QueueUrl']
+            attributes = client.get_queue_attributes(QueueUrl=self._queue_urls[queue_name],
+                                                     AttributeNames=BACKLOG_ATTRIBUTES)['Attributes']
+            visible += int(attributes['ApproximateNumberOfMessages'])
+            in_flight += int(attributes['ApproximateNumberOfMessagesNotVisible'])
+        return visible, in_flight
+
+    def desired_workers(self, backlog):
+        """
+        Number of workers for a backlog, within the bounds
+        """
+        return min(self.max_workers, max(self.min_workers, math.ceil(backlog / self.target_backlog_per_worker)))
+
+    def step(self):
+        """
+        Read the backlog once and scale the fleet if needed
+        :return: dict with the backlog, the current and desired worker counts and the action taken
+        """
+        visible, in_flight = self.get_backlog()
+        current = self.app.INSTANCE_SIZE
+        desired = self.desired_workers(visible + in_flight)
+        now = self.clock()
+        since_scaled = math.inf if self.last_scaled is None else now - self.last_scaled
+
+        action = 'none'
+        if desired > current and since_scaled >= self.scale_out_cooldown:
+            action = 'scale-out'
+        elif desired < current and since_scaled >= self.scale_in_cooldown:
+            action = 'scale-in'
+        elif desired != current:
+            action = 'cooldown'
+
+        if action in ('scale-out', 'scale-in'):
+            print(f"Autoscaler: {visible} queued, {in_flight} in flight, scaling from {current} to {desired} workers")
+            self.app.scale_workers(desired)
+            self.last_scaled = now
+        return {'visible': visible, 'in_flight': in_flight, 'current': current, 'desired': desired,
+                'action': action}
+
+    def run(self, interval=30, stop=None):
+        """
+        Step every interval seconds until stop is set
+        :param interval: seconds between steps
+        :param stop: threading.Event ending the loop
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                print(f"Autoscaler step failed: {e}")
+            stop.wait(interval)
+
+    def start(self, interval=30):
+        """
+        Run the autoscaler on a daemon thread
+        :return: threading.Event that stops it when set
+        """
+        stop = threading.Event()
+        threading.Thread(target=self.run, args=(interval, stop), name='autoscaler', daemon=True).start()
+        return stop
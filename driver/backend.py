@@ -0,0 +1,46 @@
+"""Execution backends of the CloudComputingApp."""
+
+
+class Backend:
+    """
+    Where the task and result queues live and how the workers are launched. The queue operations of the app
+    (get_queue, send_message_to_queue, get_messages_from_queue, purge_queue and delete_queues) run against the sqs
+    and sqs_client objects of the backend, which expose the subset of the boto3 SQS resource and client APIs used by
+    the app and the workers. Worker launch (initialise_instances and start_worker) is delegated to the backend.
+    """
+    sqs = None
+    sqs_client = None
+
+    def initialise_instances(self, app):
+        """
+        Bring up the workers of an app
+        :param app: CloudComputingApp whose workers to start
+        """
+        raise NotImplementedError
+
+    def start_worker(self, app, worker_id):
+        """
+        Start one worker pulling from the queues the app assigns to worker_id
+        :param app: CloudComputingApp the worker computes for
+        :param worker_id: index of the worker
+        """
+        raise NotImplementedError
+
+    def scale_workers(self, app, count):
+        """
+        Start or stop workers so that exactly workers 0 to count - 1 run
+        :param app: CloudComputingApp the workers compute for
+        :param count: number of workers
+        """
+        raise NotImplementedError
+
+    def terminate_instances(self):
+        """
+        Stop every worker started by the backend
+        """
+        raise NotImplementedError
+
+    def shutdown(self):
+        """
+        Stop the workers and release the resources of the backend
+        """
@@ -0,0 +1,313 @@
+"""Build matrix expressions lazily and run each in as few distributed passes as operator fusion allows."""
+import math
+import numbers
+from collections import namedtuple
+
+import numpy as np
+
+from files.matrix_store import BlockGrid
+
+# operation: 'addition' for a pass of one task per output block, 'multiplication' for a pass of partial products
+# summed per output tile
+# shape: shape of the output
+# block_shape: shape of an output block
+# inner_blocks: partial products summed into every output tile, 1 for an addition pass
+# dtype: dtype of the output
+# grids: BlockGrid of every matrix the tasks read blocks from
+# tasks: list of (block coordinates, list of (index in grids, block index) of the input blocks, program), see
+# worker.run_program for the programs
+FusedPass = namedtuple('FusedPass', ['operation', 'shape', 'block_shape', 'inner_blocks', 'dtype', 'grids', 'tasks'])
+
+
+# Expression nodes are tuples: ('leaf', BlockGrid), ('add', left, right), ('scale', factor, operand) and
+# ('matmul', left, right). Subtraction is an addition of the operand scaled by -1.
+
+def children(node):
+    kind = node[0]
+    if kind == 'leaf':
+        return ()
+    elif kind == 'scale':
+        return (node[2],)
+    return node[1:]
+
+
+def contains_product(node):
+    """
+    Whether a matrix product appears anywhere in an expression
+    """
+    return node[0] == 'matmul' or any(contains_product(child) for child in children(node))
+
+
+def shape_of(node):
+    kind = node[0]
+    if kind == 'leaf':
+        return tuple(node[1].matrix.shape)
+    elif kind == 'matmul':
+        return shape_of(node[1])[0], shape_of(node[2])[1]
+    return shape_of(children(node)[0])
+
+
+def leaves(node):
+    """
+    Leaf nodes of an expression, in order of appearance
+    """
+    if node[0] == 'leaf':
+        return [node]
+    return [leaf for child in children(node) for leaf in leaves(child)]
+
+
+def linear_terms(node, factor=1):
+    """
+    Expand the additions and scalings at the top of an expression
+    :return: list of (factor, leaf or product node), the expression is the sum of the scaled terms
+    """
+    kind = node[0]
+    if kind == 'add':
+        return linear_terms(node[1], factor) + linear_terms(node[2], factor)
+    elif kind == 'scale':
+        return linear_terms(node[2], factor * node[1])
+    return [(factor, node)]
+
+
+def scales(node):
+    """
+    Scaling nodes of an expression
+    """
+    own = [node] if node[0] == 'scale' else []
+    return own + [scale for child in children(node) for scale in scales(child)]
+
+
+def is_zero_program(program, zero_blocks):
+    """
+    Whether a program gives an all-zero block, without running it
+    :param program: program of a fused task
+    :param zero_blocks: whether each input block of the task is all zeros
+    """
+    if isinstance(program, int):
+        return zero_blocks[program]
+    operation, *args = program
+    if operation == 'add':
+        return is_zero_program(args[0], zero_blocks) and is_zero_program(args[1], zero_blocks)
+    elif operation == 'scale':
+        return args[0] == 0 or is_zero_program(args[1], zero_blocks)
+    return is_zero_program(args[0], zero_blocks) or is_zero_program(args[1], zero_blocks)
+
+
+def _scaled(factor, program):
+    return program if factor == 1 else ['scale', factor, program]
+
+
+def _sum(programs):
+    total = programs[0]
+    for program in programs[1:]:
+        total = ['add', total, program]
+    return total
+
+
+class _TaskInputs:
+    """
+    Input blocks of one task, each block listed once however often the program reads it
+    """
+
+    def __init__(self, grids):
+        self.grids = grids
+        self.refs = []
+
+    def ref(self, grid, row, col):
+        index = next((idx for idx, known in enumerate(self.grids) if known is grid), None)
+        if index is None:
+            index = len(self.grids)
+            self.grids.append(grid)
+        ref = (index, row * grid.grid_shape[1] + col)
+        if ref not in self.refs:
+            self.refs.append(ref)
+        return self.refs.index(ref)
+
+    def program(self, node, row, col):
+        """
+        Program computing block (row, col) of an element-wise expression
+        """
+        kind = node[0]
+        if kind == 'leaf':
+            return self.ref(node[1], row, col)
+        elif kind == 'add':
+            return ['add', self.program(node[1], row, col), self.program(node[2], row, col)]
+        elif kind == 'scale':
+            return ['scale', node[1], self.program(node[2], row, col)]
+        raise ValueError(f"{kind} is not element-wise")
+
+
+def plan_pass(node, block_size):
+    """
+    Fuse an expression whose products have no product in their operands into a single pass. Element-wise operations
+    on the operands of a product are computed by its partial product tasks, and the element-wise terms added to
+    products are computed by the first partial product of every output tile.
+    :param node: expression
+    :param block_size: edge of the square blocks every leaf is split into
+    :return: FusedPass
+    """
+    shape = shape_of(node)
+    terms = linear_terms(node)
+    products = [(factor, term) for factor, term in terms if term[0] == 'matmul']
+    elementwise = [(factor, term) for factor, term in terms if term[0] != 'matmul']
+    assert not any(contains_product(operand) for _, product in products for operand in product[1:]), \
+        "Product operands must be materialised before planning"
+    dtype = np.result_type(*[leaf[1].matrix.dtype for leaf in leaves(node)], *[scale[1] for scale in scales(node)])
+    if dtype.kind in 'biu':
+        # integer blocks are assembled as int64, see ResultAssembler
+        dtype = np.dtype(np.int64)
+    grid_rows, grid_cols = (math.ceil(size / block_size) for size in shape)
+    grids, tasks = [], []
+
+    def epilogue(inputs, row, col):
+        return [_scaled(factor, inputs.program(term, row, col)) for factor, term in elementwise]
+
+    if not products:
+        for row in range(grid_rows):
+            for col in range(grid_cols):
+                inputs = _TaskInputs(grids)
+                tasks.append(((row * grid_cols + col,), inputs.refs, _sum(epilogue(inputs, row, col))))
+        return FusedPass('addition', shape, (block_size, block_size), 1, dtype, grids, tasks)
+
+    inner = [math.ceil(shape_of(product[1])[1] / block_size) for _, product in products]
+    for row in range(grid_rows):
+        for col in range(grid_cols):
+            offset = 0
+            for (factor, (_, left, right)), inner_blocks in zip(products, inner):
+                # k varies fastest so the partial products of one output tile land on the same queue
+                for k in range(inner_blocks):
+                    inputs = _TaskInputs(grids)
+                    program = _scaled(factor, ['matmul', inputs.program(left, row, k), inputs.program(right, k, col)])
+                    if offset + k == 0 and elementwise:
+                        program = _sum([program] + epilogue(inputs, row, col))
+                    tasks.append(((row, col, offset + k), inputs.refs, program))
+                offset += inner_blocks
+    return FusedPass('multiplication', shape, (block_size, block_size), sum(inner), dtype, grids, tasks)
+
+
+class DistributedMatrix:
+    """
+    Matrix expression evaluated lazily on the workers of an app. Operators only build the expression graph, compute
+    runs it: additions, subtractions and scalings are fused into the block tasks producing or consuming them, so
+    (A + B) @ C + D runs as one pass of partial products reading blocks of A, B, C and D, and only the final result is
+    merged on the driver. A product whose operand is itself a product has that operand merged first.
+    """
+
+    def __init__(self, app, node, block_size):
+        """
+        :param app: CloudComputingApp running the passes
+        :param node: expression node
+        :param block_size: edge of the square blocks every matrix of the expression is split into
+        """
+        self.app = app
+        self.node = node
+        self.block_size = block_size
+
+    @property
+    def shape(self):
+        return shape_of(self.node)
+
+    def _check(self, other):
+        if not isinstance(other, DistributedMatrix):
+            return False
+        if other.app is not self.app or other.block_size != self.block_size:
+            raise ValueError("Matrices of an expression must share the app and the block size")
+        return True
+
+    def __add__(self, other):
+        if not self._check(other):
+            return NotImplemented
+        if self.shape != other.shape:
+            raise ValueError(f"Cannot add matrices of shapes {self.shape} and {other.shape}")
+        return DistributedMatrix(self.app, ('add', self.node, other.node), self.block_size)
+
+    def __sub__(self, other):
+        if not self._check(other):
+            return NotImplemented
+        return self + -other
+
+    def __neg__(self):
+        return self * -1
+
+    def __mul__(self, factor):
+        if not isinstance(factor, numbers.Real) or isinstance(factor, bool):
+            return NotImplemented
+        # the factor travels in the JSON header of the tasks
+        factor = factor.item() if isinstance(factor, np.generic) else factor
+        return DistributedMatrix(self.app, ('scale', factor, self.node), self.block_size)
+
+    __rmul__ = __mul__
+
+    def __matmul__(self, other):
+        if not self._check(other):
+            return NotImplemented
+        if self.shape[1] != other.shape[0]:
+            raise ValueError(f"Cannot multiply matrices of shapes {self.shape} and {other.shape}")
+        return DistributedMatrix(self.app, ('matmul', self.node, other.node), self.block_size)
+
+    def compute(self, filename=None):
+        """
+        Run the expression
+        :param filename: optional .npy file to assemble the result in through a memory map
+        :return: result array
+        """
+        return evaluate(self.app, self.node, self.block_size, filename)
+
+
+def materialise(app, node, block_size, memo):
+    """
+    Run the product operands that are themselves products, replacing each by a leaf over its merged result
+    :param memo: results already merged, by id of their node, so a shared operand is run once
+    :return: expression whose products have element-wise operands
+    """
+    kind = node[0]
+    if kind == 'leaf':
+        return node
+    elif kind == 'scale':
+        return 'scale', node[1], materialise(app, node[2], block_size, memo)
+    elif kind == 'add':
+        return 'add', materialise(app, node[1], block_size, memo), materialise(app, node[2], block_size, memo)
+
+    operands = []
+    for operand in node[1:]:
+        if contains_product(operand):
+            if id(operand) not in memo:
+                memo[id(operand)] = ('leaf', BlockGrid(evaluate(app, operand, block_size, memo=memo),
+                                                       (block_size, block_size)))
+            operand = memo[id(operand)]
+        operands.append(operand)
+    return ('matmul', *operands)
+
+
+def evaluate(app, node, block_size, filename=None, memo=None):
+    """
+    Run an expression, one pass per level of nested products
+    :param app: CloudComputingApp running the passes
+    :param node: expression node
+    :param block_size: edge of the square blocks
+    :param filename: optional .npy file to assemble the result in through a memory map
+    :param memo: results already merged, by id of their node
+    :return: result array
+    """
+    if node[0] == 'leaf' and filename is None:
+        return node[1].matrix
+    node = materialise(app, node, block_size, {} if memo is None else memo)
+    fused = plan_pass(node, block_size)
+    return app.submit_pass(fused, filename).result()
+
+
+def zero_tasks(fused, zero_blocks):
+    """
+    Separate the tasks of a pass whose result is all zeros
+    :param fused: FusedPass
+    :param zero_blocks: for every grid of the pass, whether each of its blocks is all zeros
+    :return: tuple of (tasks to send, coordinates of the skipped tasks)
+    """
+    sent, skipped = [], []
+    for task in fused.tasks:
+        coords, refs, program = task
+        if is_zero_program(program, [zero_blocks[grid][idx] for grid, idx in refs]):
+            skipped.append(coords)
+        else:
+            sent.append(task)
+    return sent, skipped
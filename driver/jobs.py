@@ -0,0 +1,151 @@
+"""Run several jobs at once over the shared queues, with their results routed by job id."""
+import threading
+import time
+from concurrent.futures import CancelledError
+
+from worker import queue_helper as qh
+
+
+class JobHandle:
+    """
+    A job submitted with CloudComputingApp.submit. Its result is assembled in the background as the router delivers it.
+    """
+
+    def __init__(self, job, assembler, trace, router):
+        """
+        :param job: job dict recorded by CloudComputingApp.prepare_job
+        :param assembler: ResultAssembler of the job
+        :param trace: JobTrace of the job
+        :param router: JobRouter delivering the results of the job
+        """
+        self.job = job
+        self.router = router
+        self.id = job['id']
+        self.assembler = assembler
+        self.trace = trace
+        # set when the job is cancelled, stops its straggler watch
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """
+        Stop assembling the job, its results are dropped as they arrive. Tasks already queued still run on the workers.
+        :return: False if the job had already completed
+        """
+        if self.assembler.done:
+            return False
+        self.cancel_event.set()
+        self.router.finish(self)
+        return True
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def done(self):
+        return self.assembler.done or self.cancelled()
+
+    @property
+    def progress(self):
+        """
+        Fraction of the tasks received, between 0 and 1
+        """
+        return self.assembler.progress
+
+    def result(self, timeout=None):
+        """
+        Wait for the job to complete
+        :param timeout: seconds to wait for, forever when not given
+        :return: merged array
+        """
+        if self.cancelled():
+            raise CancelledError(f"Job {self.id} was cancelled")
+        if not self.assembler.wait(timeout):
+            raise TimeoutError(f"Job {self.id} is {self.progress:.0%} done after {timeout} seconds")
+        return self.assembler.get_result()
+
+
+class JobRouter:
+    """
+    One poller thread per result queue, shared by every job in flight and running only while there is one. Each
+    result goes to the job named in its meta. Results of the jobs merged by merge_queue_result or the AsyncJobDriver
+    are left on the queue for them, results of finished or cancelled jobs are dropped.
+    """
+
+    def __init__(self, app, wait_time=qh.LONG_POLL_SECONDS):
+        """
+        :param app: CloudComputingApp whose result queues to poll
+        :param wait_time: seconds every receive long-polls for
+        """
+        self.app = app
+        self.wait_time = wait_time
+        self.dropped = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._stop = None
+        self._pollers = []
+
+    def register(self, handle):
+        """
+        Route the results of a job to its handle, starting the pollers on first use
+        """
+        with self._lock:
+            self._jobs[handle.id] = handle
+            if not self._pollers:
+                self._stop = threading.Event()
+                self._pollers = [threading.Thread(target=self.poll, args=(result_queue_name, self._stop), daemon=True,
+                                                  name=f'router-{result_queue_name}')
+                                 for _, result_queue_name in self.app.get_queue_names()]
+                for poller in self._pollers:
+                    poller.start()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def get(self, job_id):
+        """
+        :return: JobHandle of a job in flight, or None
+        """
+        return self._jobs.get(job_id)
+
+    def poll(self, result_queue_name, stop):
+        while not stop.is_set():
+            try:
+                messages = self.app.get_messages_from_queue(result_queue_name, wait_time=self.wait_time,
+                                                            job_ids=self._jobs)
+            except Exception:
+                # the queues are deleted by the teardown after closing the router
+                if stop.is_set():
+                    return
+                raise
+            received_at = time.time()
+            for message in messages:
+                handle = self._jobs.get(message.meta.get('job'))
+                if handle is None or handle.cancelled():
+                    self.dropped += 1
+                    continue
+                self.app.add_result(handle.assembler, message, received_at, handle.trace, handle.id)
+                if handle.assembler.done:
+                    self.finish(handle)
+
+    def finish(self, handle):
+        """
+        Stop routing the results of a job, and stop the pollers after the last job
+        """
+        with self._lock:
+            self.app.close_job(handle.id)
+            if self._jobs.pop(handle.id, None) is not None and handle.assembler.done:
+                print(f"Job {handle.id} done")
+                self.app.report_trace(handle.trace)
+            if not self._jobs:
+                self._stop_pollers()
+
+    def close(self):
+        """
+        Stop the pollers, each finishes its current receive in the background
+        """
+        with self._lock:
+            self._stop_pollers()
+
+    def _stop_pollers(self):
+        if self._stop is not None:
+            self._stop.set()
+        self._pollers = []
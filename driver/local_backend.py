@@ -0,0 +1,360 @@
+"""Run the workers in local processes over an in-memory stand-in for SQS."""
+import collections
+import importlib.util
+import itertools
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from multiprocessing.managers import BaseManager
+
+from driver.backend import Backend
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'worker')
+LOCAL_QUEUE_URL = 'local://queue/'
+
+DEFAULT_ATTRIBUTES = {
+    'DelaySeconds': '0',
+    'MessageRetentionPeriod': '86400',
+    'ReceiveMessageWaitTimeSeconds': '0',
+    'VisibilityTimeout': '30',
+}
+
+
+class QueueDoesNotExist(Exception):
+    pass
+
+
+class LocalQueueStore:
+    """
+    In-memory queues with the SQS semantics the app relies on: long polling, visibility timeouts and receipt handles.
+    A single store is served by a manager process and shared by the driver and every worker process.
+    """
+
+    def __init__(self):
+        self._queues = {}
+        self._condition = threading.Condition()
+        self._receipts = itertools.count()
+
+    def _get(self, name):
+        try:
+            return self._queues[name]
+        except KeyError:
+            raise QueueDoesNotExist(f"Queue {name} does not exist")
+
+    def _requeue_expired(self, queue, now):
+        """
+        Make in-flight messages whose visibility timeout has expired visible again
+        :return: seconds until the next in-flight message expires, or None
+        """
+        next_expiry = None
+        for receipt, (message_id, deadline) in list(queue['inflight'].items()):
+            if deadline <= now:
+                del queue['inflight'][receipt]
+                if message_id in queue['messages']:
+                    queue['ready'].append(message_id)
+            elif next_expiry is None or deadline - now < next_expiry:
+                next_expiry = deadline - now
+        return next_expiry
+
+    def create_queue(self, name, attributes=None):
+        with self._condition:
+            if name not in self._queues:
+                self._queues[name] = {'attributes': {**DEFAULT_ATTRIBUTES, **(attributes or {})},
+                                      'messages': {}, 'ready': collections.deque(), 'inflight': {}}
+        return LOCAL_QUEUE_URL + name
+
+    def queue_exists(self, name):
+        return name in self._queues
+
+    def list_queues(self, prefix=''):
+        return [LOCAL_QUEUE_URL + name for name in self._queues if name.startswith(prefix)]
+
+    def send(self, name, entries):
+        successful = []
+        with self._condition:
+            queue = self._get(name)
+            for entry in entries:
+                message_id = uuid.uuid4().hex
+                queue['messages'][message_id] = (entry['MessageBody'], entry.get('MessageAttributes', {}))
+                queue['ready'].append(message_id)
+                successful.append({'Id': entry['Id'], 'MessageId': message_id})
+            self._condition.notify_all()
+        return {'Successful': successful}
+
+    def receive(self, name, max_messages=1, wait_time=0, visibility_timeout=None):
+        """
+        Receive up to max_messages visible messages, waiting up to wait_time seconds for one to arrive
+        :return: list of (message id, receipt handle, body, message attributes)
+        """
+        deadline = time.monotonic() + wait_time
+        with self._condition:
+            while True:
+                queue = self._get(name)
+                now = time.monotonic()
+                next_expiry = self._requeue_expired(queue, now)
+                if queue['ready'] or now >= deadline:
+                    break
+                self._condition.wait(min(deadline - now, next_expiry if next_expiry is not None else deadline - now))
+
+            timeout = float(visibility_timeout if visibility_timeout is not None
+                            else queue['attributes']['VisibilityTimeout'])
+            received = []
+            while queue['ready'] and len(received) < max_messages:
+                message_id = queue['ready'].popleft()
+                if message_id not in queue['messages']:
+                    continue
+                receipt = f"{message_id}-{next(self._receipts)}"
+                queue['inflight'][receipt] = (message_id, now + timeout)
+                received.append((message_id, receipt) + queue['messages'][message_id])
+            return received
+
+    def delete(self, name, entries):
+        successful = []
+        failed = []
+        with self._condition:
+            queue = self._get(name)
+            for entry in entries:
+                inflight = queue['inflight'].pop(entry['ReceiptHandle'], None)
+                if inflight is None:
+                    failed.append({'Id': entry['Id'], 'SenderFault': True, 'Code': 'ReceiptHandleIsInvalid'})
+                    continue
+                queue['messages'].pop(inflight[0], None)
+                successful.append({'Id': entry['Id']})
+        return {'Successful': successful, 'Failed': failed} if failed else {'Successful': successful}
+
+    def change_visibility(self, name, entries):
+        successful = []
+        failed = []
+        with self._condition:
+            queue = self._get(name)
+            now = time.monotonic()
+            # like SQS, a message whose timeout has expired can no longer be extended
+            self._requeue_expired(queue, now)
+            for entry in entries:
+                inflight = queue['inflight'].get(entry['ReceiptHandle'])
+                if inflight is None:
+                    failed.append({'Id': entry['Id'], 'SenderFault': True, 'Code': 'ReceiptHandleIsInvalid'})
+                    continue
+                queue['inflight'][entry['ReceiptHandle']] = (inflight[0], now + float(entry['VisibilityTimeout']))
+                successful.append({'Id': entry['Id']})
+            # a shorter timeout can make messages visible to a waiting receiver
+            self._condition.notify_all()
+        return {'Successful': successful, 'Failed': failed} if failed else {'Successful': successful}
+
+    def purge(self, name):
+        with self._condition:
+            queue = self._get(name)
+            queue['messages'].clear()
+            queue['ready'].clear()
+            queue['inflight'].clear()
+
+    def delete_queue(self, name):
+        with self._condition:
+            self._get(name)
+            del self._queues[name]
+            self._condition.notify_all()
+
+    def get_attributes(self, name):
+        with self._condition:
+            queue = self._get(name)
+            self._requeue_expired(queue, time.monotonic())
+            return {**queue['attributes'],
+                    'ApproximateNumberOfMessages': str(len(queue['ready'])),
+                    'ApproximateNumberOfMessagesNotVisible': str(len(queue['inflight']))}
+
+
+class LocalQueueManager(BaseManager):
+    pass
+
+
+LocalQueueManager.register('LocalQueueStore', LocalQueueStore)
+
+
+def _queue_name(queue_url):
+    return queue_url[len(LOCAL_QUEUE_URL):] if queue_url.startswith(LOCAL_QUEUE_URL) else queue_url
+
+
+class LocalMessage:
+    """
+    Stand-in for a boto3 sqs.Message
+    """
+
+    def __init__(self, queue, message_id, receipt_handle, body, message_attributes):
+        self.queue = queue
+        self.message_id = message_id
+        self.receipt_handle = receipt_handle
+        self.body = body
+        self.message_attributes = message_attributes
+
+    def delete(self):
+        return self.queue.delete_messages(Entries=[{'Id': '0', 'ReceiptHandle': self.receipt_handle}])
+
+
+class LocalQueue:
+    """
+    Stand-in for a boto3 sqs.Queue
+    """
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.url = LOCAL_QUEUE_URL + name
+
+    @property
+    def attributes(self):
+        return self.store.get_attributes(self.name)
+
+    def send_messages(self, Entries):
+        return self.store.send(self.name, Entries)
+
+    def receive_messages(self, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None, **kwargs):
+        return [LocalMessage(self, *message) for message in
+                self.store.receive(self.name, MaxNumberOfMessages, WaitTimeSeconds, VisibilityTimeout)]
+
+    def delete_messages(self, Entries):
+        return self.store.delete(self.name, Entries)
+
+    def change_message_visibility_batch(self, Entries):
+        return self.store.change_visibility(self.name, Entries)
+
+    def purge(self):
+        self.store.purge(self.name)
+
+
+class LocalSQS:
+    """
+    In-process stand-in for both the boto3 SQS resource and the SQS client. It only holds a proxy to the shared
+    LocalQueueStore, so it can be passed to worker processes.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def create_queue(self, QueueName, Attributes=None):
+        self.store.create_queue(QueueName, Attributes)
+        return LocalQueue(self.store, QueueName)
+
+    def get_queue_by_name(self, QueueName):
+        if not self.store.queue_exists(QueueName):
+            raise QueueDoesNotExist(f"Queue {QueueName} does not exist")
+        return LocalQueue(self.store, QueueName)
+
+    def get_queue_url(self, QueueName):
+        if not self.store.queue_exists(QueueName):
+            raise QueueDoesNotExist(f"Queue {QueueName} does not exist")
+        return {'QueueUrl': LOCAL_QUEUE_URL + QueueName}
+
+    def list_queues(self, QueueNamePrefix='', **kwargs):
+        return {'QueueUrls': self.store.list_queues(QueueNamePrefix)}
+
+    def purge_queue(self, QueueUrl):
+        self.store.purge(_queue_name(QueueUrl))
+        return {}
+
+    def delete_queue(self, QueueUrl):
+        self.store.delete_queue(_queue_name(QueueUrl))
+        return {}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=('All',)):
+        attributes = self.store.get_attributes(_queue_name(QueueUrl))
+        if 'All' not in AttributeNames:
+            attributes = {name: value for name, value in attributes.items() if name in AttributeNames}
+        return {'Attributes': attributes}
+
+
+def run_worker(sqs, worker_id, queue_name, result_queue_name, log_file=None, cache_dir=None, cache_bytes=None,
+               store_bytes=None):
+    """
+    Process entry point running worker.perform_computation, imported the same way it is on an instance. Each worker
+    computes on a single thread: the workers already share the cores, and as daemon processes they cannot start a
+    process pool.
+    """
+    if log_file is not None:
+        sys.stdout = sys.stderr = open(log_file, 'a', buffering=1)
+    sys.path.insert(0, WORKER_DIR)
+    spec = importlib.util.spec_from_file_location('local_worker', os.path.join(WORKER_DIR, 'worker.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    cache = module.BlockCache(cache_dir, cache_bytes) if cache_dir else None
+    store = module.BlockStore(store_bytes) if store_bytes else None
+    module.perform_computation(sqs, worker_id, queue_name, result_queue_name, cache, processes=1, store=store)
+
+
+class LocalBackend(Backend):
+    """
+    Run every worker as a local process, with the queues held by a LocalQueueStore in a manager process. Uses all the
+    cores of one machine with the same driver code, and needs no network.
+    """
+
+    def __init__(self, log_dir=None, start_method='spawn'):
+        """
+        :param log_dir: optional directory for one worker-{id}.log per worker, output is inherited otherwise
+        :param start_method: multiprocessing start method of the worker processes
+        """
+        self.log_dir = log_dir
+        self._context = multiprocessing.get_context(start_method)
+        self._manager = LocalQueueManager(ctx=self._context)
+        self._manager.start()
+        self.sqs = LocalSQS(self._manager.LocalQueueStore())
+        self.sqs_client = self.sqs
+        self.workers = {}
+        # parent of the worker-{id} cache directories, created when the app asks for worker caches
+        self._cache_root = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def initialise_instances(self, app):
+        for idx in range(app.INSTANCE_SIZE):
+            app.start_worker(None, idx)
+
+    def start_worker(self, app, worker_id):
+        self.stop_worker(worker_id)
+        queue_name, result_queue_name = app.get_worker_queue_names(worker_id)
+        log_file = os.path.join(self.log_dir, f'worker-{worker_id}.log') if self.log_dir else None
+        cache_dir = None
+        if app.WORKER_CACHE_BYTES:
+            self._cache_root = self._cache_root or tempfile.mkdtemp(prefix='worker-cache-')
+            cache_dir = os.path.join(self._cache_root, f'worker-{worker_id}')
+        process = self._context.Process(target=run_worker, name=f'worker-{worker_id}', daemon=True,
+                                        args=(self.sqs, worker_id, queue_name, result_queue_name, log_file, cache_dir,
+                                              app.WORKER_CACHE_BYTES, app.WORKER_STORE_BYTES))
+        process.start()
+        self.workers[worker_id] = process
+        return process
+
+    def stop_worker(self, worker_id):
+        """
+        Stop a worker process, its in-flight tasks become visible again after the visibility timeout
+        """
+        process = self.workers.pop(worker_id, None)
+        if process is not None and process.is_alive():
+            process.terminate()
+            process.join()
+
+    def scale_workers(self, app, count):
+        for worker_id in range(count):
+            process = self.workers.get(worker_id)
+            if process is None or not process.is_alive():
+                app.start_worker(None, worker_id)
+        for worker_id in [worker_id for worker_id in self.workers if worker_id >= count]:
+            self.stop_worker(worker_id)
+
+    def terminate_instances(self):
+        for worker_id in list(self.workers):
+            self.stop_worker(worker_id)
+
+    def shutdown(self):
+        self.terminate_instances()
+        self._manager.shutdown()
+        if self._cache_root is not None:
+            shutil.rmtree(self._cache_root, ignore_errors=True)
+            self._cache_root = None
@@ -0,0 +1,177 @@
+"""Pick the block size of a distributed operation from a cost model of the queues and the workers."""
+import math
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from worker import codec, helper
+from worker import queue_helper as qh
+
+# largest message body SQS accepts
+MAX_MESSAGE_BYTES = qh.MAX_BATCH_BYTES
+
+# message_latency: seconds of fixed overhead per message round trip (send, receive and delete), whatever its size
+# bandwidth: bytes per second moved between the driver or a worker and SQS
+# compute_rate: multiply-adds (or additions) per second of one worker
+# sender_threads: concurrent batch sends of the driver
+CostModel = namedtuple('CostModel', ['message_latency', 'bandwidth', 'compute_rate', 'sender_threads'],
+                       defaults=(0.05, 50e6, 1e9, 8))
+
+# block_size: edge of the square blocks, the blocks of the last block row and column are smaller when it does not
+# divide the matrix
+# grid_shape: block grid of the output
+# tasks: number of task messages
+# message_bytes: body size of the largest task or result message
+# makespan: predicted seconds from the first send to the last result received
+# stages: predicted seconds of the 'send', 'compute' and 'receive' stages, which overlap
+BlockPlan = namedtuple('BlockPlan', ['block_size', 'grid_shape', 'tasks', 'message_bytes', 'makespan', 'stages'])
+
+
+def _edges(size, block_size):
+    """
+    Block lengths along one dimension and how many blocks have each
+    :return: list of (length, count)
+    """
+    edges = [(block_size, size // block_size)]
+    if size % block_size:
+        edges.append((size % block_size, 1))
+    return [(length, count) for length, count in edges if count]
+
+
+def _task_classes(operation, shape_a, shape_b, block_size):
+    """
+    Group the tasks of an operation by the shapes of their blocks
+    :return: tuple of (output grid shape, list of (operand shapes, result shape, operations per task, task count))
+    """
+    if operation == 'addition':
+        assert tuple(shape_a) == tuple(shape_b), f"Cannot add matrices of shapes {shape_a} and {shape_b}"
+        rows, cols = _edges(shape_a[0], block_size), _edges(shape_a[1], block_size)
+        grid = (sum(count for _, count in rows), sum(count for _, count in cols))
+        return grid, [([(r, c), (r, c)], (r, c), r * c, nr * nc) for r, nr in rows for c, nc in cols]
+    elif operation == 'multiplication':
+        assert shape_a[1] == shape_b[0], f"Cannot multiply matrices of shapes {shape_a} and {shape_b}"
+        rows, inner, cols = (_edges(size, block_size) for size in (shape_a[0], shape_a[1], shape_b[1]))
+        grid = (sum(count for _, count in rows), sum(count for _, count in cols))
+        return grid, [([(r, k), (k, c)], (r, c), r * k * c, nr * nk * nc)
+                      for r, nr in rows for k, nk in inner for c, nc in cols]
+    raise ValueError(f"Unknown operation {operation}")
+
+
+def _result_dtype(operation, dtype, inner, max_value):
+    """
+    Dtype of the result blocks the workers pick, from the bound of the result values
+    :param inner: inner edge of the block product, unused for an addition
+    :param max_value: largest absolute value of the matrices, the full range of an integer dtype when None
+    """
+    if dtype.kind not in 'biu':
+        return helper.result_dtype(dtype, dtype, 0)
+    if max_value is None:
+        max_value = 1 if dtype.kind == 'b' else max(-int(np.iinfo(dtype).min), int(np.iinfo(dtype).max))
+    bound = 2 * max_value if operation == 'addition' else max_value ** 2 * inner
+    # beyond int64 the workers raise OverflowError, the largest result they send is int64
+    return helper.result_dtype(dtype, dtype, min(bound, np.iinfo(np.int64).max))
+
+
+def predict(operation, shape_a, shape_b, dtype, workers, block_size, cost_model=None, result_queues=1,
+            result_dtype=None, max_value=None):
+    """
+    Predict the makespan of an operation split into square blocks of block_size. Workers take an equal share of the
+    tasks; each task costs the message latency, its task and result bytes over the bandwidth and its operations over
+    the compute rate. The driver sends in batches of ten on sender_threads and drains result_queues in parallel. The
+    three stages overlap, so the makespan is the slowest stage plus one task to fill and drain the pipeline.
+    :param operation: 'addition' or 'multiplication'
+    :param shape_a: shape of the first matrix
+    :param shape_b: shape of the second matrix
+    :param dtype: dtype of the matrices
+    :param workers: number of workers
+    :param block_size: edge of the square blocks
+    :param cost_model: CostModel, the defaults are used when not given
+    :param result_queues: number of result queues the driver drains
+    :param result_dtype: dtype of the result blocks, derived from the bound of the result values when not given
+    :param max_value: largest absolute value of the matrices, the full range of an integer dtype when not given
+    :return: BlockPlan
+    """
+    cost_model = cost_model or CostModel()
+    dtype = np.dtype(dtype)
+    grid, classes = _task_classes(operation, shape_a, shape_b, block_size)
+    # largest coordinates give the longest header
+    coords = (grid[0] - 1, grid[1] - 1, math.ceil(shape_a[1] / block_size) - 1) \
+        if operation == 'multiplication' else grid[0] * grid[1] - 1
+
+    tasks = task_bytes = result_bytes = task_seconds = message_bytes = 0
+    for operand_shapes, result_shape, operations, count in classes:
+        sent = codec.body_size(operation, coords, [(shape, dtype) for shape in operand_shapes])
+        block_dtype = np.dtype(result_dtype or _result_dtype(operation, dtype, operand_shapes[0][1], max_value))
+        received = codec.body_size('result', coords, [(result_shape, block_dtype)])
+        message_bytes = max(message_bytes, sent, received)
+        tasks += count
+        task_bytes += sent * count
+        result_bytes += received * count
+        task_seconds += count * (cost_model.message_latency + (sent + received) / cost_model.bandwidth +
+                                 operations / cost_model.compute_rate)
+
+    batches = math.ceil(tasks / qh.MAX_BATCH_ENTRIES)
+    mean_task = task_seconds / tasks
+    stages = {
+        'send': batches * cost_model.message_latency / cost_model.sender_threads + task_bytes / cost_model.bandwidth,
+        'compute': math.ceil(tasks / workers) * mean_task,
+        'receive': batches * cost_model.message_latency / result_queues + result_bytes / cost_model.bandwidth,
+    }
+    return BlockPlan(block_size, grid, tasks, message_bytes, max(stages.values()) + mean_task, stages)
+
+
+def plan_blocks(operation, shape_a, shape_b, dtype, workers, cost_model=None, result_queues=1, result_dtype=None,
+                max_message_bytes=MAX_MESSAGE_BYTES, max_value=None):
+    """
+    Find the block size with the smallest predicted makespan whose task and result messages fit in a message
+    :return: BlockPlan of the best block size
+    :raises ValueError: when even single element blocks do not fit
+    """
+    def fits(block_size):
+        plan = predict(operation, shape_a, shape_b, dtype, workers, block_size, cost_model, result_queues, result_dtype,
+                       max_value)
+        return plan.message_bytes <= max_message_bytes
+
+    # message size grows with the block size, find the largest block that fits with a binary search
+    low, high = 0, max(*shape_a, *shape_b)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    if low == 0:
+        raise ValueError(f"Blocks of {np.dtype(dtype)} do not fit in a {max_message_bytes} byte message")
+
+    plans = [predict(operation, shape_a, shape_b, dtype, workers, block_size, cost_model, result_queues, result_dtype,
+                     max_value)
+             for block_size in range(1, low + 1)]
+    return min(plans, key=lambda plan: (plan.makespan, -plan.block_size))
+
+
+def measure_compute_rate(dtype=np.int64, size=256, repeat=3):
+    """
+    Measure the multiply-adds per second of the local block product, to fill CostModel.compute_rate
+    """
+    matrix = np.random.randint(10, size=(size, size)).astype(dtype)
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        helper.matrix_dot_product(matrix, matrix)
+    return repeat * size ** 3 / (time.perf_counter() - start_time)
+
+
+def measure_message_latency(sqs, queue_name, samples=5):
+    """
+    Measure the seconds of one send, receive and delete round trip of a small message, to fill
+    CostModel.message_latency. Use a queue no worker reads from, such as a result queue.
+    """
+    queue = qh.get_queue(sqs, queue_name)
+    start_time = time.perf_counter()
+    for idx in range(samples):
+        queue.send_messages(Entries=[{'Id': f'{idx}', 'MessageBody': 'ping'}])
+        messages = []
+        while not messages:
+            messages = qh.receive_messages(queue, 1)
+        qh.delete_messages(queue, messages)
+    return (time.perf_counter() - start_time) / samples
@@ -0,0 +1,60 @@
+"""Decide when to re-enqueue the straggling tasks of a job."""
+import math
+import time
+
+
+class StragglerMonitor:
+    """
+    Watch the sent tasks of a job complete. When percentile % of them have completed, at t seconds into the job, the
+    tasks still outstanding at max(delay_factor * t, t + min_delay) seconds are re-enqueued, once. Whichever copy of a
+    task answers first is merged, the assembler drops the other one.
+    """
+
+    def __init__(self, assembler, started, percentile=90, delay_factor=1.5, min_delay=5, interval=0.5,
+                 clock=time.monotonic):
+        """
+        :param assembler: ResultAssembler of the job, with the skipped and cached tasks already filled in
+        :param started: clock time the tasks started being sent
+        :param percentile: share of the sent tasks, in percent, whose completion time sets the straggler deadline
+        :param delay_factor: deadline as a multiple of that completion time
+        :param min_delay: least seconds between reaching the percentile and re-enqueueing
+        :param interval: seconds between two checks
+        :param clock: time source, replaceable in tests
+        """
+        assert 0 < percentile < 100, "percentile must be between 0 and 100"
+        self.assembler = assembler
+        self.started = started
+        self.percentile = percentile
+        self.delay_factor = delay_factor
+        self.min_delay = min_delay
+        self.interval = interval
+        self.clock = clock
+        # tasks filled in before any result arrived do not count towards the percentile
+        self.prefilled = assembler.completed
+        # completions reaching the percentile, rounded down so a small job can still have a straggler
+        self.percentile_count = max(1, math.floor(percentile * (assembler.total - self.prefilled) / 100))
+        self.percentile_reached = None
+        self.speculated = False
+
+    @property
+    def deadline(self):
+        """
+        Seconds into the job after which the outstanding tasks are stragglers, None until the percentile is reached
+        """
+        if self.percentile_reached is None:
+            return None
+        return max(self.delay_factor * self.percentile_reached, self.percentile_reached + self.min_delay)
+
+    def poll(self):
+        """
+        Check the progress of the job
+        :return: True once, when the outstanding tasks should be re-enqueued
+        """
+        if self.speculated or self.assembler.done:
+            return False
+        elapsed = self.clock() - self.started
+        if self.percentile_reached is None and self.assembler.completed - self.prefilled >= self.percentile_count:
+            self.percentile_reached = elapsed
+        if self.deadline is not None and elapsed >= self.deadline:
+            self.speculated = True
+        return self.speculated
@@ -0,0 +1,152 @@
+"""Keep one SSH session per instance open for the lifetime of the cluster."""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+
+class SSHSessionManager:
+    """
+    Pool of SSH sessions keyed by host. The private key is read once, connections are retried with jittered
+    exponential backoff and kept alive so later commands (restarting workers, tailing logs, collecting metrics) reuse
+    the open transport instead of reconnecting.
+    """
+
+    def __init__(self, key_filename='labsuser.pem', username='ec2-user', max_attempts=5, base_delay=1.0,
+                 max_delay=30.0, connect_timeout=10, keepalive=30):
+        """
+        :param key_filename: private key used for every host
+        :param username: ssh user
+        :param max_attempts: connection attempts per host before giving up
+        :param base_delay: backoff before the second attempt, doubled after every failure
+        :param max_delay: cap of the backoff
+        :param connect_timeout: seconds allowed for one connection attempt
+        :param keepalive: seconds between keepalive packets on open transports
+        """
+        self.key_filename = key_filename
+        self.username = username
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.connect_timeout = connect_timeout
+        self.keepalive = keepalive
+        self.sessions = {}
+        self._pkey = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def pkey(self):
+        """
+        Private key, read from key_filename on first use only
+        """
+        with self._lock:
+            if self._pkey is None:
+                self._pkey = paramiko.RSAKey.from_private_key_file(self.key_filename)
+            return self._pkey
+
+    def backoff(self, attempt):
+        """
+        Seconds to wait after a failed attempt, drawn uniformly up to the capped exponential delay
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def connect_client(self, ssh, host, max_attempts=None):
+        """
+        Connect an existing ssh client to host, retrying with backoff
+        :param ssh: paramiko.SSHClient
+        :param host: host name or ip address
+        :param max_attempts: overrides the attempts of the manager
+        :return: True if the connection succeeded, False otherwise
+        """
+        max_attempts = self.max_attempts if max_attempts is None else max_attempts
+        for attempt in range(max_attempts):
+            try:
+                print('SSH into the instance: {}'.format(host))
+                ssh.connect(hostname=host, username=self.username, pkey=self.pkey, timeout=self.connect_timeout)
+                transport = ssh.get_transport()
+                if transport is not None:
+                    transport.set_keepalive(self.keepalive)
+                return True
+            except Exception as e:
+                print(e)
+                if attempt + 1 < max_attempts:
+                    print('Retrying SSH connection to {}'.format(host))
+                    time.sleep(self.backoff(attempt))
+        return False
+
+    def connect(self, host):
+        """
+        Get an open session to host, connecting when there is none or the transport has dropped
+        :param host: host name or ip address
+        :return: paramiko.SSHClient
+        """
+        with self._lock:
+            ssh = self.sessions.get(host)
+        if ssh is not None:
+            transport = ssh.get_transport()
+            if transport is not None and transport.is_active():
+                return ssh
+            ssh.close()
+
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        if not self.connect_client(ssh, host):
+            raise ConnectionError(f"Could not connect to {host} after {self.max_attempts} attempts")
+        with self._lock:
+            self.sessions[host] = ssh
+        return ssh
+
+    def connect_all(self, hosts):
+        """
+        Connect to every host in parallel
+        :param hosts: list of host names or ip addresses
+        :return: dict of host to paramiko.SSHClient, or to the exception raised while connecting
+        """
+        return dict(zip(hosts, self._map(self.connect, hosts)))
+
+    def exec(self, host, command, timeout=None):
+        """
+        Run a command on host over its open session and wait for it to finish
+        :return: tuple of (exit status, stdout, stderr)
+        """
+        stdin, stdout, stderr = self.connect(host).exec_command(command, timeout=timeout)
+        output = stdout.read().decode('utf-8')
+        error = stderr.read().decode('utf-8')
+        return stdout.channel.recv_exit_status(), output, error
+
+    def exec_all(self, hosts, command, timeout=None):
+        """
+        Run a command on every host in parallel
+        :return: dict of host to (exit status, stdout, stderr), or to the exception raised
+        """
+        return dict(zip(hosts, self._map(lambda host: self.exec(host, command, timeout), hosts)))
+
+    def _map(self, function, hosts):
+        def call(host):
+            try:
+                return function(host)
+            except Exception as e:
+                return e
+
+        if not hosts:
+            return []
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            return list(executor.map(call, hosts))
+
+    def close(self, host=None):
+        """
+        Close the session to host, or every session when no host is given
+        """
+        with self._lock:
+            hosts = [host] if host is not None else list(self.sessions)
+            sessions = [self.sessions.pop(h) for h in hosts if h in self.sessions]
+        for ssh in sessions:
+            ssh.close()
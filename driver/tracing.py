@@ -0,0 +1,94 @@
+"""Combine the timings carried by task and result messages into per-job statistics."""
+import threading
+
+import numpy as np
+
+# seconds between the driver encoding a task and a worker receiving it
+QUEUE_WAIT = 'queue_wait'
+# seconds the worker spent decoding the task
+DECODE = 'decode'
+# seconds the worker spent in the block kernel
+COMPUTE = 'compute'
+# seconds between the worker finishing the block and the driver receiving its result: encode, send, result queue
+TRANSFER = 'transfer'
+# seconds from the task being encoded to its result being received
+TOTAL = 'total'
+STAGES = [QUEUE_WAIT, DECODE, COMPUTE, TRANSFER, TOTAL]
+
+
+def task_meta(task_id, enqueued):
+    """
+    Header fields of a traced task message
+    :param task_id: index of the task in the job
+    :param enqueued: wall clock time the task is encoded at
+    """
+    return {'task': task_id, 'enqueued': enqueued}
+
+
+class JobTrace:
+    """
+    Timings of the tasks of one job, read from the meta of their result messages. Worker and driver clocks are
+    compared for the queue wait and transfer stages, so they assume clocks kept in sync (NTP on EC2).
+    """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, meta, received):
+        """
+        Add the timings of one result
+        :param meta: meta of the result message
+        :param received: wall clock time the driver received the result at
+        :return: dict of stage to seconds, None when the result carries no trace
+        """
+        if 'enqueued' not in meta or 'finished' not in meta:
+            return None
+        timings = {QUEUE_WAIT: meta['received'] - meta['enqueued'], DECODE: meta['decode'],
+                   COMPUTE: meta['compute'], TRANSFER: received - meta['finished'],
+                   TOTAL: received - meta['enqueued']}
+        with self._lock:
+            self.records.append(timings)
+        return timings
+
+    def __len__(self):
+        return len(self.records)
+
+    def values(self, stage):
+        """
+        Seconds of one stage for every traced task
+        """
+        return np.array([timings[stage] for timings in self.records])
+
+    def histogram(self, stage, bins=10):
+        """
+        Histogram of the seconds of one stage
+        :return: tuple of (counts, bin edges) as returned by np.histogram
+        """
+        return np.histogram(self.values(stage), bins=bins)
+
+    def summary(self):
+        """
+        Percentiles of every stage, and the share of the task time each of queue wait, compute and transfer takes
+        :return: dict of stage to {'p50', 'p90', 'p99', 'max', 'share'}
+        """
+        if not self.records:
+            return {}
+        totals = {stage: self.values(stage) for stage in STAGES}
+        total_time = max(totals[TOTAL].sum(), 1e-12)
+        summary = {}
+        for stage, values in totals.items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            summary[stage] = {'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(values.max()),
+                              'share': float(values.sum() / total_time)}
+        return summary
+
+    def bottleneck(self):
+        """
+        Stage taking the largest share of the task time: 'queue_wait' when tasks wait for a free worker, 'compute' when
+        the workers are CPU-bound, 'transfer' when moving the results is the slow part
+        """
+        summary = self.summary()
+        if not summary:
+            return None
+        return max((QUEUE_WAIT, DECODE, COMPUTE, TRANSFER), key=lambda stage: summary[stage]['share'])
@@ -3,11 +3,17 @@ from os import walk
 from typing import List
 
 
-def fetch_local_files(local_file_dir: str) -> List[str]:
+def fetch_local_files(local_file_dir: str, recursive: bool = False) -> List[str]:
     """
     Generate list of file paths.
     :param str local_file_dir: Local filepath of assets to SCP to host.
+    :param bool recursive: Also list the files of sub-directories, skipping __pycache__.
     :returns: List[str]
     """
+    paths = []
     for root, dirs, files in walk(local_file_dir):
-        return [f"{root}/{file}" for file in files]
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        paths += [f"{root}/{file}" for file in sorted(files)]
+        if not recursive:
+            break
+    return paths
@@ -0,0 +1,144 @@
+"""Store matrices on disk as memory-mapped .npy files or as directories of blocks."""
+import json
+import math
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+BLOCK_MANIFEST = 'manifest.json'
+
+
+def create_matrix(filename: str, shape: Tuple[int, int], dtype=np.int64) -> np.memmap:
+    """
+    Create a memory-mapped .npy file to write a matrix into.
+    :param str filename: path of the .npy file
+    :param shape: shape of the matrix
+    :param dtype: dtype of the matrix
+    :returns: np.memmap
+    """
+    return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=tuple(shape))
+
+
+def open_matrix(filename: str, mode: str = 'r') -> np.memmap:
+    """
+    Open a .npy file as a memory map, nothing is read until the data is accessed.
+    :param str filename: path of the .npy file
+    :param str mode: 'r' for read-only, 'r+' to update in place
+    :returns: np.memmap
+    """
+    return np.load(filename, mmap_mode=mode)
+
+
+def generate_matrix(filename: str, nrows: int, ncols: int, max_value: int = 10, chunk_rows: int = 1024,
+                    dtype=np.int64, density: Optional[float] = None) -> np.memmap:
+    """
+    Generate a random matrix straight into a memory-mapped .npy file, chunk_rows rows at a time, so the matrix never
+    has to fit in RAM.
+    :param str filename: path of the .npy file
+    :param int nrows: number of rows
+    :param int ncols: number of columns
+    :param int max_value: values are drawn from [0, max_value)
+    :param int chunk_rows: rows generated per step
+    :param float density: optional fraction of the elements drawn, the others are zero
+    :returns: np.memmap opened read-only
+    """
+    matrix = create_matrix(filename, (nrows, ncols), dtype)
+    for start in range(0, nrows, chunk_rows):
+        stop = min(start + chunk_rows, nrows)
+        chunk = np.random.randint(max_value, size=(stop - start, ncols))
+        if density is not None:
+            chunk[np.random.random_sample(chunk.shape) >= density] = 0
+        matrix[start:stop] = chunk
+    matrix.flush()
+    del matrix
+    return open_matrix(filename)
+
+
+def save_matrix(filename: str, matrix) -> str:
+    """
+    Write a matrix in binary form, as .npz when the filename asks for it and as .npy otherwise.
+    :param str filename: path of the file
+    :param matrix: matrix to write
+    :returns: path of the written file
+    """
+    if filename.endswith('.npz'):
+        np.savez(filename, result=matrix)
+        return filename
+    if not filename.endswith('.npy'):
+        filename += '.npy'
+    np.save(filename, matrix)
+    return filename
+
+
+class BlockGrid:
+    """
+    Sequence of the blocks of a matrix in row-major grid order. Blocks are views over the matrix, so splitting a
+    memory-mapped matrix reads nothing until a block is used.
+    """
+
+    def __init__(self, matrix, block_shape: Tuple[int, int]):
+        self.matrix = matrix
+        self.block_shape = tuple(block_shape)
+        self.grid_shape = tuple(math.ceil(size / block) for size, block in zip(matrix.shape, self.block_shape))
+
+    def __len__(self):
+        return self.grid_shape[0] * self.grid_shape[1]
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Block {idx} is out of range for a {self.grid_shape} grid")
+        return self.block(*divmod(idx, self.grid_shape[1]))
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+    def block(self, row: int, col: int):
+        """
+        View of the block at grid position (row, col)
+        """
+        nrows, ncols = self.block_shape
+        return self.matrix[row * nrows:(row + 1) * nrows, col * ncols:(col + 1) * ncols]
+
+
+def save_blocks(directory: str, matrix, block_shape: Tuple[int, int]) -> str:
+    """
+    Write a matrix as a directory of one .npy file per block plus a manifest describing the grid.
+    :param str directory: directory to write into, created if missing
+    :param matrix: matrix to write
+    :param block_shape: shape of a block
+    :returns: the directory
+    """
+    os.makedirs(directory, exist_ok=True)
+    grid = BlockGrid(matrix, block_shape)
+    for idx, block in enumerate(grid):
+        row, col = divmod(idx, grid.grid_shape[1])
+        np.save(os.path.join(directory, f'block-{row}-{col}.npy'), block)
+    with open(os.path.join(directory, BLOCK_MANIFEST), 'w') as f:
+        json.dump({'shape': list(matrix.shape), 'block_shape': list(grid.block_shape),
+                   'grid_shape': list(grid.grid_shape), 'dtype': np.dtype(matrix.dtype).str}, f)
+    return directory
+
+
+def load_block(directory: str, row: int, col: int, mmap_mode: str = 'r'):
+    """
+    Open one block of a directory-of-blocks matrix as a memory map.
+    """
+    return np.load(os.path.join(directory, f'block-{row}-{col}.npy'), mmap_mode=mmap_mode)
+
+
+def load_blocks(directory: str) -> np.ndarray:
+    """
+    Gather a directory-of-blocks matrix into a single array.
+    :param str directory: directory written by save_blocks
+    :returns: np.ndarray
+    """
+    with open(os.path.join(directory, BLOCK_MANIFEST)) as f:
+        manifest = json.load(f)
+    matrix = np.empty(manifest['shape'], dtype=manifest['dtype'])
+    grid = BlockGrid(matrix, manifest['block_shape'])
+    for row, col in np.ndindex(*grid.grid_shape):
+        grid.block(row, col)[...] = load_block(directory, row, col)
+    return matrix
@@ -0,0 +1,113 @@
+"""Build a versioned, content-addressed bundle of the worker to deploy to the instances."""
+import hashlib
+import os
+import subprocess
+import sys
+import zipfile
+from collections import namedtuple
+from typing import List, Optional
+
+from files.file_helper import fetch_local_files
+
+# packages the worker needs on the instance
+WORKER_REQUIREMENTS = ['numpy', 'boto3']
+# where the hash of the deployed bundle is recorded on the instance
+REMOTE_MANIFEST = '~/.worker-bundle.sha256'
+REMOTE_BUNDLE = 'worker.pyz'
+
+# zipapp entry point, runs worker.py from the archive with the command line arguments of the bundle
+_MAIN = b"import runpy\nrunpy.run_module('worker', run_name='__main__', alter_sys=True)\n"
+# fixed timestamp so identical contents always produce an identical archive
+_ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+WorkerBundle = namedtuple('WorkerBundle', ['path', 'sha256', 'requirements', 'wheels'])
+
+
+def _bundle_files(source_dir: str, wheels_dir: Optional[str]) -> List[tuple]:
+    """
+    List (archive name, local path) of everything that goes into the bundle, in a stable order.
+    """
+    files = [(os.path.relpath(path, source_dir).replace(os.sep, '/'), path)
+             for path in fetch_local_files(source_dir, recursive=True) if path.endswith('.py')]
+    if wheels_dir:
+        files += [(f"wheels/{os.path.basename(path)}", path)
+                  for path in fetch_local_files(wheels_dir) if path.endswith('.whl')]
+    return sorted(files)
+
+
+def hash_bundle_contents(source_dir: str, wheels_dir: Optional[str] = None,
+                         requirements: List[str] = WORKER_REQUIREMENTS) -> str:
+    """
+    Hash the names and contents of the files that make up a bundle, plus its requirements.
+    :param str source_dir: worker source directory
+    :param str wheels_dir: optional directory of wheels to vendor
+    :param requirements: packages installed from the wheels
+    :returns: hex sha256 digest
+    """
+    digest = hashlib.sha256()
+    digest.update(' '.join(requirements).encode('utf-8') + b'\0')
+    for name, path in _bundle_files(source_dir, wheels_dir):
+        digest.update(name.encode('utf-8') + b'\0')
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def build_worker_bundle(source_dir: str = './worker', output_dir: str = './build', wheels_dir: Optional[str] = None,
+                        requirements: List[str] = WORKER_REQUIREMENTS) -> WorkerBundle:
+    """
+    Build the worker zipapp. The archive holds the worker sources at its root, a __main__ running worker.py and,
+    when wheels_dir is given, the wheels under wheels/ so the instance can install the requirements offline.
+    An existing bundle with the same content hash is reused.
+    :param str source_dir: worker source directory
+    :param str output_dir: directory the bundle is written to
+    :param str wheels_dir: optional directory of wheels to vendor, see download_wheels
+    :param requirements: packages installed from the wheels
+    :returns: WorkerBundle
+    """
+    sha256 = hash_bundle_contents(source_dir, wheels_dir, requirements)
+    files = _bundle_files(source_dir, wheels_dir)
+    wheels = [name for name, _ in files if name.startswith('wheels/')]
+    path = os.path.join(output_dir, f'worker-{sha256[:12]}.pyz')
+    if not os.path.exists(path):
+        os.makedirs(output_dir, exist_ok=True)
+        partial = path + '.partial'
+        with open(partial, 'wb') as f:
+            f.write(b'#!/usr/bin/env python3\n')
+            with zipfile.ZipFile(f, 'w') as archive:
+                archive.writestr(zipfile.ZipInfo('__main__.py', _ZIP_DATE), _MAIN, zipfile.ZIP_DEFLATED)
+                for name, local_path in files:
+                    with open(local_path, 'rb') as source:
+                        # wheels are already compressed
+                        compression = zipfile.ZIP_STORED if name.startswith('wheels/') else zipfile.ZIP_DEFLATED
+                        archive.writestr(zipfile.ZipInfo(name, _ZIP_DATE), source.read(), compression)
+        os.replace(partial, path)
+    return WorkerBundle(path, sha256, list(requirements), wheels)
+
+
+def download_wheels(wheels_dir: str, requirements: List[str] = WORKER_REQUIREMENTS,
+                    platform: str = 'manylinux2014_x86_64', python_version: str = '3.9') -> str:
+    """
+    Download the wheels of the requirements for the instance platform, to vendor them into the bundle.
+    :param str wheels_dir: directory to download into
+    :param requirements: packages to download, with their dependencies
+    :param str platform: pip platform tag of the instances
+    :param str python_version: python version of the instances
+    :returns: the wheels directory
+    """
+    subprocess.run([sys.executable, '-m', 'pip', 'download', '--only-binary=:all:', '--platform', platform,
+                    '--python-version', python_version, '-d', wheels_dir, *requirements], check=True)
+    return wheels_dir
+
+
+def remote_install_command(bundle: WorkerBundle) -> str:
+    """
+    Shell command installing the requirements of a bundle uploaded to the instance home directory.
+    """
+    if not bundle.wheels:
+        return f"sudo yum install pip -y && sudo pip install {' '.join(bundle.requirements)}"
+    return (f"rm -rf ~/worker-bundle && python3 -m zipfile -e ~/{REMOTE_BUNDLE} ~/worker-bundle && "
+            f"sudo python3 -m pip install --no-index --find-links ~/worker-bundle/wheels "
+            f"{' '.join(bundle.requirements)}")
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from driver.assembler import ResultAssembler
+from worker import codec
+from worker.sparse import CSRMatrix
+
+
+class TestResultAssembler(unittest.TestCase):
+    def test_out_of_order_addition(self):
+        matrix = np.arange(36).reshape(6, 6)
+        assembler = ResultAssembler((6, 6), (2, 3), 'addition')
+        blocks = [(idx, matrix[row * 2:row * 2 + 2, col * 3:col * 3 + 3])
+                  for idx, (row, col) in enumerate(np.ndindex(3, 2))]
+
+        for idx, block in reversed(blocks):
+            self.assertTrue(assembler.add(codec.Message('result', (idx,), [block], {})))
+            self.assertFalse(assembler.add(codec.Message('result', (idx,), [block], {})))
+
+        self.assertTrue(assembler.done)
+        self.assertEqual(assembler.progress, 1.0)
+        self.assertEqual(np.array_equal(assembler.get_result(), matrix), True)
+
+    def test_multiplication_partials(self):
+        assembler = ResultAssembler((2, 2), (1, 1), 'multiplication', inner_blocks=2)
+        assembler.add(codec.Message('result', (0, 0, 0), [np.array([[1]])], {}))
+        assembler.add(codec.Message('result', (0, 0, 1), [np.array([[2]])], {}))
+        assembler.add(codec.Message('result', (0, 0, 1), [np.array([[2]])], {}))
+        self.assertEqual(assembler.completed, 2)
+        self.assertEqual(assembler.progress, 0.25)
+        self.assertFalse(assembler.wait(timeout=0))
+        self.assertEqual(assembler.get_result()[0, 0], 3)
+
+    def test_sparse_blocks_and_skipped_tasks(self):
+        addition = ResultAssembler((4, 4), (2, 2), 'addition')
+        addition.skip((0,))
+        addition.add(codec.Message('result', (1,), [CSRMatrix.from_dense(np.eye(2, dtype=np.int64))], {}))
+        addition.add(codec.Message('result', (2,), [np.full((2, 2), 3)], {}))
+        self.assertFalse(addition.skip((2,)))
+        addition.skip((3,))
+        self.assertTrue(addition.done)
+        expected = np.zeros((4, 4), dtype=np.int64)
+        expected[0:2, 2:4] = np.eye(2)
+        expected[2:4, 0:2] = 3
+        self.assertEqual(np.array_equal(addition.get_result(), expected), True)
+
+        multiplication = ResultAssembler((2, 2), (2, 2), 'multiplication', inner_blocks=2)
+        multiplication.skip((0, 0, 0))
+        multiplication.add(codec.Message('result', (0, 0, 1), [CSRMatrix.from_dense(np.eye(2, dtype=np.int64))], {}))
+        self.assertTrue(multiplication.done)
+        self.assertEqual(np.array_equal(multiplication.get_result(), np.eye(2)), True)
+
+    def test_all_tasks_skipped(self):
+        assembler = ResultAssembler((2, 2), (1, 1), 'addition')
+        for idx in range(4):
+            assembler.skip((idx,))
+        self.assertEqual(np.array_equal(assembler.get_result(), np.zeros((2, 2))), True)
+
+    def test_memmap_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'result.npy')
+            assembler = ResultAssembler((2, 2), (2, 2), 'addition', dtype=np.int64, filename=filename)
+            assembler.add(codec.Message('result', (0,), [np.eye(2, dtype=np.int64)], {}))
+            self.assertIsInstance(assembler.get_result(), np.memmap)
+            del assembler
+            self.assertEqual(np.array_equal(np.load(filename), np.eye(2)), True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+import numpy as np
+from CloudComputing import CloudComputingApp
+from driver.async_driver import AsyncJobDriver
+from driver.backend import Backend
+from driver.local_backend import LocalQueueStore, LocalSQS, QueueDoesNotExist
+from worker import codec, helper
+from worker import queue_helper as qh
+from app_support import REAL_METHODS
+
+
+class ThreadBackend(Backend):
+    """
+    Queues in the test process, with a worker thread answering the tasks and recording how many were in flight at once.
+    The first delivery of the tasks in stuck is never answered, as by a stuck worker.
+    """
+    def __init__(self, stuck=()):
+        self.sqs = self.sqs_client = LocalSQS(LocalQueueStore())
+        self.stop = threading.Event()
+        self.max_held = 0
+        self.stuck = set(stuck)
+        self.kernels = {'addition': helper.matrix_add, 'multiplication': helper.matrix_dot_product}
+
+    def initialise_instances(self, app):
+        threading.Thread(target=self.run_worker, args=app.get_worker_queue_names(0), daemon=True).start()
+
+    def run_worker(self, queue_name, result_queue_name):
+        try:
+            self.answer_tasks(queue_name, result_queue_name)
+        except QueueDoesNotExist:
+            # the queues were deleted by the teardown
+            pass
+
+    def answer_tasks(self, queue_name, result_queue_name):
+        tasks = self.sqs.get_queue_by_name(QueueName=queue_name)
+        results = self.sqs.get_queue_by_name(QueueName=result_queue_name)
+        while not self.stop.is_set():
+            # hold every task the driver has sent before answering them, so they count as in flight
+            held = []
+            while True:
+                messages = tasks.receive_messages(MaxNumberOfMessages=10, WaitTimeSeconds=0.05)
+                if not messages:
+                    break
+                held += messages
+            self.max_held = max(self.max_held, len(held))
+            stuck = [message for message in held if codec.decode_header(message.body).coords in self.stuck]
+            for message in stuck:
+                self.stuck.discard(codec.decode_header(message.body).coords)
+            held = [message for message in held if message not in stuck]
+            for start in range(0, len(held), 10):
+                entries = []
+                for message in held[start:start + 10]:
+                    task = codec.decode_body(message.body)
+                    entries.append({'Id': f'{len(entries)}', 'MessageBody': codec.encode_body(
+                        'result', task.coords, [self.kernels[task.operation](*task.blocks)], task.meta)})
+                results.send_messages(Entries=entries)
+                tasks.delete_messages(Entries=[{'Id': f'{idx}', 'ReceiptHandle': message.receipt_handle}
+                                               for idx, message in enumerate(held[start:start + 10])])
+
+    def terminate_instances(self):
+        self.stop.set()
+
+    def shutdown(self):
+        self.stop.set()
+
+
+class TestAsyncJobDriver(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.multiple(CloudComputingApp, **REAL_METHODS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.start()
+
+    def start(self, stuck=()):
+        self.backend = ThreadBackend(stuck)
+        self.app = CloudComputingApp(instance_size=1, scheduling='shared', backend=self.backend)
+        self.app.SPECULATION_OPTIONS.update(min_delay=0.2)
+        self.app.prepare_architecture()
+        self.addCleanup(self.app.teardown_infrastructure)
+
+    def test_run_bounds_tasks_in_flight(self):
+        matrix_a = np.arange(64).reshape(8, 8)
+        matrix_b = np.arange(64).reshape(8, 8) % 7
+        split_a = self.app.split_row(matrix_a, 2, 2)
+        split_b = self.app.split_row(matrix_b, 2, 2)
+
+        driver = AsyncJobDriver(self.app, max_in_flight=10, wait_time=0.1)
+        result = asyncio.run(driver.run('multiplication', split_a, split_b, 8, 2))
+        self.assertEqual(np.array_equal(result, matrix_a @ matrix_b), True)
+        self.assertEqual(self.backend.max_held, 10)
+
+    def test_run_reenqueues_stragglers(self):
+        self.start(stuck=[(0, 1, 1)])
+        matrix = np.arange(36).reshape(6, 6)
+        split = self.app.split_row(matrix, 2, 2)
+        result = asyncio.run(AsyncJobDriver(self.app, wait_time=0.1).run('multiplication', split, split, 6, 2))
+        self.assertEqual(np.array_equal(result, matrix @ matrix), True)
+        self.assertEqual(self.backend.stuck, set())
+
+    def test_merge_reenqueues_stragglers(self):
+        self.start(stuck=[(3,)])
+        matrix = np.arange(36).reshape(6, 6)
+        split = self.app.split_row(matrix, 2, 2)
+        self.app.compute_matrix_operation('addition', split, split)
+        with patch.object(self.app, 'get_messages_from_queue',
+                          side_effect=lambda queue, job_ids: CloudComputingApp.get_messages_from_queue(
+                              self.app, queue, wait_time=0.1, job_ids=job_ids)):
+            result = self.app.merge_queue_result(split, 6, 2, 'addition')
+        self.assertEqual(np.array_equal(result, matrix + matrix), True)
+        self.assertEqual(self.backend.stuck, set())
+
+    def test_run_raises_failed_send(self):
+        matrix = np.arange(64).reshape(8, 8)
+        split = self.app.split_row(matrix, 2, 2)
+        send_batch = qh.BatchSender._send_batch
+        batches = []
+
+        def fail_second_batch(sender, queue, batch):
+            batches.append(batch)
+            if len(batches) == 2:
+                raise RuntimeError("Failed to send")
+            return send_batch(sender, queue, batch)
+
+        # the window stays full of the tasks of the failed batch, the error is raised instead of waiting for it
+        driver = AsyncJobDriver(self.app, max_in_flight=10, wait_time=0.1)
+        with patch.object(qh.BatchSender, '_send_batch', fail_second_batch), self.assertRaises(RuntimeError):
+            asyncio.run(driver.run('multiplication', split, split, 8, 2))
+        self.assertEqual(len(batches), 2)
+
+    def test_window_must_hold_a_batch(self):
+        with self.assertRaises(AssertionError):
+            AsyncJobDriver(self.app, max_in_flight=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import Mock
+from driver.autoscaler import QueueDepthAutoscaler
+from driver.local_backend import LocalBackend, LocalQueueStore, LocalSQS
+
+
+class FakeApp:
+    """
+    Stands in for the CloudComputingApp, scale_workers only records the requested fleet size
+    """
+    def __init__(self, instance_size=1, scheduling='shared'):
+        self.INSTANCE_SIZE = instance_size
+        self.SCHEDULING = scheduling
+        self.sqs_client = LocalSQS(LocalQueueStore())
+        self.sqs_client.create_queue(QueueName='queue-shared', Attributes={'VisibilityTimeout': '30'})
+        self.scaled = []
+
+    def get_queue_names(self):
+        return [('queue-shared', 'result-queue-shared')]
+
+    def scale_workers(self, count):
+        self.scaled.append(count)
+        self.INSTANCE_SIZE = count
+
+    def enqueue(self, count):
+        queue = self.sqs_client.get_queue_by_name(QueueName='queue-shared')
+        for start in range(0, count, 10):
+            queue.send_messages(Entries=[{'Id': str(i), 'MessageBody': 'task'}
+                                         for i in range(start, min(start + 10, count))])
+
+
+class TestQueueDepthAutoscaler(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.app = FakeApp()
+        self.autoscaler = QueueDepthAutoscaler(self.app, target_backlog_per_worker=10, min_workers=1, max_workers=4,
+                                               scale_out_cooldown=60, scale_in_cooldown=300,
+                                               clock=lambda: self.now)
+
+    def test_get_backlog(self):
+        self.app.enqueue(25)
+        self.app.sqs_client.get_queue_by_name(QueueName='queue-shared').receive_messages(MaxNumberOfMessages=5)
+        self.assertEqual(self.autoscaler.get_backlog(), (20, 5))
+
+    def test_desired_workers(self):
+        self.assertEqual(self.autoscaler.desired_workers(0), 1)
+        self.assertEqual(self.autoscaler.desired_workers(21), 3)
+        self.assertEqual(self.autoscaler.desired_workers(1000), 4)
+
+    def test_scale_out_and_in_with_cooldowns(self):
+        self.app.enqueue(25)
+        self.assertEqual(self.autoscaler.step()['action'], 'scale-out')
+        self.assertEqual(self.app.INSTANCE_SIZE, 3)
+
+        self.app.enqueue(20)
+        self.now = 30
+        self.assertEqual(self.autoscaler.step()['action'], 'cooldown')
+        self.now = 60
+        self.assertEqual(self.autoscaler.step()['action'], 'scale-out')
+        self.assertEqual(self.app.INSTANCE_SIZE, 4)
+
+        self.app.sqs_client.purge_queue(QueueUrl='local://queue/queue-shared')
+        self.now = 120
+        self.assertEqual(self.autoscaler.step()['action'], 'cooldown')
+        self.now = 360
+        self.assertEqual(self.autoscaler.step()['action'], 'scale-in')
+        self.assertEqual(self.app.scaled, [3, 4, 1])
+        self.assertEqual(self.autoscaler.step()['action'], 'none')
+
+    def test_static_scheduling_rejected(self):
+        with self.assertRaises(ValueError):
+            QueueDepthAutoscaler(FakeApp(scheduling='static'))
+
+
+class TestLocalBackendScaling(unittest.TestCase):
+    def test_scale_workers(self):
+        with LocalBackend() as backend:
+            app = Mock()
+            app.start_worker.side_effect = lambda ssh, worker_id: backend.workers.__setitem__(worker_id, Mock())
+            backend.scale_workers(app, 3)
+            self.assertEqual(sorted(backend.workers), [0, 1, 2])
+
+            stopped = backend.workers[2]
+            backend.scale_workers(app, 2)
+            self.assertEqual(sorted(backend.workers), [0, 1])
+            stopped.terminate.assert_called_once()
+            self.assertEqual(app.start_worker.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
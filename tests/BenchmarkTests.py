@@ -0,0 +1,33 @@
+import unittest
+from unittest.mock import patch
+from benchmarks import pipeline
+from CloudComputing import CloudComputingApp
+from app_support import REAL_METHODS
+
+
+class TestPipelineBenchmark(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.multiple(CloudComputingApp, **REAL_METHODS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_run_case(self):
+        result = pipeline.run_case(size=10, block_size=4, workers=2, operation='multiplication', repeat=2)
+        self.assertEqual(result['tasks'], 27)
+        self.assertEqual(len(result['runs']), 2)
+        self.assertEqual(sorted(result['median']), sorted(pipeline.STAGES))
+        self.assertEqual(all(seconds >= 0 for seconds in result['median'].values()), True)
+        self.assertEqual(result['peak_rss_kb']['driver'] > 0, True)
+
+    def test_sweep_skips_blocks_larger_than_the_matrix(self):
+        with patch.object(pipeline, 'run_case', return_value={}) as run_case:
+            report = pipeline.sweep([4, 8], [8], [1], ['addition'], in_process=True)
+        self.assertEqual(len(report['results']), 1)
+        run_case.assert_called_once_with(size=8, block_size=8, workers=1, operation='addition', scheduling='shared',
+                                         repeat=1, compression=None, narrow=False)
+        self.assertEqual(sorted(report['environment']),
+                         ['commit', 'cpu_count', 'numpy', 'platform', 'python'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+import numpy as np
+from worker import codec, sparse
+from worker.block_store import BlockStore, resolve_blocks
+
+
+class TestBlockStore(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        store = BlockStore(3 * 128)
+        for key in 'abc':
+            store.put(key, np.ones((4, 4)))
+        store.get('a')
+        store.put('d', np.ones((4, 4)))
+        self.assertEqual(['b' in store, 'a' in store, len(store), store.size], [False, True, 3, 3 * 128])
+        self.assertIsNone(store.get('b'))
+        self.assertEqual((store.hits, store.misses), (1, 1))
+
+        self.assertEqual(store.put('e', np.ones((16, 16))), False)
+        store.put('f', sparse.CSRMatrix.from_dense(np.eye(4)))
+        store.discard('f')
+        self.assertEqual(('f' in store, store.size), (False, 2 * 128))
+
+    def test_resolve_blocks(self):
+        store = BlockStore(1 << 10)
+        store.put('a', np.eye(2))
+        body = codec.encode_body('multiplication', (0, 0, 0), [np.ones((2, 2))])
+        meta = {'block_keys': ['a', 'b'], 'inline': [False, True]}
+        blocks = resolve_blocks(store, body, meta)
+        self.assertEqual(np.array_equal(blocks[0] @ blocks[1], np.ones((2, 2))), True)
+        self.assertEqual('b' in store, True)
+
+        meta = {'block_keys': ['c', 'b'], 'inline': [False, False]}
+        self.assertIsNone(resolve_blocks(store, codec.encode_body('multiplication', (0, 0, 0), []), meta))
+        self.assertIsNone(resolve_blocks(None, body, {'block_keys': ['a', 'b'], 'inline': [False, True]}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from worker import sparse
+from worker.cache import BlockCache, block_digest, task_key
+
+
+class TestBlockDigest(unittest.TestCase):
+    def test_digest_depends_on_dtype_shape_and_values(self):
+        block = np.arange(6).reshape(2, 3)
+        self.assertEqual(block_digest(block), block_digest(block.copy()))
+        self.assertEqual(block_digest(block.T), block_digest(np.ascontiguousarray(block.T)))
+        self.assertNotEqual(block_digest(block), block_digest(block.reshape(3, 2)))
+        self.assertNotEqual(block_digest(block), block_digest(block.astype(np.int32)))
+        self.assertNotEqual(block_digest(block), block_digest(sparse.CSRMatrix.from_dense(block)))
+
+    def test_task_key(self):
+        digests = [block_digest(np.eye(2)), block_digest(np.ones((2, 2)))]
+        self.assertNotEqual(task_key('addition', digests), task_key('multiplication', digests))
+        self.assertNotEqual(task_key('addition', digests), task_key('addition', digests[::-1]))
+
+
+class TestBlockCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_get_put(self):
+        cache = BlockCache(self.directory.name)
+        block = np.arange(16).reshape(4, 4)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', block)
+        self.assertEqual('a' in cache, True)
+        self.assertEqual(np.array_equal(cache.get('a'), block), True)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.put('b', sparse.CSRMatrix.from_dense(np.eye(4)))
+        self.assertEqual(np.array_equal(cache.get('b').to_dense(), np.eye(4)), True)
+
+    def test_lru_eviction(self):
+        blocks = {key: np.random.default_rng(i).random((16, 16)) for i, key in enumerate('abc')}
+        cache = BlockCache(self.directory.name)
+        cache.put('a', blocks['a'])
+        cache.max_bytes = cache.size * 2
+        cache.put('b', blocks['b'])
+        cache.get('a')
+        cache.put('c', blocks['c'])
+        self.assertEqual(['a' in cache, 'b' in cache, 'c' in cache], [True, False, True])
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ['a.block', 'c.block'])
+
+        cache.pin(['a'])
+        cache.put('b', blocks['b'])
+        self.assertEqual(['a' in cache, 'b' in cache, 'c' in cache], [True, True, False])
+
+    def test_reopen(self):
+        BlockCache(self.directory.name).put('a', np.ones((2, 2)))
+        cache = BlockCache(self.directory.name)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(np.array_equal(cache.get('a'), np.ones((2, 2))), True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import numpy as np
+from worker import codec, sparse
+
+
+class TestCodec(unittest.TestCase):
+    def test_round_trip(self):
+        matrix_a = np.arange(12, dtype=np.int64).reshape(3, 4)
+        matrix_b = np.arange(6, dtype=np.float32).reshape(2, 3)
+        message = codec.decode_message(codec.encode_message('addition', (1, 2), [matrix_a, matrix_b], {'k': 'v'}))
+
+        self.assertEqual(message.operation, 'addition')
+        self.assertEqual(message.coords, (1, 2))
+        self.assertEqual(message.meta, {'k': 'v'})
+        self.assertEqual(message.blocks[0].dtype, np.int64)
+        self.assertEqual(message.blocks[1].dtype, np.float32)
+        self.assertEqual(np.array_equal(message.blocks[0], matrix_a), True)
+        self.assertEqual(np.array_equal(message.blocks[1], matrix_b), True)
+
+    def test_round_trip_body(self):
+        matrix = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        body = codec.encode_body('result', 4, [matrix])
+        self.assertIsInstance(body, str)
+
+        message = codec.decode_body(body)
+        self.assertEqual(message.coords, (4,))
+        self.assertEqual(np.array_equal(message.blocks[0], matrix), True)
+
+    def test_decode_header(self):
+        body = codec.encode_body('multiplication', (1, 2, 3), [np.ones((8, 8)), np.eye(8)], {'cache_key': 'k'},
+                                 compression='zlib')
+        self.assertEqual(codec.decode_header(body), ('multiplication', (1, 2, 3), [], {'cache_key': 'k'}))
+
+    def test_decode_is_zero_copy(self):
+        frame = codec.encode_message('addition', 0, [np.ones((4, 4))])
+        block = codec.decode_message(frame).blocks[0]
+        self.assertFalse(block.flags.owndata)
+        self.assertEqual(block.ctypes.data % 8, np.frombuffer(frame, np.uint8).ctypes.data % 8)
+
+    def test_non_contiguous_block(self):
+        matrix = np.arange(16).reshape(4, 4)[:, 1:3]
+        block = codec.decode_message(codec.encode_message('addition', 0, [matrix])).blocks[0]
+        self.assertEqual(np.array_equal(block, matrix), True)
+
+    def test_body_size(self):
+        matrix_a = np.ones((5, 7), dtype=np.int32)
+        matrix_b = np.ones((7, 3), dtype=np.uint8)
+        body = codec.encode_body('multiplication', (10, 2, 3), [matrix_a, matrix_b], {'k': 'v'})
+        self.assertEqual(codec.body_size('multiplication', (10, 2, 3), [((5, 7), np.int32), ((7, 3), np.uint8)],
+                                         {'k': 'v'}), len(body))
+
+    def test_compression(self):
+        matrix = np.random.randint(10, size=(64, 64))
+        raw = codec.encode_message('addition', 0, [matrix, matrix])
+        for compression in ('zlib', 'lzma', 'auto'):
+            frame = codec.encode_message('addition', 0, [matrix, matrix], compression=compression)
+            self.assertEqual(len(frame) < len(raw) / 2, True)
+            message = codec.decode_message(frame)
+            self.assertEqual(np.array_equal(message.blocks[1], matrix), True)
+        # small payloads are not worth compressing
+        self.assertEqual(codec.encode_message('result', 0, [np.eye(2)], compression='auto'),
+                         codec.encode_message('result', 0, [np.eye(2)]))
+        with self.assertRaises(ValueError):
+            codec.encode_message('result', 0, [np.eye(2)], compression='brotli')
+
+    def test_narrowing(self):
+        matrix = np.random.randint(10, size=(8, 8))
+        signed = np.full((2, 2), -300)
+        message = codec.decode_message(codec.encode_message('addition', 0, [matrix, signed, np.ones(3)], narrow=True))
+        self.assertEqual([block.dtype for block in message.blocks], [np.int8, np.int16, np.float64])
+        self.assertEqual(np.array_equal(message.blocks[0], matrix), True)
+        self.assertEqual(np.array_equal(message.blocks[1], signed), True)
+        self.assertEqual(codec.narrow_dtype(np.array([0, 200], dtype=np.int64)), np.uint8)
+        self.assertEqual(codec.narrow_dtype(np.array([2 ** 40])), np.int64)
+
+    def test_sparse_blocks(self):
+        matrix = np.zeros((16, 16), dtype=np.int64)
+        matrix[3, 4], matrix[10, 0] = 7, -2
+        frame = codec.encode_message('addition', 0, [matrix, np.ones((16, 16))], sparse=True, narrow=True)
+        self.assertEqual(len(frame) < len(codec.encode_message('addition', 0, [matrix, np.ones((16, 16))])), True)
+        sparse_block, dense_block = codec.decode_message(frame).blocks
+        self.assertEqual(sparse.is_sparse(sparse_block), True)
+        self.assertEqual(sparse_block.dtype, np.int8)
+        self.assertEqual(np.array_equal(sparse_block.to_dense(), matrix), True)
+        self.assertEqual(np.array_equal(dense_block, np.ones((16, 16))), True)
+
+    def test_decodes_version_1_frames(self):
+        frame = bytearray(codec.encode_message('addition', 0, [np.arange(4)]))
+        frame[3] = 1
+        self.assertEqual(np.array_equal(codec.decode_message(bytes(frame)).blocks[0], np.arange(4)), True)
+
+    def test_rejects_unknown_frames(self):
+        frame = bytearray(codec.encode_message('addition', 0, [np.zeros(2)]))
+        with self.assertRaises(ValueError):
+            codec.decode_message(b'not a frame')
+        frame[3] = codec.WIRE_VERSION + 1
+        with self.assertRaises(ValueError):
+            codec.decode_message(bytes(frame))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from CloudComputing import CloudComputingApp
+from driver import expression
+from driver.local_backend import LocalBackend
+from files.matrix_store import BlockGrid
+from app_support import REAL_METHODS
+
+
+def leaf(matrix, block_size=2):
+    return 'leaf', BlockGrid(matrix, (block_size, block_size))
+
+
+class TestPlanPass(unittest.TestCase):
+    def test_fuses_element_wise_into_products(self):
+        a, b, c, d = (leaf(np.ones((4, 4), dtype=np.int64)) for _ in range(4))
+        fused = expression.plan_pass(('add', ('matmul', ('add', a, b), c), d), 2)
+        self.assertEqual((fused.operation, fused.inner_blocks, len(fused.tasks), len(fused.grids)),
+                         ('multiplication', 2, 8, 4))
+        # the first partial product of a tile adds the block of d
+        self.assertEqual(fused.tasks[0][2], ['add', ['matmul', ['add', 0, 1], 2], 3])
+        self.assertEqual(fused.tasks[1][2], ['matmul', ['add', 0, 1], 2])
+
+    def test_sum_of_products(self):
+        a, b = leaf(np.ones((4, 6), dtype=np.int64)), leaf(np.ones((6, 4), dtype=np.int64))
+        c, e = leaf(np.ones((4, 2), dtype=np.int64)), leaf(np.ones((2, 4), dtype=np.int64))
+        fused = expression.plan_pass(('add', ('matmul', a, b), ('scale', 0.5, ('matmul', c, ('scale', 2, e)))), 2)
+        # the partial products of both products are summed into the same tiles
+        self.assertEqual((fused.inner_blocks, len(fused.tasks), fused.dtype), (4, 16, np.float64))
+        self.assertEqual(fused.tasks[3], ((0, 0, 3), [(2, 0), (3, 0)],
+                                          ['scale', 0.5, ['matmul', 0, ['scale', 2, 1]]]))
+
+    def test_element_wise_pass(self):
+        a, b = leaf(np.arange(9).reshape(3, 3)), leaf(np.ones((3, 3), dtype=np.int8))
+        fused = expression.plan_pass(('add', a, ('scale', -1, b)), 2)
+        self.assertEqual((fused.operation, fused.inner_blocks, len(fused.tasks), fused.dtype),
+                         ('addition', 1, 4, np.int64))
+        self.assertEqual(fused.tasks[3], ((3,), [(0, 3), (1, 3)], ['add', 0, ['scale', -1, 1]]))
+
+    def test_rejects_nested_products(self):
+        a = leaf(np.ones((2, 2)))
+        with self.assertRaises(AssertionError):
+            expression.plan_pass(('matmul', ('matmul', a, a), a), 2)
+
+    def test_zero_tasks(self):
+        zero, ones = leaf(np.zeros((4, 4))), leaf(np.ones((4, 4)))
+        fused = expression.plan_pass(('add', ('matmul', zero, ones), ones), 2)
+        sent, skipped = expression.zero_tasks(fused, [[True] * 4, [False] * 4])
+        # only the partial products adding a block of the last matrix are left
+        self.assertEqual([task[0] for task in sent], [(0, 0, 0), (0, 1, 0), (1, 0, 0), (1, 1, 0)])
+        self.assertEqual(len(skipped), 4)
+
+
+class TestDistributedMatrix(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.multiple(CloudComputingApp, **REAL_METHODS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.log_dir.cleanup)
+        self.app = CloudComputingApp(instance_size=2, scheduling='shared', backend=LocalBackend(self.log_dir.name))
+        self.app.prepare_architecture()
+        self.addCleanup(self.app.teardown_infrastructure)
+
+    def test_fused_expression_runs_in_one_pass(self):
+        a, b, c, d = (np.random.randint(10, size=(6, 6)) for _ in range(4))
+        da, db, dc, dd = (self.app.distributed_matrix(matrix, 4) for matrix in (a, b, c, d))
+        expr = (da + db) @ dc + dd
+        self.assertEqual(expr.shape, (6, 6))
+        with patch.object(self.app, 'submit_pass', wraps=self.app.submit_pass) as submit_pass:
+            result = expr.compute()
+        self.assertEqual(submit_pass.call_count, 1)
+        self.assertEqual(np.array_equal(result, (a + b) @ c + d), True)
+
+        result = (2 * da - db * 0.5).compute()
+        self.assertEqual(np.allclose(result, 2 * a - b * 0.5), True)
+
+    def test_nested_products(self):
+        a, b, c = (np.random.randint(10, size=(4, 4)) for _ in range(3))
+        da, db, dc = (self.app.distributed_matrix(matrix, 2) for matrix in (a, b, c))
+        product = da @ db
+        with patch.object(self.app, 'submit_pass', wraps=self.app.submit_pass) as submit_pass:
+            result = (product @ dc - product @ da).compute()
+        # the shared inner product is merged once, the outer products then fuse into one pass
+        self.assertEqual(submit_pass.call_count, 2)
+        self.assertEqual(np.array_equal(result, a @ b @ c - a @ b @ a), True)
+
+    def test_operand_checks(self):
+        da = self.app.distributed_matrix(np.ones((4, 4)), 2)
+        with self.assertRaises(ValueError):
+            da @ self.app.distributed_matrix(np.ones((2, 4)), 2)
+        with self.assertRaises(ValueError):
+            da + self.app.distributed_matrix(np.ones((4, 4)), 4)
+        with self.assertRaises(TypeError):
+            da + np.ones((4, 4)).tolist()
+
+
+if __name__ == '__main__':
+    unittest.main()
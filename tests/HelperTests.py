@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+from worker import helper, sparse
+
+
+class TestHelper(unittest.TestCase):
+    def test_matrix_dot_product(self):
+        matrix_a = np.arange(12).reshape(3, 4)
+        matrix_b = np.arange(8).reshape(4, 2)
+        result = helper.matrix_dot_product(matrix_a, matrix_b)
+        self.assertIsInstance(result, np.ndarray)
+        self.assertEqual(result.dtype, np.int64)
+        self.assertEqual(np.array_equal(result, matrix_a @ matrix_b), True)
+
+    def test_matrix_dot_product_incompatible(self):
+        with self.assertRaises(ValueError):
+            helper.matrix_dot_product(np.ones((2, 3)), np.ones((2, 3)))
+
+    def test_matrix_dot_product_promotes_on_overflow(self):
+        matrix = np.full((4, 4), 100, dtype=np.int8)
+        result = helper.matrix_dot_product(matrix, matrix)
+        self.assertEqual(result.dtype, np.int32)
+        self.assertEqual(np.all(result == 40000), True)
+
+    def test_result_dtype_smallest_accumulator(self):
+        self.assertEqual(helper.result_dtype(np.int8, np.int8, 100), np.int8)
+        self.assertEqual(helper.result_dtype(np.int8, np.int8, 8100), np.int16)
+        self.assertEqual(helper.result_dtype(np.uint8, np.int8, 2 ** 20), np.int32)
+        self.assertEqual(helper.result_dtype(np.int32, np.int32, 2 ** 40), np.int64)
+        self.assertEqual(helper.result_dtype(np.bool_, np.bool_, 1), np.int64)
+
+    def test_matrix_dot_product_overflow(self):
+        matrix = np.full((2, 2), 2 ** 40, dtype=np.int64)
+        with self.assertRaises(OverflowError):
+            helper.matrix_dot_product(matrix, matrix)
+
+    def test_matrix_add_in_place(self):
+        matrix_1 = np.arange(9).reshape(3, 3)
+        matrix_2 = np.ones((3, 3), dtype=np.int64)
+        result = helper.matrix_add(matrix_1, matrix_2, out=matrix_1)
+        self.assertIs(result, matrix_1)
+        self.assertEqual(np.array_equal(result, np.arange(1, 10).reshape(3, 3)), True)
+
+    def test_matrix_add_promotes_on_overflow(self):
+        matrix = np.full((2, 2), 115, dtype=np.int8)
+        result = helper.matrix_add(matrix, matrix)
+        self.assertEqual(result.dtype, np.int16)
+        self.assertEqual(np.all(result == 230), True)
+        self.assertEqual(np.all(helper.matrix_add(matrix, matrix, out=np.empty((2, 2), dtype=np.int64)) == 230), True)
+
+    def test_matrix_scale(self):
+        matrix = np.full((2, 2), 100, dtype=np.int8)
+        result = helper.matrix_scale(matrix, -3)
+        self.assertEqual(result.dtype, np.int16)
+        self.assertEqual(np.all(result == -300), True)
+        self.assertEqual(helper.matrix_scale(matrix, 0.5).dtype, np.float64)
+        sparse_result = helper.matrix_scale(sparse.CSRMatrix.from_dense(np.eye(3, dtype=np.int64)), 2)
+        self.assertEqual(np.array_equal(sparse_result.to_dense(), 2 * np.eye(3)), True)
+
+    def test_matrix_add_checks_dtype(self):
+        with self.assertRaises(TypeError):
+            helper.matrix_add(np.array([['a']]), np.array([['b']]))
+        with self.assertRaises(OverflowError):
+            helper.matrix_add(np.full(2, 100), np.full(2, 100), out=np.empty(2, dtype=np.int8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+from concurrent.futures import CancelledError
+from unittest.mock import patch
+import numpy as np
+from AsyncDriverTests import ThreadBackend
+from CloudComputing import CloudComputingApp
+from worker import codec
+from app_support import REAL_METHODS
+
+
+class TestJobs(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.multiple(CloudComputingApp, **REAL_METHODS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start(self, stuck=()):
+        self.backend = ThreadBackend(stuck)
+        self.app = CloudComputingApp(instance_size=1, scheduling='shared', backend=self.backend)
+        self.app.jobs.wait_time = 0.1
+        self.app.prepare_architecture()
+        self.addCleanup(self.app.teardown_infrastructure)
+
+    def test_concurrent_jobs(self):
+        self.start()
+        matrix_a = np.arange(36).reshape(6, 6)
+        matrix_b = np.arange(36).reshape(6, 6) % 5
+        split_a = self.app.split_row(matrix_a, 2, 2)
+        split_b = self.app.split_row(matrix_b, 2, 2)
+
+        product = self.app.submit('multiplication', split_a, split_b, 6, 2)
+        total = self.app.submit('addition', split_a, split_b, 6, 2)
+        self.assertNotEqual(product.id, total.id)
+        self.assertEqual(np.array_equal(total.result(10), matrix_a + matrix_b), True)
+        self.assertEqual(np.array_equal(product.result(10), matrix_a @ matrix_b), True)
+        self.assertEqual(product.done() and total.done(), True)
+        self.assertEqual(len(self.app.jobs), 0)
+
+    def test_cancel(self):
+        self.start(stuck=[(0, 0, 0)])
+        self.app.SPECULATION_OPTIONS['percentile'] = None
+        matrix = np.arange(36).reshape(6, 6)
+        split = self.app.split_row(matrix, 2, 2)
+
+        handle = self.app.submit('multiplication', split, split, 6, 2)
+        with self.assertRaises(TimeoutError):
+            handle.result(0.5)
+        self.assertEqual(handle.cancel(), True)
+        with self.assertRaises(CancelledError):
+            handle.result()
+
+        # the results still coming for the cancelled job are dropped, not merged into the next one
+        self.assertEqual(np.array_equal(self.app.submit('addition', split, split, 6, 2).result(10), matrix + matrix),
+                         True)
+        self.assertEqual(len(self.app.jobs), 0)
+
+    def test_add_result_drops_other_jobs(self):
+        self.start()
+        split = self.app.split_row(np.ones((4, 4)), 2, 2)
+        assembler, _ = self.app.create_assembler(split, 4, 2, 'addition')
+        block = [np.full((2, 2), 2.0)]
+        self.assertEqual(self.app.add_result(assembler, codec.Message('result', (0,), block, {'job': 'b'}), 0, None,
+                                             'a'), False)
+        self.assertEqual(assembler.completed, 0)
+        self.assertEqual(self.app.add_result(assembler, codec.Message('result', (0,), block, {'job': 'a'}), 0, None,
+                                             'a'), True)
+        self.assertEqual(assembler.completed, 1)
+
+    def test_blocking_merge_alongside_jobs(self):
+        self.start(stuck=[(0, 0, 0)])
+        self.app.SPECULATION_OPTIONS['percentile'] = None
+        matrix = np.arange(36).reshape(6, 6)
+        split = self.app.split_row(matrix, 2, 2)
+
+        # the router polls for the job in flight without taking the results of the blocking merge, nor the merge those
+        # of the job
+        handle = self.app.submit('multiplication', split, split, 6, 2)
+        self.app.compute_matrix_operation('addition', split, split)
+        self.assertEqual(np.array_equal(self.app.merge_queue_result(split, 6, 2, 'addition'), matrix + matrix), True)
+        self.assertEqual(handle.done(), False)
+        self.assertEqual(handle.cancel(), True)
+
+        # nor once the jobs are done
+        self.assertEqual(np.array_equal(self.app.submit('addition', split, split, 6, 2).result(10), matrix + matrix),
+                         True)
+        self.app.compute_matrix_operation('multiplication', split, split)
+        self.assertEqual(np.array_equal(self.app.merge_queue_result(split, 6, 2, 'multiplication'), matrix @ matrix),
+                         True)
+        self.assertEqual(len(self.app.jobs), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
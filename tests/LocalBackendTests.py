@@ -0,0 +1,203 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from CloudComputing import CloudComputingApp
+from driver.local_backend import LocalBackend, LocalQueueStore, LocalSQS
+from worker.cache import block_digest
+from app_support import REAL_METHODS
+
+
+class TestLocalQueueStore(unittest.TestCase):
+    def test_visibility_timeout(self):
+        sqs = LocalSQS(LocalQueueStore())
+        queue = sqs.create_queue(QueueName='queue0', Attributes={'VisibilityTimeout': '0'})
+        queue.send_messages(Entries=[{'Id': '0', 'MessageBody': 'task'}])
+
+        first = queue.receive_messages(MaxNumberOfMessages=10, WaitTimeSeconds=0)
+        second = queue.receive_messages(MaxNumberOfMessages=10, WaitTimeSeconds=0)
+        self.assertEqual([m.body for m in first + second], ['task', 'task'])
+        self.assertEqual(queue.delete_messages(Entries=[{'Id': '0', 'ReceiptHandle': second[0].receipt_handle}]),
+                         {'Successful': [{'Id': '0'}]})
+        self.assertEqual(queue.receive_messages(WaitTimeSeconds=0), [])
+
+    def test_change_visibility(self):
+        sqs = LocalSQS(LocalQueueStore())
+        queue = sqs.create_queue(QueueName='queue0', Attributes={'VisibilityTimeout': '0.2'})
+        queue.send_messages(Entries=[{'Id': '0', 'MessageBody': 'task'}])
+        message = queue.receive_messages(WaitTimeSeconds=0)[0]
+        entry = {'Id': '0', 'ReceiptHandle': message.receipt_handle, 'VisibilityTimeout': 30}
+        self.assertEqual(queue.change_message_visibility_batch(Entries=[entry]), {'Successful': [{'Id': '0'}]})
+        self.assertEqual(queue.receive_messages(WaitTimeSeconds=0.4), [])
+
+        entry['VisibilityTimeout'] = 0
+        queue.change_message_visibility_batch(Entries=[entry])
+        self.assertEqual([m.body for m in queue.receive_messages(WaitTimeSeconds=0)], ['task'])
+        # the first receipt expired when the message became visible again
+        self.assertEqual(queue.change_message_visibility_batch(Entries=[entry])['Failed'][0]['Code'],
+                         'ReceiptHandleIsInvalid')
+
+    def test_client_operations(self):
+        sqs = LocalSQS(LocalQueueStore())
+        sqs.create_queue(QueueName='queue0')
+        sqs.get_queue_by_name(QueueName='queue0').send_messages(Entries=[{'Id': '0', 'MessageBody': 'task'}])
+        url = sqs.list_queues(MaxResults=123)['QueueUrls'][0]
+        self.assertEqual(sqs.get_queue_attributes(QueueUrl=url, AttributeNames=['ApproximateNumberOfMessages']),
+                         {'Attributes': {'ApproximateNumberOfMessages': '1'}})
+        sqs.purge_queue(QueueUrl=url)
+        sqs.delete_queue(QueueUrl=url)
+        self.assertEqual(sqs.list_queues(MaxResults=123), {'QueueUrls': []})
+
+
+class TestLocalBackend(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.multiple(CloudComputingApp, **REAL_METHODS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.log_dir.cleanup)
+
+    def run_pipeline(self, scheduling, max_value=10, **codec_options):
+        app = CloudComputingApp(instance_size=2, scheduling=scheduling, backend=LocalBackend(self.log_dir.name),
+                                **codec_options)
+        try:
+            app.prepare_architecture()
+            matrix_a = app.generate_array(8, 8, max_value=max_value)
+            matrix_b = app.generate_array(8, 8, max_value=max_value)
+            split_a = app.split_row(matrix_a, 4, 4)
+            split_b = app.split_row(matrix_b, 4, 4)
+
+            app.compute_matrix_operation('addition', split_a, split_b)
+            result = app.merge_queue_result(split_a, 8, 4, 'addition')
+            self.assertEqual(np.array_equal(result, matrix_a + matrix_b), True)
+
+            app.compute_matrix_operation('multiplication', split_a, split_b)
+            result = app.merge_queue_result(split_a, 8, 4, 'multiplication')
+            self.assertEqual(np.array_equal(result, matrix_a @ matrix_b), True)
+            self.assertEqual(len(app.last_trace), 8)
+            self.assertEqual(app.last_trace.summary()['compute']['max'] >= 0, True)
+        finally:
+            self.assertTrue(app.teardown_infrastructure())
+
+    def test_static_pipeline(self):
+        self.run_pipeline('static')
+
+    def test_shared_pipeline(self):
+        self.run_pipeline('shared')
+
+    def test_compressed_narrowed_pipeline(self):
+        self.run_pipeline('shared', compression='auto', narrow=True)
+
+    def test_narrowed_pipeline_overflowing_block_dtype(self):
+        # blocks travel as uint8, their sums and products do not fit in it
+        self.run_pipeline('shared', max_value=200, narrow=True)
+
+    def test_sparse_pipeline(self):
+        app = CloudComputingApp(instance_size=2, scheduling='shared', backend=LocalBackend(self.log_dir.name),
+                                sparse=True)
+        try:
+            app.prepare_architecture()
+            matrix_a = app.generate_array(16, 16, density=0.05)
+            matrix_b = app.generate_array(16, 16, density=0.05)
+            split_a = app.split_row(matrix_a, 4, 4)
+            split_b = app.split_row(matrix_b, 4, 4)
+
+            app.compute_matrix_operation('multiplication', split_a, split_b)
+            result = app.merge_queue_result(split_a, 16, 4, 'multiplication')
+            self.assertEqual(np.array_equal(result, matrix_a @ matrix_b), True)
+        finally:
+            self.assertTrue(app.teardown_infrastructure())
+
+    def test_cached_pipeline(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        app = CloudComputingApp(instance_size=2, scheduling='shared', backend=LocalBackend(self.log_dir.name),
+                                cache_dir=cache_dir.name, worker_cache_bytes=1 << 20)
+        try:
+            app.prepare_architecture()
+            matrix_a = app.generate_array(8, 8)
+            matrix_b = app.generate_array(8, 8)
+            split_a = app.split_row(matrix_a, 4, 4)
+            split_b = app.split_row(matrix_b, 4, 4)
+            for _ in range(2):
+                app.compute_matrix_operation('multiplication', split_a, split_b)
+                result = app.merge_queue_result(split_a, 8, 4, 'multiplication')
+                self.assertEqual(np.array_equal(result, matrix_a @ matrix_b), True)
+            self.assertEqual((app.last_job['tasks'], len(app.last_job['cached'])), (0, 8))
+        finally:
+            self.assertTrue(app.teardown_infrastructure())
+
+    def test_block_store_pipeline(self):
+        app = CloudComputingApp(instance_size=2, scheduling='static', backend=LocalBackend(self.log_dir.name),
+                                worker_store_bytes=1 << 20)
+        try:
+            app.prepare_architecture()
+            matrix_a = app.generate_array(12, 12)
+            matrix_b = app.generate_array(12, 12)
+            split_a = app.split_row(matrix_a, 3, 3)
+            split_b = app.split_row(matrix_b, 3, 3)
+
+            app.compute_matrix_operation('multiplication', split_a, split_b)
+            result = app.merge_queue_result(split_a, 12, 3, 'multiplication')
+            self.assertEqual(np.array_equal(result, matrix_a @ matrix_b), True)
+            # each queue carries every block it uses once, the 128 block uses of the 64 tasks mostly go by key
+            residency = app.block_residency.values()
+            self.assertEqual(sum(store.misses for store in residency) <= 2 * 32, True)
+            self.assertEqual(sum(store.hits for store in residency) >= 64, True)
+
+            # blocks the workers have lost, e.g. on a restart, are sent again with the tasks referring to them
+            matrix_c = matrix_a + 1
+            for store in residency:
+                for block in app.split_row(matrix_c, 3, 3):
+                    store.put(block_digest(block), block)
+            with patch.object(app, 'resend_missing_blocks', wraps=app.resend_missing_blocks) as resend:
+                dc, db = app.distributed_matrix(matrix_c, 3), app.distributed_matrix(matrix_b, 3)
+                self.assertEqual(np.array_equal((dc @ db).compute(), matrix_c @ matrix_b), True)
+            self.assertEqual(resend.call_count > 0, True)
+        finally:
+            self.assertTrue(app.teardown_infrastructure())
+
+    def test_block_store_needs_static_scheduling(self):
+        with self.assertRaises(ValueError):
+            CloudComputingApp(instance_size=2, scheduling='shared', backend=LocalBackend(self.log_dir.name),
+                              worker_store_bytes=1 << 20)
+
+    def test_async_pipeline(self):
+        app = CloudComputingApp(instance_size=2, scheduling='static', backend=LocalBackend(self.log_dir.name))
+        try:
+            app.prepare_architecture()
+            matrix_a = app.generate_array(12, 12)
+            matrix_b = app.generate_array(12, 12)
+            split_a = app.split_row(matrix_a, 3, 3)
+            split_b = app.split_row(matrix_b, 3, 3)
+
+            # 64 tasks through a window of 10
+            result = app.run_operation('multiplication', split_a, split_b, 12, 3, max_in_flight=10)
+            self.assertEqual(np.array_equal(result, matrix_a @ matrix_b), True)
+            self.assertEqual(len(app.last_trace), app.last_job['tasks'])
+
+            result = app.run_operation('addition', split_a, split_b, 12, 3)
+            self.assertEqual(np.array_equal(result, matrix_a + matrix_b), True)
+        finally:
+            self.assertTrue(app.teardown_infrastructure())
+
+    def test_ragged_blocks(self):
+        app = CloudComputingApp(instance_size=2, scheduling='shared', backend=LocalBackend(self.log_dir.name))
+        try:
+            app.prepare_architecture()
+            matrix_a = app.generate_array(10, 10)
+            matrix_b = app.generate_array(10, 10)
+            plan = app.plan_block_size('multiplication', matrix_a.shape, matrix_b.shape, matrix_a.dtype)
+            self.assertEqual(plan.makespan > 0, True)
+            split_a = app.split_row(matrix_a, 4, 4, ragged=True)
+            split_b = app.split_row(matrix_b, 4, 4, ragged=True)
+
+            app.compute_matrix_operation('multiplication', split_a, split_b)
+            result = app.merge_queue_result(split_a, 10, 4, 'multiplication')
+            self.assertEqual(np.array_equal(result, matrix_a @ matrix_b), True)
+        finally:
+            self.assertTrue(app.teardown_infrastructure())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from files import matrix_store
+
+
+class TestMatrixStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_generate_matrix(self):
+        filename = os.path.join(self.directory.name, 'a.npy')
+        matrix = matrix_store.generate_matrix(filename, 10, 4, max_value=5, chunk_rows=3)
+        self.assertIsInstance(matrix, np.memmap)
+        self.assertEqual(matrix.shape, (10, 4))
+        self.assertTrue(np.all(matrix < 5))
+
+    def test_block_grid_views(self):
+        filename = os.path.join(self.directory.name, 'a.npy')
+        matrix = matrix_store.create_matrix(filename, (4, 6))
+        matrix[:] = np.arange(24).reshape(4, 6)
+        grid = matrix_store.BlockGrid(matrix_store.open_matrix(filename), (2, 3))
+
+        self.assertEqual(len(grid), 4)
+        self.assertEqual(grid.grid_shape, (2, 2))
+        self.assertTrue(np.shares_memory(grid[3], grid.matrix))
+        self.assertEqual(np.array_equal(grid[3], [[15, 16, 17], [21, 22, 23]]), True)
+        with self.assertRaises(IndexError):
+            grid[4]
+
+    def test_save_matrix(self):
+        matrix = np.arange(6).reshape(2, 3)
+        path = matrix_store.save_matrix(os.path.join(self.directory.name, 'result.txt'), matrix)
+        self.assertTrue(path.endswith('.npy'))
+        self.assertEqual(np.array_equal(np.load(path), matrix), True)
+
+        path = matrix_store.save_matrix(os.path.join(self.directory.name, 'result.npz'), matrix)
+        self.assertEqual(np.array_equal(np.load(path)['result'], matrix), True)
+
+    def test_block_directory_round_trip(self):
+        matrix = np.arange(35).reshape(5, 7)
+        directory = matrix_store.save_blocks(os.path.join(self.directory.name, 'blocks'), matrix, (2, 3))
+        self.assertEqual(np.array_equal(matrix_store.load_block(directory, 2, 2), [[34]]), True)
+        self.assertEqual(np.array_equal(matrix_store.load_blocks(directory), matrix), True)
+
+
+if __name__ == '__main__':
+    unittest.main()
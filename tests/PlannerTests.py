@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+from driver.planner import CostModel, plan_blocks, predict
+from worker import codec
+
+
+class TestPlanner(unittest.TestCase):
+    def test_predict_ragged_edges(self):
+        plan = predict('multiplication', (10, 10), (10, 10), np.int64, 2, 4)
+        self.assertEqual(plan.grid_shape, (3, 3))
+        self.assertEqual(plan.tasks, 27)
+        self.assertEqual(plan.message_bytes,
+                         codec.body_size('multiplication', (2, 2, 2), [((4, 4), np.int64), ((4, 4), np.int64)]))
+        self.assertEqual(plan.makespan > max(plan.stages.values()), True)
+
+    def test_plan_respects_message_limit(self):
+        plan = plan_blocks('multiplication', (2000, 2000), (2000, 2000), np.int64, 4)
+        self.assertEqual(plan.message_bytes <= 256 * 1024, True)
+        bigger = predict('multiplication', (2000, 2000), (2000, 2000), np.int64, 4, plan.block_size + 1)
+        self.assertEqual(bigger.message_bytes > 256 * 1024 or bigger.makespan >= plan.makespan, True)
+
+    def test_plan_fits_result_messages(self):
+        plan = plan_blocks('multiplication', (3000, 3000), (3000, 3000), np.int8, 4)
+        # full range int8 products of the block edge accumulate in int32
+        result_bytes = codec.body_size('result', (0, 0, 0), [((plan.block_size, plan.block_size), np.int32)])
+        self.assertEqual(plan.message_bytes >= result_bytes, True)
+        self.assertEqual(plan.message_bytes <= 256 * 1024, True)
+        # small values accumulate in int16, leaving room for larger blocks
+        small = plan_blocks('multiplication', (3000, 3000), (3000, 3000), np.int8, 4, max_value=10)
+        self.assertEqual(small.block_size > plan.block_size, True)
+
+    def test_plan_minimises_makespan(self):
+        cost_model = CostModel(message_latency=0.05, bandwidth=1e9, compute_rate=1e6)
+        plan = plan_blocks('addition', (64, 64), (64, 64), np.int64, 4, cost_model, max_message_bytes=8 * 1024)
+        for block_size in range(1, 65):
+            other = predict('addition', (64, 64), (64, 64), np.int64, 4, block_size, cost_model)
+            if other.message_bytes <= 8 * 1024:
+                self.assertEqual(plan.makespan <= other.makespan, True)
+
+    def test_latency_favours_larger_blocks(self):
+        slow_queue = plan_blocks('addition', (500, 500), (500, 500), np.int64, 4, CostModel(message_latency=1.0))
+        fast_queue = plan_blocks('addition', (500, 500), (500, 500), np.int64, 4,
+                                 CostModel(message_latency=0.0, bandwidth=1e12, compute_rate=1e3))
+        self.assertEqual(slow_queue.tasks <= fast_queue.tasks, True)
+
+    def test_message_too_small(self):
+        with self.assertRaises(ValueError):
+            plan_blocks('addition', (4, 4), (4, 4), np.int64, 1, max_message_bytes=16)
+
+    def test_incompatible_shapes(self):
+        with self.assertRaises(AssertionError):
+            predict('multiplication', (4, 3), (4, 3), np.int64, 1, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
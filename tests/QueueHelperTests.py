@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import Mock
+from worker import queue_helper as qh
+
+
+class TestQueueHelper(unittest.TestCase):
+    def entries(self, count, size=10):
+        return [{"Id": f"{idx}", "MessageBody": "x" * size} for idx in range(count)]
+
+    def test_make_batches_entry_limit(self):
+        batches = list(qh.make_batches(self.entries(25)))
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+
+    def test_make_batches_size_limit(self):
+        batches = list(qh.make_batches(self.entries(5, size=100 * 1024)))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        with self.assertRaises(ValueError):
+            list(qh.make_batches(self.entries(1, size=qh.MAX_BATCH_BYTES + 1)))
+
+    def test_get_queue_is_cached(self):
+        sqs = Mock()
+        self.assertIs(qh.get_queue(sqs, 'queue0'), qh.get_queue(sqs, 'queue0'))
+        sqs.get_queue_by_name.assert_called_once_with(QueueName='queue0')
+
+    def test_batch_sender_retries_failed_entries(self):
+        calls = []
+
+        def send_messages(Entries):
+            calls.append([entry['Id'] for entry in Entries])
+            if len(calls) == 1:
+                return {'Successful': [{'Id': entry['Id']} for entry in Entries[1:]],
+                        'Failed': [{'Id': Entries[0]['Id'], 'SenderFault': False}]}
+            return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+        sqs = Mock()
+        sqs.get_queue_by_name.return_value.send_messages.side_effect = send_messages
+        with qh.BatchSender(sqs, max_workers=1, backoff=0) as sender:
+            sender.send('queue0', self.entries(3))
+        self.assertEqual(calls, [['0', '1', '2'], ['0']])
+        self.assertEqual(sender.sent, 3)
+
+    def test_batch_sender_sender_fault(self):
+        sqs = Mock()
+        sqs.get_queue_by_name.return_value.send_messages.return_value = {
+            'Failed': [{'Id': '0', 'SenderFault': True, 'Code': 'InvalidMessageContents'}]}
+        sender = qh.BatchSender(sqs, max_workers=1)
+        sender.send('queue0', self.entries(1))
+        with self.assertRaises(RuntimeError):
+            sender.flush()
+        sender.close()
+
+    def test_batch_receiver(self):
+        sqs = Mock()
+        queue = sqs.get_queue_by_name.return_value
+        messages = [Mock(receipt_handle=f"handle-{idx}") for idx in range(12)]
+        queue.receive_messages.return_value = messages[:10]
+        queue.delete_messages.return_value = {}
+
+        receiver = qh.BatchReceiver(sqs, 'result-queue-0')
+        self.assertEqual(receiver.receive(), messages[:10])
+        queue.receive_messages.assert_called_once_with(MaxNumberOfMessages=10, MessageAttributeNames=['All'],
+                                                       WaitTimeSeconds=qh.LONG_POLL_SECONDS)
+
+        self.assertEqual(receiver.delete(messages), [])
+        self.assertEqual(queue.delete_messages.call_count, 2)
+        last_entries = queue.delete_messages.call_args.kwargs['Entries']
+        self.assertEqual(last_entries, [{'Id': '0', 'ReceiptHandle': 'handle-10'},
+                                        {'Id': '1', 'ReceiptHandle': 'handle-11'}])
+
+    def test_lease_keeper_renews_due_leases(self):
+        now = [0]
+        receiver = Mock()
+        receiver.extend.return_value = []
+        messages = [Mock(receipt_handle=f"handle-{idx}") for idx in range(3)]
+        leases = qh.LeaseKeeper(receiver, 30, clock=lambda: now[0])
+        leases.hold(messages[:2])
+        now[0] = 5
+        leases.hold(messages[2:])
+        self.assertEqual(leases.renew(), 0)
+
+        now[0] = 12
+        leases.release(messages[:1])
+        self.assertEqual(leases.renew(), 1)
+        receiver.extend.assert_called_once_with([messages[1]], 30)
+        now[0] = 15
+        self.assertEqual(leases.renew(), 1)
+        self.assertEqual(receiver.extend.call_args.args[0], [messages[2]])
+        self.assertEqual((len(leases), leases.renewed), (2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
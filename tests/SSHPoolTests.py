@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from driver.ssh_pool import SSHSessionManager
+
+
+@patch('driver.ssh_pool.time.sleep')
+@patch('driver.ssh_pool.paramiko')
+class TestSSHSessionManager(unittest.TestCase):
+    def test_key_loaded_once(self, paramiko, sleep):
+        sessions = SSHSessionManager()
+        clients = sessions.connect_all(['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+        self.assertEqual(len(clients), 3)
+        paramiko.RSAKey.from_private_key_file.assert_called_once_with('labsuser.pem')
+        sleep.assert_not_called()
+
+    def test_connect_retries_with_backoff(self, paramiko, sleep):
+        sessions = SSHSessionManager(max_attempts=3, base_delay=1, max_delay=2)
+        ssh = MagicMock()
+        ssh.connect.side_effect = [OSError('refused'), OSError('refused'), None]
+        self.assertTrue(sessions.connect_client(ssh, '10.0.0.1'))
+        self.assertEqual(sleep.call_count, 2)
+        self.assertTrue(all(0 <= c.args[0] <= 2 for c in sleep.call_args_list))
+
+        ssh.connect.side_effect = OSError('refused')
+        self.assertFalse(sessions.connect_client(ssh, '10.0.0.1'))
+
+    def test_sessions_are_reused(self, paramiko, sleep):
+        sessions = SSHSessionManager()
+        ssh = sessions.connect('10.0.0.1')
+        ssh.get_transport.return_value.is_active.return_value = True
+        self.assertIs(sessions.connect('10.0.0.1'), ssh)
+        self.assertEqual(paramiko.SSHClient.call_count, 1)
+        ssh.get_transport.return_value.set_keepalive.assert_called_once_with(30)
+
+        sessions.close()
+        ssh.close.assert_called_once()
+        self.assertEqual(sessions.sessions, {})
+
+    def test_connect_all_isolates_errors(self, paramiko, sleep):
+        sessions = SSHSessionManager(max_attempts=2)
+        paramiko.SSHClient.return_value.connect.side_effect = OSError('unreachable')
+        result = sessions.connect_all(['10.0.0.1'])
+        self.assertIsInstance(result['10.0.0.1'], ConnectionError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import numpy as np
+from worker import helper, sparse
+from worker.sparse import CSRMatrix
+
+
+def random_sparse(nrows, ncols, density=0.2, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.integers(1, 10, size=(nrows, ncols))
+    matrix[rng.random((nrows, ncols)) >= density] = 0
+    return matrix
+
+
+def dense(matrix):
+    return matrix.to_dense() if sparse.is_sparse(matrix) else matrix
+
+
+class TestCSRMatrix(unittest.TestCase):
+    def test_from_dense(self):
+        matrix = random_sparse(6, 5)
+        block = CSRMatrix.from_dense(matrix)
+        self.assertEqual(block.nnz, np.count_nonzero(matrix))
+        self.assertEqual(np.array_equal(block.to_dense(), matrix), True)
+        self.assertEqual(np.array_equal(block.transpose().to_dense(), matrix.T), True)
+
+    def test_from_coo_sums_duplicates(self):
+        block = CSRMatrix.from_coo([0, 2, 0, 1], [1, 0, 1, 1], [1, 2, 3, -4], (3, 2))
+        self.assertEqual(block.to_dense().tolist(), [[0, 4], [0, -4], [2, 0]])
+
+    def test_sparsify(self):
+        self.assertEqual(sparse.is_sparse(sparse.sparsify(random_sparse(20, 20, 0.05))), True)
+        self.assertEqual(sparse.is_sparse(sparse.sparsify(np.ones((20, 20)))), False)
+        self.assertEqual(sparse.is_zero(CSRMatrix.from_dense(np.zeros((3, 3)))), True)
+        self.assertEqual(sparse.is_zero(np.eye(3)), False)
+
+
+class TestSparseKernels(unittest.TestCase):
+    def test_matrix_dot_product(self):
+        matrix_a = random_sparse(6, 5, seed=1)
+        matrix_b = random_sparse(5, 4, seed=2)
+        for operand_a, operand_b in [(CSRMatrix.from_dense(matrix_a), matrix_b),
+                                     (matrix_a, CSRMatrix.from_dense(matrix_b)),
+                                     (CSRMatrix.from_dense(matrix_a), CSRMatrix.from_dense(matrix_b))]:
+            result = helper.matrix_dot_product(operand_a, operand_b)
+            self.assertEqual(np.array_equal(dense(result), matrix_a @ matrix_b), True)
+        self.assertEqual(sparse.is_sparse(result), True)
+
+    def test_matrix_add(self):
+        matrix_a = random_sparse(6, 5, seed=3)
+        matrix_b = random_sparse(6, 5, seed=4)
+        for operand_a, operand_b in [(CSRMatrix.from_dense(matrix_a), matrix_b),
+                                     (matrix_a, CSRMatrix.from_dense(matrix_b)),
+                                     (CSRMatrix.from_dense(matrix_a), CSRMatrix.from_dense(matrix_b))]:
+            result = helper.matrix_add(operand_a, operand_b)
+            self.assertEqual(np.array_equal(dense(result), matrix_a + matrix_b), True)
+
+    def test_matrix_add_in_place(self):
+        tile = np.ones((6, 5), dtype=np.int64)
+        matrix = random_sparse(6, 5)
+        helper.matrix_add(tile, CSRMatrix.from_dense(matrix), out=tile)
+        self.assertEqual(np.array_equal(tile, matrix + 1), True)
+
+    def test_matrix_dot_product_incompatible(self):
+        with self.assertRaises(ValueError):
+            helper.matrix_dot_product(CSRMatrix.from_dense(np.eye(3)), np.ones((2, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
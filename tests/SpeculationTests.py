@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+from driver.assembler import ResultAssembler
+from driver.speculation import StragglerMonitor
+from worker import codec
+
+
+def result(idx):
+    return codec.Message('result', (idx,), [np.ones((1, 1))], {})
+
+
+class TestStragglerMonitor(unittest.TestCase):
+    def test_deadline_after_percentile(self):
+        now = [0]
+        assembler = ResultAssembler((1, 12), (1, 1), 'addition')
+        assembler.skip((0,))
+        assembler.skip((1,))
+        monitor = StragglerMonitor(assembler, started=0, percentile=90, delay_factor=1.5, min_delay=2,
+                                   clock=lambda: now[0])
+        # 9 of the 10 sent tasks reach the 90th percentile, the skipped ones do not count
+        self.assertEqual(monitor.percentile_count, 9)
+        for idx in range(2, 10):
+            assembler.add(result(idx))
+        now[0] = 10
+        self.assertFalse(monitor.poll())
+        self.assertIsNone(monitor.deadline)
+
+        assembler.add(result(10))
+        self.assertFalse(monitor.poll())
+        self.assertEqual(monitor.deadline, 15)
+        now[0] = 14.9
+        self.assertFalse(monitor.poll())
+        now[0] = 15
+        self.assertTrue(monitor.poll())
+        self.assertFalse(monitor.poll())
+
+    def test_min_delay(self):
+        now = [1]
+        assembler = ResultAssembler((1, 2), (1, 1), 'addition')
+        monitor = StragglerMonitor(assembler, started=0, percentile=50, min_delay=5, clock=lambda: now[0])
+        assembler.add(result(0))
+        self.assertFalse(monitor.poll())
+        self.assertEqual(monitor.deadline, 6)
+
+    def test_done_job_is_not_speculated(self):
+        assembler = ResultAssembler((1, 1), (1, 1), 'addition')
+        monitor = StragglerMonitor(assembler, started=0, min_delay=0, clock=lambda: 100)
+        assembler.add(result(0))
+        self.assertFalse(monitor.poll())
+
+
+if __name__ == '__main__':
+    unittest.main()
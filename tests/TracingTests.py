@@ -0,0 +1,43 @@
+import unittest
+import numpy as np
+from driver.tracing import JobTrace, task_meta
+from worker import codec
+
+
+def result_meta(task_id, enqueued, received, decode, compute, finished):
+    return dict(task_meta(task_id, enqueued), worker='0', received=received, decode=decode, compute=compute,
+                finished=finished)
+
+
+class TestJobTrace(unittest.TestCase):
+    def test_record(self):
+        trace = JobTrace()
+        timings = trace.record(result_meta(0, 100.0, 101.0, 0.5, 2.0, 103.5), 104.0)
+        self.assertEqual(timings, {'queue_wait': 1.0, 'decode': 0.5, 'compute': 2.0, 'transfer': 0.5, 'total': 4.0})
+        self.assertEqual(trace.record({}, 104.0), None)
+        self.assertEqual(len(trace), 1)
+
+    def test_meta_survives_the_codec(self):
+        meta = result_meta(3, 100.0, 101.0, 0.5, 2.0, 103.5)
+        body = codec.encode_body('result', (0, 1), [np.zeros((2, 2))], meta)
+        self.assertEqual(codec.decode_body(body).meta, meta)
+
+    def test_summary_and_bottleneck(self):
+        trace = JobTrace()
+        for task_id in range(10):
+            trace.record(result_meta(task_id, 0.0, 0.1, 0.01, 1.0 + task_id, 1.5 + task_id), 1.6 + task_id)
+        summary = trace.summary()
+        self.assertEqual(summary['compute']['max'], 10.0)
+        self.assertAlmostEqual(summary['compute']['p50'], 5.5)
+        self.assertEqual(trace.bottleneck(), 'compute')
+        counts, edges = trace.histogram('compute', bins=5)
+        self.assertEqual(counts.sum(), 10)
+        self.assertEqual(len(edges), 6)
+
+    def test_empty_trace(self):
+        self.assertEqual(JobTrace().summary(), {})
+        self.assertEqual(JobTrace().bottleneck(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+from files import worker_bundle
+
+
+class TestWorkerBundle(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'worker')
+        os.makedirs(os.path.join(self.source, '__pycache__'))
+        self.write('worker.py', "import sys\nimport helper\nprint(helper.greet(sys.argv[1]))\n")
+        self.write('helper.py', "def greet(name):\n    return 'hello ' + name\n")
+        self.write('__pycache__/helper.cpython-311.pyc', 'stale')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        with open(os.path.join(self.source, name), 'w') as f:
+            f.write(content)
+
+    def build(self):
+        return worker_bundle.build_worker_bundle(self.source, os.path.join(self.directory.name, 'build'))
+
+    def test_bundle_runs_worker(self):
+        bundle = self.build()
+        with zipfile.ZipFile(bundle.path) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['__main__.py', 'helper.py', 'worker.py'])
+        output = subprocess.run([sys.executable, bundle.path, 'worker'], capture_output=True, check=True, text=True)
+        self.assertEqual(output.stdout, 'hello worker\n')
+
+    def test_hash_follows_contents(self):
+        first = self.build()
+        self.assertEqual(self.build(), first)
+
+        self.write('helper.py', "def greet(name):\n    return 'hi ' + name\n")
+        second = self.build()
+        self.assertNotEqual(second.sha256, first.sha256)
+        self.assertNotEqual(second.path, first.path)
+
+    def test_remote_install_command(self):
+        bundle = worker_bundle.WorkerBundle('worker.pyz', 'abc', ['numpy'], ['wheels/numpy.whl'])
+        self.assertIn('--no-index --find-links ~/worker-bundle/wheels numpy', worker_bundle.remote_install_command(bundle))
+        self.assertIn('pip install numpy', worker_bundle.remote_install_command(bundle._replace(wheels=[])))
+
+
+if __name__ == '__main__':
+    unittest.main()
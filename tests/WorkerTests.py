@@ -0,0 +1,98 @@
+import os
+import subprocess
+import sys
+import textwrap
+import unittest
+from driver.local_backend import WORKER_DIR
+
+ROOT_DIR = os.path.dirname(WORKER_DIR)
+
+# runs the worker the way an instance does, with its modules importable by name so the compute pool can spawn
+POOL_SCRIPT = textwrap.dedent(f"""
+    import sys
+    import threading
+    import time
+    sys.path.insert(0, {WORKER_DIR!r})
+    import numpy as np
+    import codec
+    import worker
+    from driver.local_backend import LocalQueueStore, LocalSQS
+
+    sqs = LocalSQS(LocalQueueStore())
+    tasks = sqs.create_queue(QueueName='queue0')
+    results = sqs.create_queue(QueueName='result-queue-0')
+    matrix = np.arange(16).reshape(4, 4)
+    tasks.send_messages(Entries=[{{'Id': f'{{idx}}', 'MessageBody': codec.encode_body(
+        'multiplication', (idx,), [matrix + idx, matrix], {{'task': idx}})}} for idx in range(25)])
+    threading.Thread(target=worker.perform_computation, args=(sqs, 0, 'queue0', 'result-queue-0'),
+                     kwargs={{'processes': 2}}, daemon=True).start()
+
+    received = []
+    deadline = time.monotonic() + 60
+    while len(received) < 25 and time.monotonic() < deadline:
+        received += [codec.decode_body(m.body) for m in results.receive_messages(MaxNumberOfMessages=10,
+                                                                                  WaitTimeSeconds=1)]
+    assert sorted(m.meta['task'] for m in received) == list(range(25))
+    assert all(np.array_equal(m.blocks[0], (matrix + m.coords[0]) @ matrix) for m in received)
+    print('pool ok')
+""")
+
+# fails the sends of one result: throttled at first, then beyond the retries of the sender
+SEND_FAILURE_SCRIPT = textwrap.dedent(f"""
+    import sys
+    import threading
+    import time
+    sys.path.insert(0, {WORKER_DIR!r})
+    import numpy as np
+    import codec
+    import worker
+    from driver.local_backend import LocalQueue, LocalQueueStore, LocalSQS
+
+    sqs = LocalSQS(LocalQueueStore())
+    tasks = sqs.create_queue(QueueName='queue0')
+    results = sqs.create_queue(QueueName='result-queue-0')
+    matrix = np.arange(16).reshape(4, 4)
+    tasks.send_messages(Entries=[{{'Id': f'{{idx}}', 'MessageBody': codec.encode_body(
+        'addition', (idx,), [matrix, matrix], {{'task': idx}})}} for idx in range(5)])
+
+    send_messages = LocalQueue.send_messages
+    attempts = []
+
+    def fail_first_result(self, Entries):
+        if self.name == 'result-queue-0' and Entries[0]['Id'] == '0' and len(attempts) < 8:
+            attempts.append(Entries[0]['Id'])
+            response = send_messages(self, Entries[1:]) if len(Entries) > 1 else {{}}
+            return dict(response, Failed=[{{'Id': '0', 'SenderFault': False, 'Code': 'ThrottlingException'}}])
+        return send_messages(self, Entries)
+
+    LocalQueue.send_messages = fail_first_result
+    threading.Thread(target=worker.perform_computation, args=(sqs, 0, 'queue0', 'result-queue-0'),
+                     kwargs={{'processes': 1}}, daemon=True).start()
+
+    received = set()
+    deadline = time.monotonic() + 20
+    while len(received) < 5 and time.monotonic() < deadline:
+        received |= {{codec.decode_body(m.body).meta['task'] for m in results.receive_messages(MaxNumberOfMessages=10,
+                                                                                          WaitTimeSeconds=1)}}
+    # the tasks are computed again well before their visibility timeout
+    assert received == set(range(5)), received
+    print('resent ok')
+""")
+
+
+class TestWorker(unittest.TestCase):
+    def test_perform_computation_with_process_pool(self):
+        process = subprocess.run([sys.executable, '-c', POOL_SCRIPT], cwd=ROOT_DIR, capture_output=True, text=True,
+                                 timeout=120)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertIn('pool ok', process.stdout)
+
+    def test_failed_results_are_not_lost(self):
+        process = subprocess.run([sys.executable, '-c', SEND_FAILURE_SCRIPT], cwd=ROOT_DIR, capture_output=True,
+                                 text=True, timeout=120)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertIn('resent ok', process.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,6 @@
+"""Shared setup of the tests running the app against its real methods."""
+from CloudComputing import CloudComputingApp
+
+# CloudComputingTests replaces some methods with mocks at class level, these tests run against the real ones
+REAL_METHODS = {name: value for name, value in vars(CloudComputingApp).items()
+                if callable(value) and not name.startswith('__')}
@@ -0,0 +1,97 @@
+"""Size-bounded in-memory LRU store of the input blocks a worker has received, for tasks to refer to by key."""
+import threading
+from collections import OrderedDict
+
+try:
+    from . import codec
+except ImportError:
+    # on the instances the worker modules are imported as top-level modules
+    import codec
+
+
+class BlockStore:
+    """
+    Blocks kept in memory by key, evicted least recently used first once they take more than max_bytes. The driver
+    keeps one per task queue as a mirror of the store of the worker reading it: blocks are put and read in the order
+    the tasks are sent, so both evict the same blocks and the driver knows which blocks a task can refer to.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: bound of the total bytes of the blocks
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._blocks
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, key):
+        """
+        :return: the block, or None when it is not in the store
+        """
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        """
+        Store a block, evicting the least recently used ones to make room
+        :return: True if the block was stored, False if it is larger than the store
+        """
+        nbytes = block.nbytes
+        if nbytes > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._blocks:
+                self.size -= self._blocks.pop(key).nbytes
+            while self.size + nbytes > self.max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self.size -= evicted.nbytes
+            self._blocks[key] = block
+            self.size += nbytes
+        return True
+
+    def discard(self, key):
+        """
+        Drop a block from the store if it holds it
+        """
+        with self._lock:
+            if key in self._blocks:
+                self.size -= self._blocks.pop(key).nbytes
+
+
+def resolve_blocks(store, body, meta):
+    """
+    Input blocks of a task referring to stored blocks. The blocks the task carries are stored, the others are read
+    from the store.
+    :param store: BlockStore of the worker, None when it keeps none
+    :param body: task message body
+    :param meta: task meta, listing the key of every input block in 'block_keys' and whether the message carries it
+    in 'inline'
+    :return: list of the input blocks, None when a block the task refers to is not in the store
+    """
+    carried = iter(codec.decode_body(body).blocks)
+    blocks = []
+    for key, inline in zip(meta['block_keys'], meta['inline']):
+        if inline:
+            block = next(carried)
+            if store is not None:
+                store.put(key, block)
+        else:
+            block = store.get(key) if store is not None else None
+        blocks.append(block)
+    return None if any(block is None for block in blocks) else blocks
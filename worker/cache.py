@@ -0,0 +1,139 @@
+"""Size-bounded on-disk LRU cache of block results, keyed by a hash of the task inputs."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from . import codec, sparse
+except ImportError:
+    # on the instances the worker modules are imported as top-level modules
+    import codec
+    import sparse
+
+# files of the cache are named <key><suffix>
+_SUFFIX = '.block'
+
+
+def block_digest(block):
+    """
+    Hash of the dtype, shape and values of a dense or sparse block
+    :return: hex sha256 digest
+    """
+    digest = hashlib.sha256()
+    if sparse.is_sparse(block):
+        arrays = [block.data, block.indices, block.indptr]
+        digest.update(f"csr{list(block.shape)}".encode('utf-8'))
+    else:
+        arrays = [block]
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{list(array.shape)}".encode('utf-8'))
+        digest.update(memoryview(array).cast('B'))
+    return digest.hexdigest()
+
+
+def task_key(operation, digests):
+    """
+    Cache key of a task from its operation and the digests of its input blocks
+    """
+    return hashlib.sha256('\0'.join([operation, *digests]).encode('utf-8')).hexdigest()
+
+
+class BlockCache:
+    """
+    Block results stored as codec frames, one file per key, evicted least recently used first once the files take
+    more than max_bytes. Keys can be pinned to keep them until a job has read them.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        """
+        :param directory: directory of the cache files, created if missing, existing files are reused
+        :param max_bytes: bound of the total size of the files
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._pinned = set()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(_SUFFIX):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, name[:-len(_SUFFIX)], stat.st_size))
+        # least recently used first
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.size = sum(self._entries.values())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Read a cached block and mark it as recently used
+        :return: the block, None on a miss
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            with open(self._path(key), 'rb') as f:
+                frame = f.read()
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self.size -= self._entries.pop(key, 0)
+            return None
+        return codec.decode_message(frame).blocks[0]
+
+    def put(self, key, block):
+        """
+        Store a block, evicting the least recently used unpinned blocks beyond max_bytes
+        """
+        frame = codec.encode_message('result', [], [block], compression='auto')
+        path = self._path(key)
+        partial = f"{path}.{threading.get_ident()}.partial"
+        with open(partial, 'wb') as f:
+            f.write(frame)
+        os.replace(partial, path)
+        with self._lock:
+            self.size += len(frame) - self._entries.pop(key, 0)
+            self._entries[key] = len(frame)
+            evicted = []
+            for old_key in list(self._entries):
+                if self.size <= self.max_bytes:
+                    break
+                if old_key == key or old_key in self._pinned:
+                    continue
+                self.size -= self._entries.pop(old_key)
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def pin(self, keys):
+        """
+        Protect keys from eviction
+        """
+        with self._lock:
+            self._pinned.update(keys)
+
+    def unpin(self, keys):
+        with self._lock:
+            self._pinned.difference_update(keys)
@@ -0,0 +1,283 @@
+"""Binary wire format for the matrix blocks exchanged between the driver and the workers."""
+import base64
+import json
+import lzma
+import math
+import struct
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    from . import sparse as sparse_blocks
+except ImportError:
+    # on the instances the worker modules are imported as top-level modules
+    import sparse as sparse_blocks
+
+MAGIC = b'MCB'
+WIRE_VERSION = 2
+# version 1 frames have no compression and no narrowed blocks, they decode the same way
+SUPPORTED_VERSIONS = (1, 2)
+
+COMPRESSORS = {'zlib': (zlib.compress, zlib.decompress), 'lzma': (lzma.compress, lzma.decompress)}
+# 'auto' compression leaves block buffers smaller than this alone
+COMPRESS_MIN_BYTES = 512
+# largest frame whose base64 body fits in a 256 KB SQS message
+MAX_FRAME_BYTES = 256 * 1024 * 3 // 4
+# candidates of narrow_dtype, smallest first
+_NARROW_DTYPES = [np.dtype(dtype) for dtype in (np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32)]
+
+# magic, wire version, header length
+_PREFIX = struct.Struct('<3sBI')
+# every block buffer starts on this boundary so np.frombuffer views stay aligned
+_ALIGNMENT = 8
+
+Message = namedtuple('Message', ['operation', 'coords', 'blocks', 'meta'])
+
+
+def _padding(size):
+    return -size % _ALIGNMENT
+
+
+def _as_coords(coords):
+    if coords is None:
+        return []
+    if isinstance(coords, (int, np.integer)):
+        return [int(coords)]
+    return [int(c) for c in coords]
+
+
+def narrow_dtype(block):
+    """
+    Smallest integer dtype holding every value of a block, the block dtype when it is not an integer block or nothing
+    smaller fits
+    :param block: numpy array
+    :return: numpy dtype
+    """
+    if block.dtype.kind not in 'iu' or block.size == 0:
+        return block.dtype
+    low, high = int(block.min()), int(block.max())
+    for dtype in _NARROW_DTYPES:
+        if dtype.itemsize >= block.dtype.itemsize:
+            break
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return block.dtype
+
+
+def _compress(payload, compression):
+    """
+    Compress the block buffers of a frame
+    :param compression: None, 'zlib', 'lzma' or 'auto'. 'auto' leaves small payloads alone, uses zlib otherwise and
+    lzma when the zlib output would still not fit in a message
+    :return: tuple of (compression used or None, payload)
+    """
+    if compression == 'auto':
+        if len(payload) < COMPRESS_MIN_BYTES:
+            return None, payload
+        compressed = zlib.compress(payload)
+        name = 'zlib'
+        if len(compressed) > MAX_FRAME_BYTES:
+            compressed, name = lzma.compress(payload), 'lzma'
+        # keep the raw buffers when compression does not pay off
+        return (name, compressed) if len(compressed) < len(payload) else (None, payload)
+    if compression is None:
+        return None, payload
+    if compression not in COMPRESSORS:
+        raise ValueError(f"Unknown compression {compression}")
+    return compression, COMPRESSORS[compression][0](payload)
+
+
+def _describe(shape, dtype, offset, logical=None):
+    """
+    Descriptor of one array of the frame
+    :return: tuple of (descriptor, offset of the next array)
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    descriptor = {'dtype': dtype.str, 'shape': [int(size) for size in shape], 'offset': offset, 'nbytes': nbytes}
+    if logical is not None and np.dtype(logical) != dtype:
+        descriptor['logical'] = np.dtype(logical).str
+    return descriptor, offset + nbytes + _padding(nbytes)
+
+
+def _wire_array(array, narrow):
+    """
+    Contiguous array to write, narrowed when asked
+    :return: tuple of (array, logical dtype)
+    """
+    array = np.ascontiguousarray(array)
+    if array.dtype.hasobject:
+        raise TypeError(f"Cannot encode blocks of dtype {array.dtype}")
+    if narrow:
+        dtype = narrow_dtype(array)
+        if dtype != array.dtype:
+            return array.astype(dtype), array.dtype
+    return array, array.dtype
+
+
+def encode_message(operation, coords, blocks, meta=None, compression=None, narrow=False, sparse=False):
+    """
+    Encode an operation, its block coordinates and a list of blocks into one binary frame.
+    The frame is a fixed prefix (magic, version, header length), a JSON header describing the dtype, shape and
+    offset of every block, followed by the raw block buffers, compressed as a whole when the header says so.
+    A CSR block is described by its shape and the descriptors of its data, indices and indptr arrays.
+    :param operation: operation name, e.g. 'addition', 'multiplication' or 'result'
+    :param coords: block coordinates, an int or a tuple of ints
+    :param blocks: list of numpy arrays or CSRMatrix blocks
+    :param meta: optional dict of extra header fields
+    :param compression: None, 'zlib', 'lzma' or 'auto' to choose per message, see _compress
+    :param narrow: send integer blocks as the smallest integer dtype holding their values, the original dtype is
+    recorded as 'logical' in the block descriptor
+    :param sparse: send dense blocks as CSR when that is at most half their size
+    :return: encoded frame as bytes
+    """
+    descriptors = []
+    arrays = []
+    offset = 0
+    for block in blocks:
+        if sparse:
+            block = sparse_blocks.sparsify(block)
+        if sparse_blocks.is_sparse(block):
+            parts = []
+            for idx, array in enumerate((block.data, block.indices, block.indptr)):
+                array, logical = _wire_array(array, narrow and idx == 0)
+                descriptor, offset = _describe(array.shape, array.dtype, offset, logical)
+                parts.append(descriptor)
+                arrays.append(array)
+            descriptors.append({'format': 'csr', 'shape': list(block.shape), 'parts': parts})
+        else:
+            array, logical = _wire_array(block, narrow)
+            descriptor, offset = _describe(array.shape, array.dtype, offset, logical)
+            descriptors.append(descriptor)
+            arrays.append(array)
+
+    buffers = []
+    for array in arrays:
+        buffers.append(memoryview(array).cast('B'))
+        pad = _padding(array.nbytes)
+        if pad:
+            buffers.append(b'\0' * pad)
+    payload = b''.join(buffers)
+    compression, payload = _compress(payload, compression)
+
+    header = _header(operation, coords, descriptors, meta, compression)
+    return b''.join([_PREFIX.pack(MAGIC, WIRE_VERSION, len(header)), header, payload])
+
+
+def _header(operation, coords, descriptors, meta, compression=None):
+    """
+    Build the padded JSON header of a frame
+    :param descriptors: descriptors of the blocks
+    :param compression: compression of the block buffers, if any
+    :return: header bytes
+    """
+    fields = {'op': operation, 'coords': _as_coords(coords), 'blocks': descriptors, 'meta': meta or {}}
+    if compression is not None:
+        fields['compression'] = compression
+    header = json.dumps(fields, separators=(',', ':')).encode('utf-8')
+    return header + b' ' * _padding(_PREFIX.size + len(header))
+
+
+def body_size(operation, coords, specs, meta=None):
+    """
+    Length of the message body encode_body produces for blocks of the given shapes and dtypes, without encoding them
+    or compressing them
+    :param operation: operation name
+    :param coords: block coordinates
+    :param specs: list of (shape, dtype) of the blocks
+    :param meta: optional dict of extra header fields
+    :return: number of characters of the base64 body
+    """
+    descriptors = []
+    offset = 0
+    for shape, dtype in specs:
+        descriptor, offset = _describe(shape, dtype, offset)
+        descriptors.append(descriptor)
+    header = _header(operation, coords, descriptors, meta)
+    return 4 * math.ceil((_PREFIX.size + len(header) + offset) / 3)
+
+
+def decode_message(data):
+    """
+    Decode a frame produced by encode_message. Blocks are read-only views over the frame buffer, or over the
+    decompressed buffers of a compressed frame, no further copy is made. Narrowed blocks keep their wire dtype, CSR
+    blocks are returned as CSRMatrix.
+    :param data: frame as bytes, or as the base64 text produced by encode_body
+    :return: Message(operation, coords, blocks, meta)
+    """
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    if len(data) < _PREFIX.size:
+        raise ValueError("Message is too short to be a block frame")
+    magic, version, header_size = _PREFIX.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Message is not a block frame")
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported wire version {version}, expected {WIRE_VERSION}")
+
+    start = _PREFIX.size + header_size
+    header = json.loads(bytes(data[_PREFIX.size:start]))
+    compression = header.get('compression')
+    if compression is not None:
+        if compression not in COMPRESSORS:
+            raise ValueError(f"Unknown compression {compression}")
+        data, start = COMPRESSORS[compression][1](bytes(data[start:])), 0
+    def read(descriptor):
+        dtype = np.dtype(descriptor['dtype'])
+        block = np.frombuffer(data, dtype=dtype, count=descriptor['nbytes'] // dtype.itemsize,
+                              offset=start + descriptor['offset'])
+        return block.reshape(tuple(descriptor['shape']))
+
+    blocks = []
+    for descriptor in header['blocks']:
+        if descriptor.get('format') == 'csr':
+            blocks.append(sparse_blocks.CSRMatrix(*(read(part) for part in descriptor['parts']), descriptor['shape']))
+        else:
+            blocks.append(read(descriptor))
+    return Message(header['op'], tuple(header['coords']), blocks, header['meta'])
+
+
+def encode_body(operation, coords, blocks, meta=None, compression=None, narrow=False, sparse=False):
+    """
+    Encode a frame as base64 text so it can be used as an SQS message body
+    :param operation: operation name
+    :param coords: block coordinates
+    :param blocks: list of numpy arrays
+    :param meta: optional dict of extra header fields
+    :param compression: None, 'zlib', 'lzma' or 'auto'
+    :param narrow: send integer blocks as the smallest integer dtype holding their values
+    :param sparse: send dense blocks as CSR when that is at most half their size
+    :return: base64 encoded frame
+    """
+    return base64.b64encode(encode_message(operation, coords, blocks, meta, compression, narrow,
+                                           sparse)).decode('ascii')
+
+
+def decode_body(body):
+    """
+    Decode an SQS message body produced by encode_body
+    :param body: base64 encoded frame
+    :return: Message(operation, coords, blocks, meta)
+    """
+    return decode_message(base64.b64decode(body))
+
+
+def decode_header(body):
+    """
+    Decode only the header of an SQS message body produced by encode_body, the blocks are not read
+    :param body: base64 encoded frame
+    :return: Message(operation, coords, [], meta)
+    """
+    # base64 decodes in groups of 4 characters for 3 bytes, read the prefix first then the rest of the header
+    prefix = base64.b64decode(body[:4 * math.ceil(_PREFIX.size / 3)])
+    magic, version, header_size = _PREFIX.unpack_from(prefix, 0)
+    if magic != MAGIC:
+        raise ValueError("Message is not a block frame")
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported wire version {version}, expected {WIRE_VERSION}")
+    end = _PREFIX.size + header_size
+    header = json.loads(base64.b64decode(body[:4 * math.ceil(end / 3)])[_PREFIX.size:end])
+    return Message(header['op'], tuple(header['coords']), [], header['meta'])
@@ -1,41 +1,147 @@
-import datetime
 import numpy as np
 
-def reformat_data(data):
-    return str(data).replace('\n', '')
-
-
-def matrix_dot_product(matrix_a, matrix_b):
-    # Check that the matrices have compatible dimensions
-    if matrix_a.shape[1] != matrix_b.shape[0]:
-        print("Error: Matrices have incompatible dimensions")
-        exit(1)
-
-    start_time = datetime.datetime.now()
-    result = np.zeros(matrix_a.shape)
-
-    for i in range(len(matrix_a)):
-        row = []
-        for j in range(len(matrix_b[0])):
-            sum = 0
-            for k in range(len(matrix_b)):
-                sum += matrix_a[i][k] * matrix_b[k][j]
-            row.append(sum)
-        result.append(row)
-    print('Computation time', datetime.datetime.now() - start_time)
-
-    return np.array(result)
-
-
-def matrix_add(matrix_1, matrix_2):
-    start_time = datetime.datetime.now()
-    result = []
-    for idx_row in range(0, len(matrix_1)):
-        row = matrix_1[idx_row]
-        row1 = matrix_2[idx_row]
-        cols = []
-        for idx_col in range(0, len(row)):
-            cols.append(row[idx_col] + row1[idx_col])
-        result.append(cols)
-    print('Computation time', datetime.datetime.now() - start_time)
+try:
+    from . import sparse
+except ImportError:
+    # on the instances the worker modules are imported as top-level modules
+    import sparse
+
+# float64 represents every integer up to 2**53 exactly, so integer products below that bound can go through BLAS
+_EXACT_FLOAT_BOUND = 2 ** 53
+# integer dtypes results are promoted to, smallest first
+_ACCUMULATOR_DTYPES = [np.dtype(np.int16), np.dtype(np.int32), np.dtype(np.int64)]
+
+
+def _max_abs(matrix):
+    """
+    Largest absolute value of a matrix as a python number, safe against integer overflow
+    """
+    matrix = sparse.values(matrix)
+    if matrix.size == 0:
+        return 0
+    if matrix.dtype.kind in 'iub':
+        return max(abs(int(matrix.max())), abs(int(matrix.min())))
+    return float(np.max(np.abs(matrix)))
+
+
+def _check_operands(matrix_a, matrix_b):
+    """
+    Convert the operands to arrays and make sure they hold numeric data
+    :return: tuple of (matrix a, matrix b) as numpy arrays, sparse operands are kept as they are
+    """
+    matrix_a = matrix_a if sparse.is_sparse(matrix_a) else np.asarray(matrix_a)
+    matrix_b = matrix_b if sparse.is_sparse(matrix_b) else np.asarray(matrix_b)
+    for matrix in (matrix_a, matrix_b):
+        if matrix.dtype.kind not in 'biuf':
+            raise TypeError(f"Unsupported matrix dtype {matrix.dtype}")
+    return matrix_a, matrix_b
+
+
+def result_dtype(dtype_a, dtype_b, bound):
+    """
+    Pick the dtype for a result whose absolute values are bounded by bound. Integer results are promoted to the
+    smallest of int16, int32 and int64 that holds the bound when the natural result type could overflow, so narrow
+    int8 blocks accumulate into int16 or int32 rather than int64.
+    :param dtype_a: dtype of the first operand
+    :param dtype_b: dtype of the second operand
+    :param bound: upper bound of the absolute value of any result element
+    :return: numpy dtype
+    """
+    dtype = np.result_type(dtype_a, dtype_b)
+    if dtype.kind == 'b':
+        dtype = np.dtype(np.int64)
+    if dtype.kind in 'iu' and np.iinfo(dtype).max < bound:
+        dtype = next((accumulator for accumulator in _ACCUMULATOR_DTYPES
+                      if accumulator.itemsize > dtype.itemsize and np.iinfo(accumulator).max >= bound),
+                     np.dtype(np.int64))
+    _check_bound(dtype, bound)
+    return dtype
+
+
+def _check_bound(dtype, bound):
+    """
+    Raise OverflowError when an integer dtype cannot hold values up to bound
+    """
+    if dtype.kind in 'iu' and np.iinfo(dtype).max < bound:
+        raise OverflowError(f"Result values up to {bound} do not fit in {dtype}")
+
+
+def matrix_dot_product(matrix_a, matrix_b, out=None):
+    """
+    Compute the matrix product of two blocks with np.matmul
+    :param matrix_a: matrix a
+    :param matrix_b: matrix b
+    :param out: optional preallocated output array
+    :return: product of matrix a and matrix b as a numpy array
+    """
+    matrix_a, matrix_b = _check_operands(matrix_a, matrix_b)
+    if matrix_a.ndim != 2 or matrix_b.ndim != 2 or matrix_a.shape[1] != matrix_b.shape[0]:
+        raise ValueError(f"Matrices have incompatible dimensions {matrix_a.shape} and {matrix_b.shape}")
+
+    bound = _max_abs(matrix_a) * _max_abs(matrix_b) * matrix_a.shape[1]
+    dtype = result_dtype(matrix_a.dtype, matrix_b.dtype, bound) if out is None else out.dtype
+    _check_bound(dtype, bound)
+    if sparse.is_sparse(matrix_a) or sparse.is_sparse(matrix_b):
+        result = sparse.matmul(matrix_a, matrix_b, dtype)
+        if out is not None:
+            out[...] = result.to_dense() if sparse.is_sparse(result) else result
+            result = out
+    elif dtype.kind in 'iu' and bound < _EXACT_FLOAT_BOUND:
+        # numpy has no BLAS path for integers, the float64 product is exact below the bound
+        product = np.matmul(matrix_a, matrix_b, dtype=np.float64)
+        if out is None:
+            result = product.astype(dtype)
+        else:
+            result = out
+            np.copyto(out, product, casting='unsafe')
+    else:
+        result = np.matmul(matrix_a, matrix_b, out=out, dtype=None if out is not None else dtype)
+
+    return result
+
+
+def matrix_add(matrix_1, matrix_2, out=None):
+    """
+    Add two blocks element-wise with np.add, or by scattering the stored entries of sparse operands
+    :param matrix_1: matrix 1
+    :param matrix_2: matrix 2
+    :param out: optional preallocated output array, may be one of the operands to add in place
+    :return: sum of matrix 1 and matrix 2 as a numpy array, or as a CSRMatrix when both operands are sparse
+    """
+    matrix_1, matrix_2 = _check_operands(matrix_1, matrix_2)
+    if matrix_1.shape != matrix_2.shape:
+        raise ValueError(f"Matrices have different shapes {matrix_1.shape} and {matrix_2.shape}")
+
+    bound = _max_abs(matrix_1) + _max_abs(matrix_2)
+    if sparse.is_sparse(matrix_1) or sparse.is_sparse(matrix_2):
+        dtype = result_dtype(matrix_1.dtype, matrix_2.dtype, bound) if out is None else out.dtype
+        _check_bound(dtype, bound)
+        if out is not None and sparse.is_sparse(matrix_1) and sparse.is_sparse(matrix_2):
+            return sparse.add(matrix_1.to_dense(out), matrix_2, dtype, out)
+        return sparse.add(matrix_1, matrix_2, dtype, out)
+    if out is None:
+        out = np.empty(matrix_1.shape, dtype=result_dtype(matrix_1.dtype, matrix_2.dtype, bound))
+    _check_bound(out.dtype, bound)
+    # add in the dtype of the output, narrowed operands would wrap in their own
+    result = np.add(matrix_1, matrix_2, out=out, dtype=out.dtype, casting='unsafe')
     return result
+
+
+def matrix_scale(matrix, factor):
+    """
+    Multiply a block by a scalar with np.multiply, or the stored values of a sparse block
+    :param matrix: matrix
+    :param factor: int or float scalar
+    :return: scaled matrix as a numpy array, or as a CSRMatrix when the matrix is sparse
+    """
+    matrix = matrix if sparse.is_sparse(matrix) else np.asarray(matrix)
+    if matrix.dtype.kind not in 'biuf':
+        raise TypeError(f"Unsupported matrix dtype {matrix.dtype}")
+
+    bound = _max_abs(matrix) * abs(factor)
+    factor_dtype = np.min_scalar_type(factor) if isinstance(factor, int) else np.dtype(np.float64)
+    dtype = result_dtype(matrix.dtype, factor_dtype, bound)
+    if sparse.is_sparse(matrix):
+        return sparse.CSRMatrix(np.multiply(matrix.data, factor, dtype=dtype), matrix.indices, matrix.indptr,
+                                matrix.shape)
+    return np.multiply(matrix, factor, dtype=dtype)
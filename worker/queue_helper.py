@@ -1,12 +1,297 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 
 sqs = boto3.resource('sqs', region_name='us-east-1')
 
+# SQS limits for a single send_messages call
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+# longest wait SQS allows for a long-polling receive
+LONG_POLL_SECONDS = 20
+
+# id(sqs) -> (sqs, {queue name: queue}), the resource is kept alive so its id cannot be reused by another resource
+_queue_cache = {}
+_queue_cache_lock = threading.Lock()
+
+
+def get_queue(sqs, queue_name):
+    """
+    Get a queue handle, looking it up by name only the first time it is used with this sqs resource
+    """
+    with _queue_cache_lock:
+        _, queues = _queue_cache.setdefault(id(sqs), (sqs, {}))
+        queue = queues.get(queue_name)
+    if queue is None:
+        queue = sqs.get_queue_by_name(QueueName=queue_name)
+        with _queue_cache_lock:
+            queues[queue_name] = queue
+    return queue
+
+
+def forget_queues(sqs):
+    """
+    Drop the cached queue handles of an sqs resource, e.g. after its queues have been deleted
+    """
+    with _queue_cache_lock:
+        _queue_cache.pop(id(sqs), None)
+
+
 def send_message_to_queue(sqs, queue_name, message):
-    queue = sqs.get_queue_by_name(QueueName=queue_name)
+    queue = get_queue(sqs, queue_name)
 
     # Send message to SQS queue
     response = queue.send_messages(
         Entries=message
     )
-    return response
\ No newline at end of file
+    return response
+
+
+def entry_size(entry):
+    """
+    Size in bytes an entry counts against the batch payload limit: its body plus its message attributes
+    """
+    size = len(entry['MessageBody'].encode('utf-8'))
+    for name, attribute in entry.get('MessageAttributes', {}).items():
+        size += len(name.encode('utf-8')) + len(attribute.get('DataType', '').encode('utf-8'))
+        size += len(attribute.get('StringValue', '').encode('utf-8')) + len(attribute.get('BinaryValue', b''))
+    return size
+
+
+def make_batches(entries, max_entries=MAX_BATCH_ENTRIES, max_bytes=MAX_BATCH_BYTES):
+    """
+    Group entries into batches that respect the SQS entry count and payload size limits
+    :param entries: iterable of send_messages entries
+    :return: generator of lists of entries
+    """
+    batch = []
+    batch_bytes = 0
+    for entry in entries:
+        size = entry_size(entry)
+        if size > max_bytes:
+            raise ValueError(f"Message {entry['Id']} is {size} bytes, larger than the {max_bytes} bytes limit")
+        if batch and (len(batch) == max_entries or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(entry)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def receive_messages(queue, max_messages=MAX_BATCH_ENTRIES, wait_time=LONG_POLL_SECONDS):
+    """
+    Long-poll a queue for up to max_messages messages. Returns as soon as a message is available, or with an empty list
+    after wait_time seconds.
+    """
+    return queue.receive_messages(MaxNumberOfMessages=max_messages, MessageAttributeNames=['All'],
+                                  WaitTimeSeconds=wait_time)
+
+
+def delete_messages(queue, messages):
+    """
+    Delete received messages with delete_message_batch calls of up to 10 entries
+    :return: list of failed entries
+    """
+    failed = []
+    messages = list(messages)
+    for start in range(0, len(messages), MAX_BATCH_ENTRIES):
+        entries = [{'Id': f"{idx}", 'ReceiptHandle': message.receipt_handle}
+                   for idx, message in enumerate(messages[start:start + MAX_BATCH_ENTRIES])]
+        response = queue.delete_messages(Entries=entries)
+        failed.extend(response.get('Failed', []))
+    return failed
+
+
+def change_visibility(queue, messages, timeout):
+    """
+    Set the visibility timeout of received messages with change_message_visibility_batch calls of up to 10 entries
+    :param timeout: seconds from now the messages stay invisible for
+    :return: list of failed entries, e.g. messages deleted meanwhile
+    """
+    failed = []
+    messages = list(messages)
+    for start in range(0, len(messages), MAX_BATCH_ENTRIES):
+        entries = [{'Id': f"{idx}", 'ReceiptHandle': message.receipt_handle, 'VisibilityTimeout': int(timeout)}
+                   for idx, message in enumerate(messages[start:start + MAX_BATCH_ENTRIES])]
+        response = queue.change_message_visibility_batch(Entries=entries)
+        failed.extend(response.get('Failed', []))
+    return failed
+
+
+class BatchReceiver:
+    """
+    Long-polling receiver that fetches up to 10 messages per call and deletes them in batches
+    """
+
+    def __init__(self, sqs, queue_name, max_messages=MAX_BATCH_ENTRIES, wait_time=LONG_POLL_SECONDS):
+        self.queue = get_queue(sqs, queue_name)
+        self.max_messages = max_messages
+        self.wait_time = wait_time
+
+    def receive(self):
+        """
+        Receive the next batch of messages, empty when nothing arrived within the long-poll wait
+        """
+        return receive_messages(self.queue, self.max_messages, self.wait_time)
+
+    def delete(self, messages):
+        """
+        Delete processed messages
+        :return: list of failed entries
+        """
+        return delete_messages(self.queue, messages)
+
+    def extend(self, messages, timeout):
+        """
+        Keep messages invisible for timeout more seconds
+        :return: list of failed entries
+        """
+        return change_visibility(self.queue, messages, timeout)
+
+    def __iter__(self):
+        """
+        Yield non-empty batches of messages forever
+        """
+        while True:
+            messages = self.receive()
+            if messages:
+                yield messages
+
+
+class LeaseKeeper:
+    """
+    Keep the messages a worker holds invisible to the other workers. Every message held for a third of the visibility
+    timeout since its last renewal gets a full timeout again, so a long block is not delivered twice while a crashed
+    worker's messages come back within one timeout.
+    """
+
+    def __init__(self, receiver, timeout, clock=time.monotonic):
+        """
+        :param receiver: BatchReceiver the messages were received with
+        :param timeout: visibility timeout of the queue in seconds
+        :param clock: time source, replaceable in tests
+        """
+        self.receiver = receiver
+        self.timeout = timeout
+        self.interval = timeout / 3
+        self.clock = clock
+        self.renewed = 0
+        # receipt handle -> (message, time of its last renewal)
+        self._held = {}
+        self._lock = threading.Lock()
+
+    def hold(self, messages):
+        now = self.clock()
+        with self._lock:
+            for message in messages:
+                self._held[message.receipt_handle] = (message, now)
+
+    def release(self, messages):
+        with self._lock:
+            for message in messages:
+                self._held.pop(message.receipt_handle, None)
+
+    def __len__(self):
+        return len(self._held)
+
+    def renew(self):
+        """
+        Extend the leases that are due
+        :return: number of messages renewed
+        """
+        now = self.clock()
+        with self._lock:
+            due = [message for message, renewed in self._held.values() if now - renewed >= self.interval]
+            for message in due:
+                self._held[message.receipt_handle] = (message, now)
+        if due:
+            failed = self.receiver.extend(due, self.timeout)
+            self.renewed += len(due) - len(failed)
+        return len(due)
+
+
+class BatchSender:
+    """
+    Send messages in batches of up to 10 entries, with the batches of all queues in flight concurrently on a bounded
+    thread pool. Only the entries reported as failed in a batch response are retried.
+    """
+
+    def __init__(self, sqs, max_workers=8, max_retries=5, backoff=0.1):
+        self.sqs = sqs
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sent = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # bound the number of batches waiting for a thread so a large job does not encode everything up front
+        self._slots = threading.BoundedSemaphore(max_workers * 2)
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.close()
+
+    def send(self, queue_name, entries):
+        """
+        Queue entries for sending. Returns as soon as every batch has been handed to the thread pool.
+        :param queue_name: queue name
+        :param entries: iterable of send_messages entries, ids must be unique within the call
+        """
+        queue = get_queue(self.sqs, queue_name)
+        for batch in make_batches(entries):
+            self._slots.acquire()
+            try:
+                future = self._executor.submit(self._send_batch, queue, batch)
+            except BaseException:
+                self._slots.release()
+                raise
+            future.add_done_callback(lambda _: self._slots.release())
+            self._futures.append(future)
+
+    def _send_batch(self, queue, batch):
+        for attempt in range(self.max_retries + 1):
+            response = queue.send_messages(Entries=batch)
+            with self._lock:
+                self.sent += len(response.get('Successful', []))
+            failed = response.get('Failed', [])
+            if not failed:
+                return
+            sender_faults = [f for f in failed if f.get('SenderFault')]
+            if sender_faults:
+                raise RuntimeError(f"SQS rejected messages: {sender_faults}")
+            failed_ids = {f['Id'] for f in failed}
+            batch = [entry for entry in batch if entry['Id'] in failed_ids]
+            # exponential backoff with jitter before retrying the failed entries
+            time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+        raise RuntimeError(f"Failed to send {len(batch)} messages after {self.max_retries} retries")
+
+    def raise_failed(self):
+        """
+        Raise the error of a batch that has failed so far, without waiting for the batches still being sent
+        """
+        for future in list(self._futures):
+            if future.done():
+                future.result()
+
+    def flush(self):
+        """
+        Wait for every queued batch to be sent
+        :return: number of messages sent so far
+        """
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+        return self.sent
+
+    def close(self):
+        self._executor.shutdown(wait=True)
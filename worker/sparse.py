@@ -0,0 +1,168 @@
+"""Compressed sparse row blocks and the kernels working on them, in plain numpy."""
+import numpy as np
+
+# CSR is used for a block when it takes at most this fraction of the dense bytes
+SPARSE_MAX_RATIO = 0.5
+INDEX_DTYPE = np.dtype(np.int32)
+
+
+class CSRMatrix:
+    """
+    Sparse 2-D block in compressed sparse row form: the column indices and values of the non-zero entries of row r
+    are indices[indptr[r]:indptr[r + 1]] and data[indptr[r]:indptr[r + 1]], sorted by column.
+    """
+
+    def __init__(self, data, indices, indptr, shape):
+        self.data = np.asarray(data)
+        self.indices = np.asarray(indices, dtype=INDEX_DTYPE)
+        self.indptr = np.asarray(indptr, dtype=INDEX_DTYPE)
+        self.shape = tuple(int(size) for size in shape)
+        assert len(self.indptr) == self.shape[0] + 1, "indptr must have one entry per row plus one"
+
+    @classmethod
+    def from_dense(cls, matrix):
+        matrix = np.asarray(matrix)
+        rows, cols = np.nonzero(matrix)
+        indptr = np.zeros(matrix.shape[0] + 1, dtype=INDEX_DTYPE)
+        np.cumsum(np.bincount(rows, minlength=matrix.shape[0]), out=indptr[1:])
+        return cls(matrix[rows, cols], cols, indptr, matrix.shape)
+
+    @classmethod
+    def from_coo(cls, rows, cols, data, shape):
+        """
+        Build a CSR block from coordinate form, duplicate entries are summed
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        data = np.asarray(data)
+        keys, inverse = np.unique(rows * shape[1] + cols, return_inverse=True)
+        summed = np.zeros(len(keys), dtype=data.dtype)
+        np.add.at(summed, inverse.ravel(), data)
+        keep = summed != 0
+        keys, summed = keys[keep], summed[keep]
+        rows, cols = np.divmod(keys, shape[1])
+        indptr = np.zeros(shape[0] + 1, dtype=INDEX_DTYPE)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(summed, cols, indptr, shape)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes
+
+    def row_ids(self):
+        """
+        Row of every stored entry
+        """
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def to_dense(self, out=None):
+        """
+        Expand the block, into out when given
+        """
+        if out is None:
+            out = np.zeros(self.shape, dtype=self.dtype)
+        else:
+            out[...] = 0
+        out[self.row_ids(), self.indices] = self.data
+        return out
+
+    def transpose(self):
+        return CSRMatrix.from_coo(self.indices, self.row_ids(), self.data, self.shape[::-1])
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def astype(self, dtype):
+        return CSRMatrix(self.data.astype(dtype), self.indices, self.indptr, self.shape)
+
+
+def is_sparse(matrix):
+    return isinstance(matrix, CSRMatrix)
+
+
+def is_zero(matrix):
+    """
+    True when a dense or sparse block holds no non-zero value
+    """
+    if is_sparse(matrix):
+        return not np.any(matrix.data)
+    return not np.any(matrix)
+
+
+def values(matrix):
+    """
+    Stored values of a block, the non-zero entries of a sparse one
+    """
+    return matrix.data if is_sparse(matrix) else np.asarray(matrix)
+
+
+def sparsify(matrix, max_ratio=SPARSE_MAX_RATIO):
+    """
+    Convert a dense 2-D numeric block to CSR when that takes at most max_ratio of its dense bytes
+    :return: CSRMatrix, or the block unchanged
+    """
+    if is_sparse(matrix):
+        return matrix
+    matrix = np.asarray(matrix)
+    if matrix.ndim != 2 or matrix.dtype.kind not in 'biuf' or matrix.size == 0:
+        return matrix
+    nnz = np.count_nonzero(matrix)
+    sparse_bytes = nnz * (matrix.dtype.itemsize + INDEX_DTYPE.itemsize) + (matrix.shape[0] + 1) * INDEX_DTYPE.itemsize
+    return CSRMatrix.from_dense(matrix) if sparse_bytes <= max_ratio * matrix.nbytes else matrix
+
+
+def add(matrix_1, matrix_2, dtype, out=None):
+    """
+    Add two blocks of which at least one is sparse. Two sparse blocks give a sparse sum, any dense operand gives a
+    dense sum.
+    """
+    if is_sparse(matrix_1) and is_sparse(matrix_2):
+        return CSRMatrix.from_coo(np.concatenate([matrix_1.row_ids(), matrix_2.row_ids()]),
+                                  np.concatenate([matrix_1.indices, matrix_2.indices]),
+                                  np.concatenate([matrix_1.data, matrix_2.data]).astype(dtype), matrix_1.shape)
+    sparse, dense = (matrix_1, matrix_2) if is_sparse(matrix_1) else (matrix_2, matrix_1)
+    if out is None:
+        out = np.array(dense, dtype=dtype)
+    elif out is not dense:
+        np.copyto(out, dense, casting='unsafe')
+    np.add.at(out, (sparse.row_ids(), sparse.indices), sparse.data)
+    return out
+
+
+def _sparse_dense_product(sparse, dense, dtype):
+    """
+    Product of a CSR block and a dense block: every stored entry scales a row of the dense block, the scaled rows of
+    one sparse row are summed with one reduceat
+    """
+    out = np.zeros((sparse.shape[0], dense.shape[1]), dtype=dtype)
+    if sparse.nnz:
+        scaled = sparse.data.astype(dtype)[:, None] * dense[sparse.indices].astype(dtype)
+        filled = np.diff(sparse.indptr) > 0
+        out[filled] = np.add.reduceat(scaled, sparse.indptr[:-1][filled], axis=0)
+    return out
+
+
+def matmul(matrix_a, matrix_b, dtype):
+    """
+    Multiply two blocks of which at least one is sparse. Two sparse blocks give a sparse product, any dense operand
+    gives a dense product.
+    """
+    if is_sparse(matrix_a) and is_sparse(matrix_b):
+        return CSRMatrix.from_dense(_sparse_dense_product(matrix_a, matrix_b.to_dense(), dtype))
+    if is_sparse(matrix_a):
+        return _sparse_dense_product(matrix_a, np.asarray(matrix_b), dtype)
+    # A @ S == (S.T @ A.T).T
+    return _sparse_dense_product(matrix_b.transpose(), np.asarray(matrix_a).T, dtype).T
@@ -1,53 +1,275 @@
 import boto3
+import multiprocessing
+import os
+import queue
 import sys
-import numpy as np
-from ast import literal_eval
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import codec
 import helper
 import queue_helper as qh
+from block_store import BlockStore, resolve_blocks
+from cache import BlockCache
 
+# directory of the worker BlockCache on an instance
+CACHE_DIR = '~/block-cache'
+# batches received ahead of the compute stage
+PREFETCH_BATCHES = 2
+# how often a stage blocked on a full or empty queue checks whether the worker is stopping
+STAGE_POLL_SECONDS = 1
+# visibility timeout assumed when the queue does not report one, the SQS default
+DEFAULT_VISIBILITY_TIMEOUT = 30
+# first and longest wait before __main__ restarts a crashed worker
+RESTART_BACKOFF_SECONDS = 1
+MAX_RESTART_BACKOFF_SECONDS = 60
 
-def perform_computation(sqs, worker_id, queue_name, result_queue_name):
-    print(f"Worker {worker_id} started")
-    sqs_queue = sqs.get_queue_by_name(QueueName=queue_name)
-    print("Queue url:", sqs_queue.url)
 
-    while True:
-        messages = sqs_queue.receive_messages()
+def run_program(program, blocks):
+    """
+    Evaluate the program of a fused task over its input blocks
+    :param program: index of an input block, or list of an operation and its arguments: ['add', x, y],
+    ['scale', factor, x] or ['matmul', x, y]
+    :param blocks: input blocks of the task
+    :return: result block
+    """
+    if isinstance(program, int):
+        return blocks[program]
+    operation, *args = program
+    if operation == 'add':
+        return helper.matrix_add(run_program(args[0], blocks), run_program(args[1], blocks))
+    elif operation == 'scale':
+        return helper.matrix_scale(run_program(args[1], blocks), args[0])
+    elif operation == 'matmul':
+        return helper.matrix_dot_product(run_program(args[0], blocks), run_program(args[1], blocks))
+    raise ValueError(f"Unknown program operation {operation}")
+
+
+def compute_block(operation, blocks, program=None):
+    if operation == 'addition':
+        return helper.matrix_add(*blocks)
+    elif operation == 'multiplication':
+        return helper.matrix_dot_product(*blocks)
+    elif operation == 'fused':
+        return run_program(program, blocks)
+    raise Exception("Unknown operation")
+
+
+def process_task(body, worker_id, received, cached=None, blocks=None):
+    """
+    Decode a task, compute its block and encode the result message. Runs in the compute pool.
+    :param body: task message body
+    :param worker_id: worker id, recorded in the result meta
+    :param received: wall clock time the task was received at
+    :param cached: result of the task found in the worker cache, the input blocks are then not decoded
+    :param blocks: input blocks of a task referring to the block store, already resolved by resolve_blocks
+    :return: tuple of (result message body, the computed block or None when it came from the cache)
+    """
+    start_time = time.perf_counter()
+    if cached is None and blocks is None:
+        operation, coords, blocks, meta = codec.decode_body(body)
+    else:
+        operation, coords, _, meta = codec.decode_header(body)
+    decoded = time.perf_counter()
+
+    result = compute_block(operation, blocks, meta.get('program')) if cached is None else cached
+    computed = time.perf_counter()
+
+    print(f'Block {coords} processed in {computed - decoded:.4f}s')
+    # the task meta comes back with the worker timings so the driver can trace the task
+    meta = dict(meta, worker=worker_id, received=received, decode=decoded - start_time,
+                compute=computed - decoded, finished=time.time())
+    body = codec.encode_body('result', coords, [result], meta, **meta.get('codec', {}))
+    return body, result if cached is None else None
 
-        for message in messages:
-            # print(message.body)
-            operation, data = eval(message.body)
-            index, matrices = data
-            matrix_a, matrix_b = matrices
 
-            matrix_a = matrix_a.replace('  ', ' ').replace('  ', ',').replace('[ ', '[').replace(' ', ',')
-            matrix_b = matrix_b.replace('  ', ' ').replace('  ', ',').replace('[ ', '[').replace(' ', ',')
+def missing_blocks(body, worker_id):
+    """
+    Reply to a task referring to a block the worker does not hold, the driver sends the task again with its blocks
+    :return: completed future of the reply, as returned by process_task
+    """
+    operation, coords, _, meta = codec.decode_header(body)
+    print(f'Block {coords} refers to blocks missing from the store')
+    future = Future()
+    future.set_result((codec.encode_body('missing', coords, [], dict(meta, worker=worker_id)), None))
+    return future
 
-            matrix_a = np.array(literal_eval(matrix_a))
-            matrix_b = np.array(literal_eval(matrix_b))
 
-            if operation == 'addition':
-                result = helper.matrix_add(matrix_a, matrix_b)
-            elif operation == 'multiplication':
-                result = helper.matrix_dot_product(matrix_a, matrix_b)
-            else:
-                raise Exception("Unknown operation")
+def _put(stage_queue, item, stop):
+    """
+    Put an item on a bounded stage queue, waiting for room unless the worker is stopping
+    :return: True if the item was queued
+    """
+    while not stop.is_set():
+        try:
+            stage_queue.put(item, timeout=STAGE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(stage_queue, stop):
+    """
+    Take the next item of a stage queue, None once the worker is stopping
+    """
+    while not stop.is_set():
+        try:
+            return stage_queue.get(timeout=STAGE_POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return None
+
+
+def _run_stage(target, stop, errors, *args):
+    """
+    Run a stage thread, recording its error and stopping the other stages if it fails
+    """
+    try:
+        target(stop, *args)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+
 
-            print("Matrix 1: =>", matrix_a, "Matrix 2:", matrix_b, f"Result: {index} =>", result)
-            print(f'Message {(index + 1)} processed!')
-            response = [{"Id": f"{index + 1}", "MessageBody": str((index, helper.reformat_data(result)))}]
-            qh.send_message_to_queue(sqs, result_queue_name, response)
+def receive_stage(stop, receiver, received_batches, leases):
+    """
+    Prefetch batches of task messages, blocked by the bounded queue while the compute stage is behind
+    """
+    while not stop.is_set():
+        messages = receiver.receive()
+        if messages:
+            leases.hold(messages)
+            if not _put(received_batches, (messages, time.time()), stop):
+                return
+
+
+def lease_stage(stop, leases):
+    """
+    Renew the visibility timeout of the tasks held by the worker, from prefetch until their deletion
+    """
+    while not stop.wait(leases.interval / 2):
+        leases.renew()
+
+
+def send_stage(stop, sender, receiver, result_queue_name, computing_batches, cache, leases):
+    """
+    Send the results of every batch in the order it was received, then delete its task messages. The tasks of a batch
+    whose results could not all be sent are made visible again instead, to be computed again.
+    """
+    while True:
+        batch = _get(computing_batches, stop)
+        if batch is None:
+            return
+        messages, futures = batch
+        results = []
+        for future, key in futures:
+            body, result = future.result()
+            if key is not None and result is not None:
+                cache.put(key, result)
+            results.append({"Id": f"{len(results)}", "MessageBody": body})
+
+        sender.send(result_queue_name, results)
+        try:
+            sender.flush()
+        except Exception as e:
+            print(f"Sending results failed, {len(messages)} tasks left to be received again: {e}")
+            leases.release(messages)
+            receiver.extend(messages, 0)
+            continue
+        print(f"{len(results)} results sent to result queue")
+        receiver.delete(messages)  # Delete the messages from the queue
+        leases.release(messages)
+
+
+def perform_computation(sqs, worker_id, queue_name, result_queue_name, cache=None, processes=None, store=None):
+    """
+    Process tasks until a stage fails. A receiver thread prefetches batches of tasks, the tasks are decoded, computed
+    and encoded on a pool of processes and a sender thread sends the results and deletes the tasks. The stages are
+    joined by bounded queues, so a slow stage holds back the ones before it. A lease thread keeps the held tasks
+    invisible to the other workers however long they take.
+    :param cache: optional BlockCache of the block results, read and written by this process only
+    :param processes: size of the compute pool, the CPU count by default. One process computes on a thread instead.
+    :param store: optional BlockStore of the input blocks, for the tasks referring to blocks sent with earlier tasks
+    """
+    processes = processes or os.cpu_count() or 1
+    print(f"Worker {worker_id} started with {processes} compute processes")
+    receiver = qh.BatchReceiver(sqs, queue_name)
+    print("Queue url:", receiver.queue.url)
+    leases = qh.LeaseKeeper(receiver, int(receiver.queue.attributes.get('VisibilityTimeout',
+                                                                        DEFAULT_VISIBILITY_TIMEOUT)))
+
+    received_batches = queue.Queue(maxsize=PREFETCH_BATCHES)
+    # batches handed to the pool and not yet sent, enough to keep every process busy
+    computing_batches = queue.Queue(maxsize=processes + PREFETCH_BATCHES)
+    # retries the failed entries of the result batches, throttled ones included
+    sender = qh.BatchSender(sqs, max_workers=1)
+    stop = threading.Event()
+    errors = []
+    if processes > 1:
+        executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+    else:
+        executor = ThreadPoolExecutor(1)
+    stages = [threading.Thread(target=_run_stage, name=f'worker-{worker_id}-receive', daemon=True,
+                               args=(receive_stage, stop, errors, receiver, received_batches, leases)),
+              threading.Thread(target=_run_stage, name=f'worker-{worker_id}-send', daemon=True,
+                               args=(send_stage, stop, errors, sender, receiver, result_queue_name,
+                                     computing_batches, cache, leases)),
+              threading.Thread(target=_run_stage, name=f'worker-{worker_id}-lease', daemon=True,
+                               args=(lease_stage, stop, errors, leases))]
+    for stage in stages:
+        stage.start()
+    try:
+        while True:
+            batch = _get(received_batches, stop)
+            if batch is None:
+                break
+            messages, received = batch
+            futures = []
+            for message in messages:
+                meta = codec.decode_header(message.body).meta
+                # the driver sends the cache key of the task when caching is enabled
+                key = meta.get('cache_key') if cache is not None else None
+                cached = cache.get(key) if key is not None else None
+                blocks = None
+                # the blocks of a task are resolved in the order the tasks arrive, as the driver expects
+                if cached is None and 'block_keys' in meta:
+                    blocks = resolve_blocks(store, message.body, meta)
+                    if blocks is None:
+                        futures.append((missing_blocks(message.body, worker_id), None))
+                        continue
+                futures.append((executor.submit(process_task, message.body, worker_id, received, cached, blocks),
+                                key))
+            if not _put(computing_batches, (messages, futures), stop):
+                break
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        sender.close()
+    raise errors[0]
 
-            print(f"Message {(index + 1)} sent to result queue")
-            message.delete() # Delete the message from the queue
 
 if __name__ == "__main__":
     sqs = boto3.resource("sqs", region_name='us-east-1')
     agent_id = sys.argv[1]
+    # queue names default to the per-instance queues, the driver passes the shared queues in shared scheduling mode
+    queue_name = sys.argv[2] if len(sys.argv) > 2 else f"queue{agent_id}"
+    result_queue_name = sys.argv[3] if len(sys.argv) > 3 else f"result-queue-{agent_id}"
+    # the driver passes the size bound of the block cache when the workers keep one, 0 for none
+    cache = BlockCache(os.path.expanduser(CACHE_DIR), int(sys.argv[4])) if len(sys.argv) > 4 and int(sys.argv[4]) \
+        else None
+    # and the size bound of the block store after it
+    store = BlockStore(int(sys.argv[5])) if len(sys.argv) > 5 else None
 
-    try:
-        perform_computation(sqs, agent_id, queue_name=f"queue{agent_id}", result_queue_name=f"result-queue-{agent_id}")
-    except Exception as e:
-        print(f'Worker {agent_id} crash with error: {e}')
-        print('Restarting worker...')
-        perform_computation(sqs, agent_id, queue_name=f"queue{agent_id}", result_queue_name=f"result-queue-{agent_id}")
\ No newline at end of file
+    # the tasks held by a crashed worker are no longer renewed and come back to the queue after one visibility timeout
+    restarts = 0
+    while True:
+        try:
+            perform_computation(sqs, agent_id, queue_name=queue_name, result_queue_name=result_queue_name, cache=cache,
+                                store=store)
+        except Exception as e:
+            restarts += 1
+            delay = min(RESTART_BACKOFF_SECONDS * 2 ** (restarts - 1), MAX_RESTART_BACKOFF_SECONDS)
+            print(f'Worker {agent_id} crash with error: {e}')
+            print(f'Restarting worker in {delay}s...')
+            time.sleep(delay)